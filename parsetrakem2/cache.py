@@ -0,0 +1,203 @@
+"""
+cache.py
+
+Persistent geometry cache for TrakEM2 files.
+
+The cache is a directory next to the TrakEM2 file (e.g. data.xml.cache/)
+holding the layers, area list transforms, calibration and the path
+vertices of every (area list, layer) pair. Arrays are stored as .npy
+files and loaded memory-mapped, so opening the cache costs seconds even
+for whole-brain projects and several processes can share the pages.
+
+A cache is valid if it was written from a file with the same size and
+modification time. If only the modification time differs the content
+hash is compared before the cache is rejected. Stale caches are rebuilt
+by ParseTrakEM2.
+
+Required 3rd party packages:
+  numpy
+
+"""
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+from parsetrakem2.geometry import decode_paths
+
+VERSION = 1
+META = 'meta.json'
+ARRAYS = ['coords','offsets','key_offsets']
+
+def cache_dir(trakem2):
+    """
+    Returns the cache directory for the trakem2 file
+    """
+    return trakem2 + '.cache'
+
+def file_hash(fname,block_size=1<<24):
+    """
+    Returns the sha1 hex digest of the file content
+    """
+    h = hashlib.sha1()
+    with open(fname,'rb') as fin:
+        for block in iter(lambda: fin.read(block_size),b''):
+            h.update(block)
+    return h.hexdigest()
+
+def file_key(fname):
+    """
+    Returns the size, mtime and content hash of fname as a dictionary
+    """
+    st = os.stat(fname)
+    return {'size':st.st_size,'mtime':st.st_mtime_ns,'sha1':file_hash(fname)}
+
+def check_key(fname,meta):
+    """
+    Returns True if meta, the output of file_key(), still matches fname.
+
+    The content hash is only computed when the size matches but the
+    modification time does not, e.g. after the file was copied. In that
+    case meta['mtime'] is updated in place.
+    """
+    st = os.stat(fname)
+    if meta['size'] != st.st_size: return False
+    if meta['mtime'] == st.st_mtime_ns: return True
+    if meta['sha1'] != file_hash(fname): return False
+    meta['mtime'] = st.st_mtime_ns
+    return True
+
+def is_valid(trakem2,meta):
+    """
+    Returns True if the cache meta data matches the trakem2 file.
+    See check_key().
+    """
+    if meta.get('version') != VERSION: return False
+    mtime = meta['mtime']
+    if not check_key(trakem2,meta): return False
+    if meta['mtime'] != mtime: _write_meta(cache_dir(trakem2),meta)
+    return True
+
+def _write_meta(dname,meta):
+    tmp = os.path.join(dname,META + '.tmp')
+    with open(tmp,'w') as fout:
+        json.dump(meta,fout)
+    os.replace(tmp,os.path.join(dname,META))
+
+def write_cache(P,key):
+    """
+    Writes the geometry of a streamed ParseTrakEM2 object to its cache
+
+    Parameters
+    ----------
+    P : ParseTrakEM2(object)
+      Must have been loaded in streaming mode
+    key : dict
+      Output of file_key() taken before P was loaded
+    """
+    dname = cache_dir(P.trakem2)
+    tmp = '%s.tmp%d' %(dname,os.getpid())
+    if os.path.isdir(tmp): shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    path_keys,coords,lengths,key_offsets = [],[],[],[0]
+    for (k,paths) in P._paths.items():
+        path_keys.append(list(k))
+        _coords,_offsets,_ = decode_paths(paths)
+        coords.append(_coords)
+        lengths.append(np.diff(_offsets))
+        key_offsets.append(key_offsets[-1] + len(_offsets) - 1)
+    coords = np.concatenate(coords) if coords else np.zeros((0,2))
+    offsets = np.zeros(key_offsets[-1] + 1,dtype=np.int64)
+    if lengths: np.cumsum(np.concatenate(lengths),out=offsets[1:])
+    np.save(os.path.join(tmp,'coords.npy'),coords)
+    np.save(os.path.join(tmp,'offsets.npy'),offsets)
+    np.save(os.path.join(tmp,'key_offsets.npy'),np.array(key_offsets,dtype=np.int64))
+
+    meta = dict(key)
+    meta['version'] = VERSION
+    meta['layer_set'] = P._layer_set
+    meta['calibration'] = P._calibration
+    meta['t2_layers'] = P._t2_layers
+    meta['t2_patches'] = P._t2_patches
+    meta['t2_area_lists'] = P._t2_area_lists
+    meta['path_keys'] = path_keys
+    _write_meta(tmp,meta)
+    _install(tmp,dname,P.trakem2)
+
+def _installed(dname,trakem2):
+    """
+    Returns True if dname holds a valid cache of trakem2
+    """
+    try:
+        with open(os.path.join(dname,META),'r') as fin:
+            return is_valid(trakem2,json.load(fin))
+    except (IOError,ValueError,KeyError):
+        return False
+
+def _install(tmp,dname,trakem2,attempts=3):
+    """
+    Moves the cache written to tmp into place.
+
+    The old cache is renamed out of the way before tmp is renamed to 
+    dname, so readers never see a partly deleted cache. If another 
+    process installs its cache in between and that cache is valid, tmp 
+    is discarded.
+    """
+    old = '%s.old%d' %(dname,os.getpid())
+    for i in range(attempts):
+        if os.path.isdir(old): shutil.rmtree(old)
+        try:
+            os.rename(dname,old)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(tmp,dname)
+            done = True
+        except OSError:
+            done = False
+        shutil.rmtree(old,ignore_errors=True)
+        if done: return
+        #Another writer installed its cache after the old one was moved
+        if _installed(dname,trakem2): break
+    shutil.rmtree(tmp,ignore_errors=True)
+
+def load_cache(P):
+    """
+    Loads the geometry of P.trakem2 from its cache.
+
+    Parameters
+    ----------
+    P : ParseTrakEM2(object)
+
+    Returns
+    -------
+    bool : True if a valid cache was loaded, False otherwise
+    """
+    dname = cache_dir(P.trakem2)
+    try:
+        with open(os.path.join(dname,META),'r') as fin:
+            meta = json.load(fin)
+        if not is_valid(P.trakem2,meta): return False
+        arrays = dict((a,np.load(os.path.join(dname,a + '.npy'),mmap_mode='r'))
+                      for a in ARRAYS)
+    except (IOError,ValueError,KeyError):
+        return False
+
+    to_tuples = lambda lst: [tuple(l) for l in lst]
+    P._layer_set = tuple(meta['layer_set'])
+    P._calibration = meta['calibration'] and tuple(meta['calibration'])
+    P._t2_layers = to_tuples(meta['t2_layers'])
+    P._t2_patches = to_tuples(meta['t2_patches'])
+    P._t2_area_lists = to_tuples(meta['t2_area_lists'])
+
+    #Plain ndarray views of the memory map can be pickled by dill
+    coords = arrays['coords'].view(np.ndarray)
+    offsets = arrays['offsets'].tolist()
+    key_offsets = arrays['key_offsets'].tolist()
+    P._paths = {}
+    for (i,k) in enumerate(meta['path_keys']):
+        P._paths[tuple(k)] = [coords[offsets[j]:offsets[j+1]]
+                              for j in range(key_offsets[i],key_offsets[i+1])]
+    return True
@@ -0,0 +1,663 @@
+"""
+geometry.py
+
+Vectorized geometry routines shared by the parsetrakem2 modules.
+
+Required 3rd party packages:
+  numpy
+  scipy
+
+"""
+import numpy as np
+import scipy.ndimage
+from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
+
+def decode_paths(paths,dtype=np.float64):
+    """
+    Decodes a batch of TrakEM2 t2_path/@d strings in one call.
+
+    Paths have the form 'M x y L x y ... z' and may hold several subpaths
+    'M ... z M ... z'. Each subpath is returned as a separate polygon.
+
+    Parameters
+    ----------
+    paths : list
+      List of path strings
+    dtype : numpy dtype, Optional, default numpy.float64
+      dtype of the returned coordinates. Integer dtypes truncate.
+
+    Returns
+    -------
+    coords : numpy.ndarray
+      Contiguous (n,2) array of the vertices of all subpaths
+    offsets : numpy.ndarray
+      Polygon k is coords[offsets[k]:offsets[k+1]]
+    source : numpy.ndarray
+      Index into paths of the string each polygon was read from
+    """
+    counts = [p.count('M') for p in paths]
+    data = ' '.join(paths)
+    data = data.replace('M','nan nan').replace('L',' ')
+    data = data.replace('z',' ').replace('Z',' ').replace(',',' ')
+    coords = np.fromstring(data,dtype=np.float64,sep=' ').reshape(-1,2)
+    starts = np.flatnonzero(np.isnan(coords[:,0]))
+    offsets = np.append(starts - np.arange(len(starts)),
+                        len(coords) - len(starts))
+    coords = coords[~np.isnan(coords[:,0])].astype(dtype,copy=False)
+    source = np.repeat(np.arange(len(paths)),counts)
+    return coords,offsets,source
+
+def decode_path(path,dtype=np.float64):
+    """
+    Decodes a single t2_path/@d string
+
+    Returns
+    -------
+    subpaths : list
+      List of (n,2) arrays, one per subpath, sharing one contiguous buffer
+    """
+    coords,offsets,_ = decode_paths([path],dtype=dtype)
+    return np.split(coords,offsets[1:-1])
+
+def format_numbers(x):
+    """
+    Returns the numbers in x as strings. Integral values are written
+    without a decimal point, other values with the shortest repr.
+    """
+    x = np.asarray(x,dtype=np.float64)
+    r = np.round(x)
+    return np.where(x == r,r.astype(np.int64).astype(str),x.astype(str))
+
+def encode_paths(coords,offsets,source=None,num=None):
+    """
+    Formats polygons as TrakEM2 t2_path/@d strings, the inverse of 
+    decode_paths()
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+      (n,2) array of the vertices of all polygons
+    offsets : numpy.ndarray
+      Polygon k is coords[offsets[k]:offsets[k+1]]
+    source : numpy.ndarray, Optional
+      Non decreasing index of the path string of each polygon. Polygons 
+      of the same path become subpaths 'M ... z M ... z'. Defaults to one
+      path per polygon.
+    num : int, Optional
+      Number of path strings. Defaults to source.max() + 1.
+
+    Returns
+    -------
+    paths : list
+      List of num path strings. Paths without polygons are empty.
+    """
+    npoly = len(offsets) - 1
+    if source is None: source = np.arange(npoly)
+    if num is None: num = int(source.max()) + 1 if npoly else 0
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    first = np.zeros(len(coords),dtype=bool)
+    first[offsets[:-1][nonempty]] = True
+    #Tokens 'M x y L x y ... z' of all polygons in one array
+    tokens = np.column_stack([np.where(first,'M','L'),format_numbers(coords)]).ravel()
+    tokens = np.insert(tokens,3*offsets[1:][nonempty],'z')
+    tstart = 3*offsets + np.r_[0,np.cumsum(nonempty)]
+    bounds = tstart[np.searchsorted(source,np.arange(num + 1))]
+    tokens = tokens.tolist()
+    return [' '.join(tokens[a:b]) for (a,b) in zip(bounds[:-1],bounds[1:])]
+
+def clip_polygons(coords,offsets,rect):
+    """
+    Clips polygons to a rectangle with the Sutherland-Hodgman algorithm
+
+    Each side of the rectangle clips all polygons at once. Clipped 
+    polygons stay closed, the parts outside are replaced by the
+    rectangle border. Polygons entirely outside become empty.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+      (n,2) array of the vertices of all polygons
+    offsets : numpy.ndarray
+      Polygon k is coords[offsets[k]:offsets[k+1]]
+    rect : list
+      [xmin,ymin,xmax,ymax], the border is inside
+
+    Returns
+    -------
+    (coords,offsets) : float64 vertices and offsets of the clipped polygons
+    """
+    (xmin,ymin,xmax,ymax) = rect
+    coords = np.asarray(coords,dtype=np.float64)
+    offsets = np.asarray(offsets,dtype=np.int64)
+    for (axis,bound,sign) in [(0,xmin,1),(0,xmax,-1),(1,ymin,1),(1,ymax,-1)]:
+        if not len(coords): break
+        inside = sign*(coords[:,axis] - bound) >= 0
+        if inside.all(): continue
+        prv = previous_vertex(offsets)
+        p = coords[prv]
+        cross = inside != inside[prv]
+        #Intersection of each crossing edge with the border
+        t = np.zeros(len(coords))
+        t[cross] = ((bound - p[cross,axis]) 
+                    / (coords[cross,axis] - p[cross,axis]))
+        I = p + t[:,None]*(coords - p)
+        I[:,axis] = bound
+        #Each vertex emits the intersection of its incoming edge, if any,
+        #followed by itself if it is inside
+        emit = np.column_stack([cross,inside])
+        coords = np.stack([I,coords],axis=1)[emit]
+        counts = np.bincount(polygon_index(offsets),weights=emit.sum(axis=1),
+                             minlength=len(offsets) - 1).astype(np.int64)
+        offsets = np.zeros(len(counts) + 1,dtype=np.int64)
+        np.cumsum(counts,out=offsets[1:])
+    return coords,offsets
+
+def polygon_index(offsets):
+    """
+    Returns the polygon index of every vertex described by offsets
+    """
+    return np.repeat(np.arange(len(offsets) - 1),np.diff(offsets))
+
+def next_vertex(offsets):
+    """
+    Returns the index of the next vertex of every vertex, wrapping the
+    last vertex of each polygon back to its first
+    """
+    nxt = np.arange(1,offsets[-1] + 1)
+    nonempty = offsets[1:] > offsets[:-1]
+    nxt[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+    return nxt
+
+def previous_vertex(offsets):
+    """
+    Returns the index of the previous vertex of every vertex, wrapping the
+    first vertex of each polygon back to its last
+    """
+    prv = np.arange(-1,offsets[-1] - 1)
+    nonempty = offsets[1:] > offsets[:-1]
+    prv[offsets[:-1][nonempty]] = offsets[1:][nonempty] - 1
+    return prv
+
+def polygon_areas(coords,offsets):
+    """
+    Returns the area enclosed by each polygon
+
+    Same definition as Boundary.set_area(), evaluated for all polygons
+    at once.
+    """
+    nxt = next_vertex(offsets)
+    prev = np.empty_like(nxt)
+    prev[nxt] = np.arange(len(nxt))
+    terms = ((coords[prev,0] + coords[:,0])*(coords[prev,1] - coords[:,1]))
+    area = np.bincount(polygon_index(offsets),weights=terms,
+                       minlength=len(offsets) - 1)
+    return 0.5*np.abs(area)
+
+def fill_boundary_gaps(coords,offsets):
+    """
+    Fills the gaps between consecutive vertices of each polygon
+
+    Vectorized form of Boundary.fill_boundary_gaps(). Horizontal edges
+    are filled one pixel per column, all other edges one pixel per row.
+    Points are produced in the same order as the per-boundary method.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+      (n,2) array of polygon vertices
+    offsets : numpy.ndarray
+      Polygon k is coords[offsets[k]:offsets[k+1]]
+
+    Returns
+    -------
+    pixels : numpy.ndarray
+      (m,2) int32 array of boundary pixels
+    offsets : numpy.ndarray
+      Boundary k is pixels[offsets[k]:offsets[k+1]]
+    """
+    c1 = np.asarray(coords,dtype=np.float64)
+    c2 = c1[next_vertex(offsets)]
+    horiz = c2[:,1] == c1[:,1]
+    swap = np.where(horiz,c2[:,0] < c1[:,0],c2[:,1] < c1[:,1])
+    p0 = np.where(swap[:,None],c2,c1)
+    p1 = np.where(swap[:,None],c1,c2)
+    axis = np.where(horiz,0,1)
+    rows = np.arange(len(c1))
+    start = np.trunc(p0[rows,axis])
+    count = (np.trunc(p1[rows,axis]) - start + 1).astype(np.int64)
+    dy = np.where(horiz,1,c2[:,1] - c1[:,1])
+    m = (c2[:,0] - c1[:,0]) / dy
+
+    first = np.cumsum(count) - count
+    t = np.repeat(start - first,count) + np.arange(count.sum())
+    horiz = np.repeat(horiz,count)
+    m = np.repeat(m,count)
+    p0 = np.repeat(p0,count,axis=0)
+    x = np.trunc(np.trunc(m*(t - p0[:,1])) + p0[:,0])
+    y = t
+    x[horiz] = t[horiz]
+    y[horiz] = np.trunc(p0[horiz,1])
+
+    pixels = np.empty((len(t),2),dtype=np.int32)
+    pixels[:,0] = x
+    pixels[:,1] = y
+    lengths = np.add.reduceat(count,offsets[:-1]) if len(count) else count
+    new_offsets = np.zeros(len(offsets),dtype=np.int64)
+    np.cumsum(lengths,out=new_offsets[1:])
+    return pixels,new_offsets
+
+def bounding_boxes(coords,offsets):
+    """
+    Returns the bounding box of each non-empty polygon as an (n,4) array
+    with columns [xmin,ymin,xmax,ymax]
+    """
+    start = offsets[:-1]
+    bbox = np.empty((len(start),4),dtype=coords.dtype)
+    bbox[:,:2] = np.minimum.reduceat(coords,start,axis=0)
+    bbox[:,2:] = np.maximum.reduceat(coords,start,axis=0)
+    return bbox
+
+def scale_bounding_boxes(bbox,scale):
+    """
+    Scales bounding boxes about their centers
+
+    Vectorized form of Boundary.scale_bounding_box()
+    """
+    width = bbox[:,2] - bbox[:,0] + 1
+    height = bbox[:,3] - bbox[:,1] + 1
+    xradius = np.ceil(scale * (width / 2))
+    yradius = np.ceil(scale * (height / 2))
+    scaled = np.empty_like(bbox)
+    scaled[:,0] = np.trunc(np.maximum(0,bbox[:,0] - xradius))
+    scaled[:,1] = np.trunc(np.maximum(0,bbox[:,1] - yradius))
+    scaled[:,2] = np.trunc(bbox[:,2] + xradius)
+    scaled[:,3] = np.trunc(bbox[:,3] + yradius)
+    return scaled
+
+def overlapping_pairs(bbox,group=None):
+    """
+    Returns all pairs of overlapping bounding boxes
+
+    Sort-based sweep and prune: boxes are sorted by xmin and each box is
+    only tested against the boxes that start before its xmax, so the
+    work grows with the number of x-overlapping pairs rather than with
+    the square of the number of boxes.
+
+    Parameters
+    ----------
+    bbox : numpy.ndarray
+      (n,4) array of bounding boxes with columns [xmin,ymin,xmax,ymax]
+    group : numpy.ndarray, Optional
+      Group label of each box. Pairs from the same group are dropped.
+
+    Returns
+    -------
+    I,J : numpy.ndarray
+      Indices of overlapping boxes with I < J. Pairs are sorted by (I,J),
+      or by the groups of I and J first if group is given, with groups
+      ranked by their first box.
+    """
+    n = len(bbox)
+    order = np.argsort(bbox[:,0],kind='stable')
+    xmin = bbox[order,0]
+    end = np.searchsorted(xmin,bbox[order,2],side='right')
+    count = np.maximum(end - np.arange(1,n + 1),0)
+    a = np.repeat(np.arange(n),count)
+    first = np.cumsum(count) - count
+    b = a + 1 + np.arange(count.sum()) - np.repeat(first,count)
+    I = order[a]
+    J = order[b]
+    keep = (bbox[J,1] <= bbox[I,3]) & (bbox[I,1] <= bbox[J,3])
+    I,J = I[keep],J[keep]
+    (I,J) = (np.minimum(I,J),np.maximum(I,J))
+    if group is None:
+        idx = np.lexsort((J,I))
+    else:
+        (_,first,inverse) = np.unique(group,return_index=True,
+                                      return_inverse=True)
+        rank = first[inverse]
+        keep = rank[I] != rank[J]
+        I,J = I[keep],J[keep]
+        idx = np.lexsort((J,I,rank[J],rank[I]))
+    return I[idx],J[idx]
+
+def boundary_adjacency(XA,XB,pixel_radius=10,TA=None,TB=None):
+    """
+    Returns the length of adjacency between the point sets XA and XB
+
+    The length is min(lA,lB), where lA is the number of points in XA
+    within pixel_radius of XB and lB the number of points in XB within 
+    pixel_radius of XA. If both k-d trees TA and TB are given they are 
+    queried, otherwise the full distance matrix is computed. Both give 
+    the same result.
+    """
+    if TA is not None and TB is not None:
+        lA = TB.query_ball_point(TA.data,pixel_radius,return_length=True)
+        lB = TA.query_ball_point(TB.data,pixel_radius,return_length=True)
+        return min(np.count_nonzero(lA),np.count_nonzero(lB))
+    Y = cdist(XA,XB,'euclidean') <= pixel_radius
+    return min(np.count_nonzero(Y.any(axis=1)),np.count_nonzero(Y.any(axis=0)))
+
+def pair_adjacency(coords,offsets,I,J,pixel_radius=10,engine='cdist',
+                   trees=None):
+    """
+    Returns the lengths of adjacency of the boundary pairs (I[k],J[k])
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+      (n,2) array of gap filled boundary pixels
+    offsets : numpy.ndarray
+      Boundary k is coords[offsets[k]:offsets[k+1]]
+    I,J : numpy.ndarray
+      Boundary indices of the pairs
+    pixel_radius : int
+      Points closer than the pixel radius are classified as adjacent
+    engine : str
+      'cdist' or 'kdtree'
+    trees : dict, Optional
+      k-d trees by boundary index, filled as they are built. Without it
+      each tree is built once per call. Pass the same dict to calls on 
+      the same coords and offsets to build each tree only once.
+
+    Returns
+    -------
+    adj : numpy.ndarray
+      int64 length of adjacency of each pair
+    """
+    if engine not in ('cdist','kdtree'):
+        raise ValueError('Unknown adjacency engine: %s' %engine)
+    if trees is None: trees = {}
+    def tree(i,X):
+        if i not in trees: trees[i] = cKDTree(X)
+        return trees[i]
+    adj = np.zeros(len(I),dtype=np.int64)
+    for (k,(i,j)) in enumerate(zip(np.asarray(I).tolist(),np.asarray(J).tolist())):
+        XA = coords[offsets[i]:offsets[i+1]]
+        XB = coords[offsets[j]:offsets[j+1]]
+        if engine == 'kdtree':
+            adj[k] = boundary_adjacency(XA,XB,pixel_radius,
+                                        tree(i,XA),tree(j,XB))
+        else:
+            adj[k] = boundary_adjacency(XA,XB,pixel_radius)
+    return adj
+
+def pair_costs(offsets,I,J,engine='cdist'):
+    """
+    Returns the estimated cost of each boundary pair from its point counts
+
+    nA*nB for 'cdist' and (nA+nB)*log2(nA+nB) for 'kdtree'.
+    """
+    nA = np.diff(offsets)[I].astype(np.float64)
+    nB = np.diff(offsets)[J].astype(np.float64)
+    if engine == 'kdtree':
+        return (nA + nB) * np.log2(nA + nB + 1)
+    return nA * nB
+
+def partition_costs(cost,nchunks):
+    """
+    Splits consecutive items into ranges of about equal total cost
+
+    Parameters
+    ----------
+    cost : numpy.ndarray
+      Cost of each item
+    nchunks : int
+      Number of ranges to aim for. Items that straddle a cut are put in
+      a range of their own, so up to 2*nchunks - 1 ranges are returned.
+
+    Returns
+    -------
+    ranges : list
+      List of (start,stop) tuples sorted by decreasing total cost
+    """
+    if len(cost) == 0: return []
+    cum = np.cumsum(cost)
+    cuts = np.searchsorted(cum,cum[-1] / nchunks * np.arange(1,nchunks),
+                           side='right')
+    #The item that straddles a cut gets a range of its own
+    bounds = np.unique(np.r_[0,cuts,np.minimum(cuts + 1,len(cost)),len(cost)])
+    total = np.diff(np.r_[0,cum][bounds])
+    order = np.argsort(-total,kind='stable')
+    return [(int(bounds[k]),int(bounds[k+1])) for k in order]
+
+def rasterize_boundaries(coords,offsets,labels,out,origin=(0,0)):
+    """
+    Writes the filled boundaries into a label image
+
+    Each boundary is filled inside its own bounding box, so the cost
+    follows the boundary size and not the size of the image. Later
+    boundaries overwrite earlier ones where they overlap.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+      (n,2) int array of gap filled boundary pixels (x,y)
+    offsets : numpy.ndarray
+      Boundary k is coords[offsets[k]:offsets[k+1]]
+    labels : numpy.ndarray
+      Label written for each boundary
+    out : numpy.ndarray
+      2D label image, indexed out[y,x]
+    origin : tuple, Optional, default (0,0)
+      (x,y) image coordinate of out[0,0]
+    """
+    origin = np.asarray(origin)
+    for k in range(len(offsets) - 1):
+        p = coords[offsets[k]:offsets[k+1]] - origin
+        (x0,y0) = p.min(axis=0)
+        (x1,y1) = p.max(axis=0)
+        M = np.zeros((y1 - y0 + 3,x1 - x0 + 3),dtype=bool)
+        M[p[:,1] - y0 + 1,p[:,0] - x0 + 1] = True
+        M = scipy.ndimage.binary_fill_holes(M)[1:-1,1:-1]
+        out[y0:y1 + 1,x0:x1 + 1][M] = labels[k]
+
+def polygon_masks(vertices,offsets,origin=(0,0),order=None):
+    """
+    Generator of the filled mask of each polygon inside its bounding box
+
+    Each polygon is filled from its vertex array with an even-odd scanline
+    fill, so the cost follows the polygon size and not the image size.
+    Vertices are truncated to pixels. A pixel is filled if it lies on the
+    gap filled outline (see fill_boundary_gaps()) or if its center is
+    inside the polygon by the even-odd rule. For closed outlines without
+    gaps or self intersections, such as the pixel traced outlines of
+    TrakEM2 area lists, this is the same mask that
+    Boundary.get_global_display_matrix() computes by filling the holes
+    of the outline.
+
+    Parameters
+    ----------
+    vertices : numpy.ndarray
+      (n,2) array of polygon vertices (x,y)
+    offsets : numpy.ndarray
+      Polygon k is vertices[offsets[k]:offsets[k+1]]
+    origin : tuple, Optional, default (0,0)
+      (x,y) coordinate that becomes pixel (0,0)
+    order : list, Optional
+      Polygon indices in the order they are yielded. Defaults to all 
+      polygons in order.
+
+    Yields
+    ------
+    (k,x0,y0,M) : polygon index, pixel of M[0,0] and the boolean mask
+    """
+    offsets = np.asarray(offsets,dtype=np.int64)
+    num = len(offsets) - 1
+    if num < 1: return
+    v = np.trunc(np.asarray(vertices,dtype=np.float64) - origin)
+    (pix,poff) = fill_boundary_gaps(v,offsets)
+    
+    #Row crossings of all non horizontal edges, half open in y
+    w = v[next_vertex(offsets)]
+    e = np.flatnonzero(v[:,1] != w[:,1])
+    (p,q) = (v[e],w[e])
+    ylo = np.minimum(p[:,1],q[:,1])
+    nrows = (np.abs(q[:,1] - p[:,1])).astype(np.int64)
+    first = np.cumsum(nrows) - nrows
+    rows = np.repeat(ylo,nrows) + np.arange(nrows.sum()) - np.repeat(first,nrows)
+    slope = (q[:,0] - p[:,0]) / (q[:,1] - p[:,1])
+    cols = np.ceil(np.repeat(p[:,0],nrows) 
+                   + (rows - np.repeat(p[:,1],nrows)) * np.repeat(slope,nrows))
+    poly = np.repeat(polygon_index(offsets)[e],nrows)
+    cstart = np.searchsorted(poly,np.arange(num + 1))
+    
+    bbox = bounding_boxes(v,offsets).astype(np.int64)
+    if order is None: order = range(num)
+    for k in order:
+        (x0,y0,x1,y1) = bbox[k]
+        (h,w) = (y1 - y0 + 1,x1 - x0 + 1)
+        D = np.zeros((h,w + 1),dtype=np.int32)
+        c = slice(cstart[k],cstart[k+1])
+        np.add.at(D,((rows[c] - y0).astype(np.int64),
+                     (cols[c] - x0).astype(np.int64)),1)
+        M = (np.cumsum(D[:,:w],axis=1) & 1).astype(bool)
+        b = pix[poff[k]:poff[k+1]]
+        M[b[:,1] - y0,b[:,0] - x0] = True
+        yield (k,x0,y0,M)
+
+OVERLAP = ['last','first']
+
+def rasterize_polygons(vertices,offsets,labels,out,origin=(0,0),overlap='last'):
+    """
+    Writes filled polygons into a label image. Masks are computed with 
+    polygon_masks() and only the bounding box of each polygon is 
+    touched. Pixels outside of out are clipped.
+
+    Parameters
+    ----------
+    vertices : numpy.ndarray
+      (n,2) array of polygon vertices (x,y)
+    offsets : numpy.ndarray
+      Polygon k is vertices[offsets[k]:offsets[k+1]]
+    labels : numpy.ndarray
+      Label of each polygon, cast to the dtype of out. Raises ValueError
+      if a label does not fit in the integer dtype of out.
+    out : numpy.ndarray
+      2D label image, indexed out[y,x]
+    origin : tuple, Optional, default (0,0)
+      (x,y) image coordinate of out[0,0]
+    overlap : str, Optional, default 'last'
+      Where polygons overlap, 'last' keeps the label of the later
+      polygon and 'first' keeps the label of the earlier polygon. Labels
+      are never added, so a pixel always holds one polygon's label.
+    """
+    if overlap not in OVERLAP:
+        raise ValueError('Unknown overlap policy: %s' %overlap)
+    num = len(offsets) - 1
+    if num < 1: return
+    labels = np.broadcast_to(np.asarray(labels),(num,))
+    if np.issubdtype(out.dtype,np.integer):
+        info = np.iinfo(out.dtype)
+        if labels.max() > info.max or labels.min() < info.min:
+            raise ValueError('Labels %d to %d do not fit in %s' 
+                             %(labels.min(),labels.max(),out.dtype))
+    labels = labels.astype(out.dtype)
+    #Earlier polygons win if they are written last
+    order = range(num - 1,-1,-1) if overlap == 'first' else None
+    (height,width) = out.shape
+    for (k,x0,y0,M) in polygon_masks(vertices,offsets,origin=origin,order=order):
+        (y1,x1) = (y0 + M.shape[0],x0 + M.shape[1])
+        (cy0,cy1) = (max(y0,0),min(y1,height))
+        (cx0,cx1) = (max(x0,0),min(x1,width))
+        if cy0 >= cy1 or cx0 >= cx1: continue
+        M = M[cy0 - y0:cy1 - y0,cx0 - x0:cx1 - x0]
+        out[cy0:cy1,cx0:cx1][M] = labels[k]
+
+def disk_offsets(radius):
+    """
+    Returns the (dx,dy) offsets of all pixels within radius of the origin
+    """
+    r = int(np.floor(radius))
+    (dy,dx) = np.mgrid[-r:r + 1,-r:r + 1]
+    inside = dx**2 + dy**2 <= radius**2
+    return dx[inside],dy[inside]
+
+def raster_adjacency(coords,offsets,group=None,pixel_radius=10,
+                     chunk_size=1<<14):
+    """
+    Returns the adjacency of every pair of boundaries in a layer
+
+    All filled boundaries are rasterized into one label image. For every
+    boundary pixel of boundary a, the labels found within pixel_radius
+    (a dilation of the label image by a disk) are collected. l(a,b) is
+    the number of distinct boundary pixels of a that see label b, and
+    the adjacency of a and b is min(l(a,b),l(b,a)).
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+      (n,2) int array of gap filled boundary pixels (x,y)
+    offsets : numpy.ndarray
+      Boundary k is coords[offsets[k]:offsets[k+1]]
+    group : numpy.ndarray, Optional
+      Group label of each boundary. Pairs from the same group are dropped.
+    pixel_radius : float
+      Pixels within this distance are classified as adjacent.
+    chunk_size : int
+      Number of boundary pixels gathered at a time. Bounds memory.
+
+    Returns
+    -------
+    I,J,adj : numpy.ndarray
+      Boundary indices with I < J and their adjacency (> 0), sorted by (I,J)
+    """
+    num = len(offsets) - 1
+    if num < 2 or len(coords) == 0:
+        empty = np.zeros(0,dtype=np.int64)
+        return empty,empty,empty
+    r = int(np.ceil(pixel_radius))
+    origin = coords.min(axis=0) - r
+    (w,h) = coords.max(axis=0) - origin + r + 1
+    image = np.zeros((h,w),dtype=np.int32)
+    rasterize_boundaries(coords,offsets,np.arange(1,num + 1),image,origin)
+
+    #Only boundaries with a bounding box within reach of another group
+    bbox = bounding_boxes(coords,offsets).astype(np.int64)
+    bbox[:,:2] -= r
+    bbox[:,2:] += r
+    (I,J) = overlapping_pairs(bbox,group)
+    near = np.zeros(num,dtype=bool)
+    near[I] = True
+    near[J] = True
+
+    #Distinct boundary pixels of each boundary
+    owner = polygon_index(offsets)
+    pix = coords - origin
+    (owner,pix) = (owner[near[owner]],pix[near[owner]])
+    key = owner * (w*h) + pix[:,1].astype(np.int64) * w + pix[:,0]
+    key = np.unique(key)
+    owner = key // (w*h)
+    pix = key % (w*h)
+    (py,px) = (pix // w,pix % w)
+
+    (dx,dy) = disk_offsets(pixel_radius)
+    pairs = []
+    for i in range(0,len(key),chunk_size):
+        sl = slice(i,i + chunk_size)
+        nb = image[py[sl,None] + dy,px[sl,None] + dx]
+        row = np.repeat(np.arange(nb.shape[0]),nb.shape[1]).reshape(nb.shape)
+        own = owner[sl,None] + 1
+        hit = (nb > 0) & (nb != own)
+        seen = np.unique(row[hit].astype(np.int64) * (num + 1) + nb[hit])
+        a = owner[sl][seen // (num + 1)]
+        b = seen % (num + 1) - 1
+        pairs.append(a * num + b)
+    pairs = np.concatenate(pairs) if pairs else np.zeros(0,dtype=np.int64)
+    (pairs,count) = np.unique(pairs,return_counts=True)
+    (a,b) = (pairs // num,pairs % num)
+
+    #Symmetric minimum of the two directed counts
+    forward = a < b
+    (I,J,lab) = (a[forward],b[forward],count[forward])
+    reverse = J * num + I
+    pos = np.minimum(np.searchsorted(pairs,reverse),len(pairs) - 1)
+    lba = np.where(pairs[pos] == reverse,count[pos],0)
+    adj = np.minimum(lab,lba)
+    keep = adj > 0
+    if group is not None:
+        group = np.asarray(group)
+        keep &= group[I] != group[J]
+    return I[keep],J[keep],adj[keep]
@@ -0,0 +1,226 @@
+"""
+index.py
+
+Byte offset index for random access to TrakEM2 files.
+
+The index is a JSON file next to the TrakEM2 file (e.g. data.xml.index)
+holding the byte ranges of the project section, of every t2_layer and
+of every t2_area_list. A single area list can be read and parsed on its
+own, and a tree that holds only a few area lists is put together from
+the byte ranges around the others, without parsing the rest.
+
+The index is built by scanning the memory-mapped file for the start and
+end tags, without parsing it. Like the geometry cache it stays valid
+while the file has the same size and modification time, or the same
+content hash, and is rebuilt otherwise.
+
+Required 3rd party packages:
+  lxml
+
+"""
+import os
+import re
+import json
+import mmap
+import lxml.etree as etree
+
+from parsetrakem2.cache import file_key, check_key
+
+VERSION = 2
+#Whole start or end tag. Quoted attribute values may contain '>'.
+TAG_RE = re.compile(rb'<(/?)(project|t2_layer|t2_area_list)(?=[\s/>])'
+                    rb'(?:[^"\'>]|"[^"]*"|\'[^\']*\')*>')
+ENCODING_RE = re.compile(rb'<\?xml[^>]*encoding=["\']([\w.:-]+)["\']')
+
+def index_file(trakem2):
+    """
+    Returns the index file for the trakem2 file
+    """
+    return trakem2 + '.index'
+
+class TrakEM2Index(object):
+    """
+    Class used to read parts of a TrakEM2 file by byte offset
+
+    Attributes
+    ----------
+    trakem2 : str
+      Path to trakem2 file
+    encoding : str
+      Encoding from the xml declaration, used to parse fragments
+    project : list
+      [start,end] byte range of the project element
+    layers : list
+      [oid,start,end] of every t2_layer, in file order
+    area_lists : list
+      [title,oid,start,end] of every t2_area_list, in file order
+
+    Methods
+    -------
+    read(start,end)
+      Returns the bytes start to end of the file
+
+    get_area_list(title)
+      Returns the t2_area_list element with title
+
+    get_layer(oid)
+      Returns the t2_layer element with oid
+
+    get_project()
+      Returns the project element
+
+    tree(cells,huge_tree=False)
+      Returns the tree of the file with only the area lists in cells
+    """
+    def __init__(self,trakem2,rebuild=False):
+        """
+        Parameters:
+        ----------
+        trakem2 : str
+           path to trakem2 file
+        rebuild : bool, Optional, default False
+           If True the index is rebuilt even if it is valid
+        """
+        self.trakem2 = trakem2
+        if rebuild or not self._load():
+            key = file_key(trakem2)
+            self._build()
+            self._write(key)
+        self._titles = {}
+        for (i,a) in enumerate(self.area_lists):
+            self._titles.setdefault(a[0],i)
+        self._oids = dict((l[0],i) for (i,l) in enumerate(self.layers))
+
+    def _load(self):
+        fname = index_file(self.trakem2)
+        try:
+            with open(fname,'r') as fin:
+                meta = json.load(fin)
+            if meta.get('version') != VERSION: return False
+            mtime = meta['mtime']
+            if not check_key(self.trakem2,meta): return False
+        except (IOError,ValueError,KeyError):
+            return False
+        self.encoding = meta['encoding']
+        self.project = meta['project']
+        self.layers = meta['layers']
+        self.area_lists = meta['area_lists']
+        if meta['mtime'] != mtime: self._write(meta)
+        return True
+
+    def _write(self,key):
+        meta = dict((k,key[k]) for k in ('size','mtime','sha1'))
+        meta.update({'version':VERSION,'encoding':self.encoding,
+                     'project':self.project,'layers':self.layers,
+                     'area_lists':self.area_lists})
+        fname = index_file(self.trakem2)
+        tmp = '%s.tmp%d' %(fname,os.getpid())
+        with open(tmp,'w') as fout:
+            json.dump(meta,fout)
+        os.replace(tmp,fname)
+
+    def _build(self):
+        self.project = None
+        self.layers = []
+        self.area_lists = []
+        open_tags = {}
+        with open(self.trakem2,'rb') as fin:
+            mm = mmap.mmap(fin.fileno(),0,access=mmap.ACCESS_READ)
+            try:
+                m = ENCODING_RE.match(mm[:1024])
+                self.encoding = m.group(1).decode() if m else 'UTF-8'
+                parser = etree.XMLParser(encoding=self.encoding)
+                for m in TAG_RE.finditer(mm):
+                    (close,tag) = m.groups()
+                    tag = tag.decode()
+                    (start,end) = m.span()
+                    if close:
+                        (start,attrib) = open_tags[tag].pop()
+                    else:
+                        stag = m.group(0)
+                        attrib = etree.fromstring(stag[:-1].rstrip(b'/') + b'/>',
+                                                  parser).attrib
+                        if not stag.endswith(b'/>'):
+                            open_tags.setdefault(tag,[]).append((start,attrib))
+                            continue
+                    self._add(tag,attrib,start,end)
+            finally:
+                mm.close()
+
+    def _add(self,tag,attrib,start,end):
+        if tag == 't2_area_list':
+            self.area_lists.append([attrib.get('title'),attrib.get('oid'),start,end])
+        elif tag == 't2_layer':
+            self.layers.append([attrib.get('oid'),start,end])
+        elif self.project is None:
+            self.project = [start,end]
+
+    def read(self,start,end):
+        """
+        Returns the bytes start to end of the file
+        """
+        with open(self.trakem2,'rb') as fin:
+            fin.seek(start)
+            return fin.read(end - start)
+
+    def _parse(self,start,end):
+        parser = etree.XMLParser(encoding=self.encoding,remove_blank_text=True,
+                                 huge_tree=True)
+        return etree.fromstring(self.read(start,end),parser)
+
+    def get_area_list(self,title):
+        """
+        Returns the first t2_area_list element with title, parsed on its
+        own. Raises KeyError if there is no such area list.
+        """
+        (_,_,start,end) = self.area_lists[self._titles[title]]
+        return self._parse(start,end)
+
+    def get_layer(self,oid):
+        """
+        Returns the t2_layer element with oid, parsed on its own. Raises
+        KeyError if there is no such layer.
+        """
+        (_,start,end) = self.layers[self._oids[oid]]
+        return self._parse(start,end)
+
+    def get_project(self):
+        """
+        Returns the project element, parsed on its own
+        """
+        return self._parse(*self.project)
+
+    def tree(self,cells,huge_tree=False):
+        """
+        Returns the tree of the file without the t2_area_list elements
+        whose title is not in cells. The byte ranges of the other area
+        lists are skipped, so only the kept area lists, the layers and the
+        project section are parsed. The project section is not filtered,
+        use tree.extract_area_lists() for that.
+
+        Parameters
+        ----------
+        cells : (list, str)
+          Area lists to keep
+        huge_tree : bool, Optional, default False
+          If loading a large file, use True
+
+        Returns
+        -------
+        tree : lxml.etree._ElementTree
+        """
+        if isinstance(cells,str): cells = [cells]
+        keep = set(cells)
+        pieces = []
+        pos = 0
+        with open(self.trakem2,'rb') as fin:
+            for (title,_,start,end) in self.area_lists:
+                if title in keep: continue
+                if start > pos:
+                    fin.seek(pos)
+                    pieces.append(fin.read(start - pos))
+                pos = end
+            fin.seek(pos)
+            pieces.append(fin.read())
+        parser = etree.XMLParser(remove_blank_text=True,huge_tree=huge_tree)
+        return etree.fromstring(b''.join(pieces),parser).getroottree()
@@ -0,0 +1,153 @@
+"""
+jobs.py
+
+Job manifest for resumable runs that write one output file per job.
+
+The manifest is a JSON file holding the run parameters and the status
+of every job. For finished jobs it records the output file, its size,
+modification time and sha1 checksum. The manifest is replaced atomically (temporary
+file, fsync, rename) whenever a job finishes, so it never refers to an
+output that was not completely written.
+
+On a rerun a job only counts as done if its output still exists with
+the recorded size and checksum. The checksum is only recomputed when the
+modification time differs from the recorded one, see cache.check_key().
+Outputs that were partially written, deleted or modified are redone. If
+the run parameters changed all jobs are redone and a warning is issued.
+
+The manifest is written by a single process. Workers write their output
+files and hand the result back to that process.
+
+Required 3rd party packages:
+  None
+
+"""
+import os
+import json
+import time
+import warnings
+
+from parsetrakem2.cache import file_hash, check_key
+
+VERSION = 1
+DONE = 'done'
+FAILED = 'failed'
+
+class JobManifest(object):
+    """
+    Class used to record the status of the jobs of a run
+
+    Attributes
+    ----------
+    fname : str
+      Path of the manifest. Output paths are stored relative to its
+      directory.
+    params : dict
+      Run parameters
+    jobs : dict
+      jobs[job] = dict with status, output, size, mtime, sha1 and any 
+      extra information passed to mark_done()
+    stale : bool
+      True if an existing manifest was discarded because it was written
+      with other parameters or another version
+
+    Methods
+    -------
+    is_done(job,verify=False)
+      Returns True if the output of job is complete
+
+    pending(jobs)
+      Returns the jobs that are not done
+
+    mark_done(job,output,sha1=None,**info)
+      Records a finished job
+
+    mark_failed(job,error)
+      Records a failed job
+    """
+    def __init__(self,fname,params):
+        self.fname = fname
+        self.params = params
+        self.jobs = {}
+        self.stale = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.fname,'r') as fin:
+                meta = json.load(fin)
+        except (IOError,ValueError):
+            return
+        if meta.get('version') != VERSION or meta.get('params') != self.params:
+            self.stale = True
+            warnings.warn('%s was written with other parameters, its %d jobs '
+                          'will be redone' %(self.fname,len(meta.get('jobs',{}))))
+            return
+        self.jobs = meta['jobs']
+
+    def _write(self):
+        meta = {'version':VERSION,'params':self.params,'jobs':self.jobs}
+        tmp = self.fname + '.tmp'
+        with open(tmp,'w') as fout:
+            json.dump(meta,fout,indent=1)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp,self.fname)
+
+    def output_path(self,output):
+        return os.path.join(os.path.dirname(self.fname),output)
+
+    def is_done(self,job,verify=False):
+        """
+        Returns True if job finished and its output still has the
+        recorded size and checksum. The checksum is only computed when
+        the modification time changed, or always if verify is True.
+        """
+        entry = self.jobs.get(job)
+        if entry is None or entry['status'] != DONE: return False
+        fname = self.output_path(entry['output'])
+        if not os.path.isfile(fname): return False
+        if verify or 'mtime' not in entry:
+            if os.path.getsize(fname) != entry['size']: return False
+            return file_hash(fname) == entry['sha1']
+        return check_key(fname,entry)
+
+    def pending(self,jobs):
+        """
+        Returns the jobs in jobs that are not done
+        """
+        return [j for j in jobs if not self.is_done(j)]
+
+    def mark_done(self,job,output,sha1=None,**info):
+        """
+        Records that job finished
+
+        Parameters
+        ----------
+        job : str
+          Job name
+        output : str
+          Output file, completely written
+        sha1 : str, Optional
+          Checksum of output. Computed if not given.
+        info :
+          Additional values stored with the job
+        """
+        if sha1 is None: sha1 = file_hash(output)
+        st = os.stat(output)
+        entry = dict(info)
+        entry.update({'status':DONE,
+                      'output':os.path.relpath(output,os.path.dirname(self.fname)),
+                      'size':st.st_size,
+                      'mtime':st.st_mtime_ns,
+                      'sha1':sha1,
+                      'time':time.time()})
+        self.jobs[job] = entry
+        self._write()
+
+    def mark_failed(self,job,error):
+        """
+        Records that job failed with error
+        """
+        self.jobs[job] = {'status':FAILED,'error':str(error),'time':time.time()}
+        self._write()
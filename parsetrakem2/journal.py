@@ -0,0 +1,172 @@
+"""
+journal.py
+
+Append-only, checkpointed storage of per-layer adjacency records.
+
+Records are appended to a tab separated journal (fout.journal), one
+layer at a time, and flushed to disk before the layer is marked as
+complete in the manifest (fout.manifest). The manifest is replaced
+atomically and holds the run parameters and the byte range of every
+completed layer. After a crash the journal is truncated to the last
+completed layer, so a run can be resumed with the same parameters
+without redoing completed layers.
+
+The journal is exported to the xml format of measure_adjacency.py or to
+a columnar table (see table.py) once, at the end of a run.
+
+Required 3rd party packages:
+  lxml
+
+"""
+import os
+import json
+from lxml import etree
+
+from parsetrakem2 import table as _table
+
+VERSION = 1
+
+class AdjacencyJournal(object):
+    """
+    Class used to checkpoint adjacency records layer by layer
+
+    Attributes
+    ----------
+    fout : str
+      Path of the xml output file
+    params : dict
+      Run parameters. A resumed run must have the same parameters.
+    completed : dict
+      completed[layer] = (start,stop) byte range in the journal
+
+    Methods
+    -------
+    write_layer(layer,records)
+      Appends the records of a layer and marks the layer as complete
+
+    read_layers()
+      Generator of (layer,records) for all completed layers
+
+    export_xml()
+      Writes the completed layers to fout
+
+    export_table(fname)
+      Writes the completed layers to a columnar table
+    """
+    def __init__(self,fout,params,resume=False):
+        self.fout = fout
+        self.params = params
+        self.journal = fout + '.journal'
+        self.manifest = fout + '.manifest'
+        self.completed = {}
+        if resume: self._load()
+        if not self.completed:
+            open(self.journal,'wb').close()
+            self._write_manifest()
+
+    def _load(self):
+        try:
+            with open(self.manifest,'r') as fin:
+                meta = json.load(fin)
+        except (IOError,ValueError):
+            return
+        if meta.get('version') != VERSION or meta['params'] != self.params:
+            return
+        completed = dict((l,(a,b)) for (l,a,b) in meta['layers'])
+        end = max([b for (a,b) in completed.values()] or [0])
+        if not os.path.isfile(self.journal) or os.path.getsize(self.journal) < end:
+            return
+        #Drop records written after the last checkpoint
+        with open(self.journal,'ab') as f:
+            f.truncate(end)
+        self.completed = completed
+
+    def _write_manifest(self):
+        meta = {'version':VERSION,'params':self.params,
+                'layers':[[l,a,b] for (l,(a,b)) in self.completed.items()]}
+        tmp = self.manifest + '.tmp'
+        with open(tmp,'w') as fout:
+            json.dump(meta,fout)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp,self.manifest)
+
+    def write_layer(self,layer,records):
+        """
+        Appends the records of a layer and marks the layer as complete
+
+        Parameters
+        ----------
+        layer : str
+          Layer name
+        records : list
+          List of (cell1,cell2,index1,index2,adjacency)
+        """
+        lines = ''.join('%s\t%s\t%s\t%d\t%d\t%d\n' %((layer,) + tuple(r))
+                        for r in records)
+        with open(self.journal,'ab') as f:
+            start = f.tell()
+            f.write(lines.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            stop = f.tell()
+        self.completed[layer] = (start,stop)
+        self._write_manifest()
+
+    def read_layers(self):
+        """
+        Generator of (layer,records) for all completed layers in the order
+        they were completed
+        """
+        with open(self.journal,'rb') as f:
+            for (layer,(start,stop)) in self.completed.items():
+                f.seek(start)
+                lines = f.read(stop - start).decode('utf-8').splitlines()
+                records = []
+                for line in lines:
+                    (_,cell1,cell2,index1,index2,adj) = line.split('\t')
+                    records.append((cell1,cell2,int(index1),int(index2),int(adj)))
+                yield layer,records
+
+    def export_xml(self):
+        """
+        Writes the completed layers to fout. Layers already in fout are
+        replaced, other layers are kept. fout is replaced atomically.
+        """
+        if os.path.isfile(self.fout):
+            root = etree.parse(self.fout).getroot()
+        else:
+            root = etree.Element('data')
+        for (layer,records) in self.read_layers():
+            xlayer = root.find("layer[@name='%s']" %layer)
+            if xlayer is not None: root.remove(xlayer)
+            xlayer = etree.SubElement(root,'layer')
+            xlayer.set('name',layer)
+            for (cell1,cell2,index1,index2,adj) in records:
+                xarea = etree.SubElement(xlayer,'area')
+                etree.SubElement(xarea,'cell1').text = cell1
+                etree.SubElement(xarea,'cell2').text = cell2
+                etree.SubElement(xarea,'index1').text = str(index1)
+                etree.SubElement(xarea,'index2').text = str(index2)
+                etree.SubElement(xarea,'adjacency').text = str(adj)
+        tmp = self.fout + '.tmp'
+        with open(tmp,'wb') as fout:
+            fout.write(etree.tostring(root,pretty_print=False))
+        os.replace(tmp,self.fout)
+
+    def export_table(self,fname):
+        """
+        Writes the completed layers to the columnar table fname. Rows of 
+        other layers already in fname are kept.
+        """
+        columns = _table.ADJACENCY_COLUMNS
+        records = []
+        if os.path.isfile(fname):
+            records = [r for r in _table.to_records(_table.load_table(fname),columns)
+                       if r[0] not in self.completed]
+        for (layer,_records) in self.read_layers():
+            records.extend((layer,) + r for r in _records)
+        T = _table.from_records(records,columns,
+                                categorical=['layer','cell1','cell2'],
+                                shared=['cell1','cell2'])
+        _table.write_table(fname,T)
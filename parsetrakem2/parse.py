@@ -12,11 +12,21 @@ Author: Christopher Brittin
 
 """
 import lxml.etree as etree
-import itertools
 import numpy as np
-from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 import scipy.ndimage
 
+from parsetrakem2 import cache as _cache
+from parsetrakem2 import geometry
+from parsetrakem2 import tree as _tree
+from parsetrakem2.index import TrakEM2Index
+
+#Area lists left out of the adjacency analysis
+EXCLUDE_CELLS = ['Pharynx','Phi_Marker']
+
+#Engines available to compute_adjacency()
+ENGINES = ['cdist','kdtree']
+
 class ParseTrakEM2(object):
     """
     Class used to represent a TrakEM2 file.
@@ -28,12 +38,19 @@ class ParseTrakEM2(object):
     trakem2 : str
        path to trakem2 file
     xml : etree.parse
-       Parsed object for trakem2 file
+       Parsed object for trakem2 file. None if the file was loaded
+       in streaming mode.
     layers : dictionary
        Dictionalary of layer objects,
        (key=layer name,value=Layer(object))
     area_lists : dictionary
        Dictionary of area lists, (key=cell name, value = AreaList(object))
+    cell_ids : dictionary
+       Integer id of each area list, (key=cell name, value = int)
+    occupancy : dictionary
+       Layers in which each area list has segments, 
+       (key=cell name, value = {layer oid: (segment count, bbox)}).
+       Built on first use by index_occupancy().
     dx : int
        transform applied to x
     dy : int
@@ -42,6 +59,27 @@ class ParseTrakEM2(object):
 
     Methods
     -------
+    stream_trakem2(huge_tree=False)
+      Reads the file with iterparse, keeping only the extracted geometry
+
+    index_paths()
+      Builds the (area list name, layer oid) -> path index
+
+    get_paths(area_list,layer_oid)
+      Returns the t2_path strings of an area list in a layer
+
+    index_occupancy()
+      Builds the cell -> {layer oid: (segment count, bbox)} table
+
+    get_occupancy(cell)
+      Returns the layers in which cell has segments, with counts and bbox
+
+    get_cell_layers(cell)
+      Returns the names of the layers in which cell has segments
+
+    get_layer_cells(layer)
+      Returns the cells with segments in layer
+
     get_layers()
       Assigns dictionary of Layer(objects) to self.layers
 
@@ -51,28 +89,42 @@ class ParseTrakEM2(object):
     set_fill(color,opacity=0.5)
       Changes the fill color for of area list. 
 
+    write_fill(fout,colors,opacity=0.5,header=None,huge_tree=False)
+      Writes a copy of the file with the fill colors changed
+
     get_calibration(self)
       Sets the transforms for self.dx and self.dy
 
+    get_layer_boundaries(layer,scale_bounding_box=1,area_thresh=200,**kwargs)
+      Returns a LayerBoundaries(object) for the area lists in layer.
+
     get_boundaries_in_layer(layer,scale_bounding_box=1,area_thresh=200,**kwargs)
       Returns a dictionary of boundaries for the area lists in layer.
 
     get_overlapping_boundiaries(boundaries)
       Returns list of boundaries with overlapping bounding boxes
 
+    get_overlapping_pairs(boundaries)
+      Returns index pairs of LayerBoundaries with overlapping bounding boxes
+
     is_boundary_overlap(A,B)
       returns True if boundaries A and B have overlapping bounding boxes.
 
-    compute_adjacency(A,B,pixel_radius=10)
+    compute_adjacency(A,B,pixel_radius=10,engine='cdist')
       return the length of adjacency (int) between boundaries A and B
 
-    batch_compute_adjacency(boundaries,pixel_radius=10)
+    batch_compute_adjacency(boundaries,pixel_radius=10,engine='cdist')
       returns lenth of adjacencies for a list of bondary pairs
 
+    compute_layer_adjacency(boundaries,pixel_radius=10)
+      returns the adjacencies of all boundary pairs in a layer from a
+      label image
+
     """
 
     
-    def __init__(self,trakem2,huge_tree=False):
+    def __init__(self,trakem2,huge_tree=False,streaming=False,cache=False,
+                 cells=None):
         """
         Parameters:
         ----------
@@ -80,16 +132,219 @@ class ParseTrakEM2(object):
            path to trakem2 file
         huge_tree : bool, Optional, default False
            If loading a large file, use True
+        streaming : bool, Optional, default False
+           If True, the file is read in a single iterparse pass and only
+           the layer, area list, calibration and path data are kept. The
+           XML tree is never built and self.xml is None.
+        cache : bool, Optional, default False
+           If True, the geometry is loaded from the on-disk cache next to
+           the trakem2 file. A missing or stale cache is rebuilt from a
+           streaming read. Implies streaming.
+        cells : list, Optional
+           If given, only the area lists in cells are parsed. They are 
+           read by byte offset with the index next to the trakem2 file
+           (see parsetrakem2.index), which is built on first use and 
+           rebuilt when the file changes. streaming and cache are ignored.
         """
         
         self.trakem2 = trakem2
-        parser = etree.XMLParser(remove_blank_text=True,huge_tree=huge_tree)
-        self.xml = etree.parse(trakem2,parser)
+        self.xml = None
         self.layers = None
         self.area_list = None
         self.dx = 0
         self.dy = 0
+        self._paths = None
+        self.occupancy = None
+        if cells is not None:
+            self.xml = TrakEM2Index(trakem2).tree(cells,huge_tree=huge_tree)
+        elif cache:
+            if not _cache.load_cache(self):
+                key = _cache.file_key(trakem2)
+                self.stream_trakem2(huge_tree=huge_tree)
+                _cache.write_cache(self,key)
+        elif streaming:
+            self.stream_trakem2(huge_tree=huge_tree)
+        else:
+            parser = etree.XMLParser(remove_blank_text=True,huge_tree=huge_tree)
+            self.xml = etree.parse(trakem2,parser)
+
+    def stream_trakem2(self,huge_tree=False):
+        """
+        Reads the trakem2 file with lxml.etree.iterparse. Only the data
+        needed by get_layers(), get_area_lists(), get_calibration() and
+        get_boundaries_in_layer() is kept. Elements are cleared as soon
+        as they have been read so peak memory is set by the extracted
+        geometry rather than by the XML tree.
+
+        Parameters
+        ----------
+        huge_tree : bool, Optional, default False
+           If loading a large file, use True
+        """
+        self._layer_set = None
+        self._calibration = None
+        self._t2_layers = []
+        self._t2_patches = []
+        self._t2_area_lists = []
+        self._paths = {}
+        context = etree.iterparse(self.trakem2,events=('start','end'),
+                                  remove_blank_text=True,huge_tree=huge_tree)
+        for (event,elem) in context:
+            tag = elem.tag
+            if event == 'start':
+                if tag == 't2_layer_set' and self._layer_set is None:
+                    self._layer_set = (elem.get('layer_width'),
+                                       elem.get('layer_height'))
+                continue
+            if tag == 't2_path':
+                area = elem.getparent()
+                area_list = area.getparent()
+                if area.tag == 't2_area' and area_list.tag == 't2_area_list':
+                    key = (area_list.get('title'),area.get('layer_id'))
+                    self._paths.setdefault(key,[]).append(elem.get('d'))
+            elif tag == 't2_patch':
+                self._t2_patches.append((elem.get('title'),
+                                         elem.get('transform'),
+                                         elem.get('width'),
+                                         elem.get('height')))
+            elif tag == 't2_layer':
+                self._t2_layers.append((elem.get('oid'),
+                                        elem.get('thickness'),
+                                        elem.get('z')))
+            elif tag == 't2_area_list':
+                self._t2_area_lists.append((elem.get('title'),
+                                            elem.get('transform')))
+            elif tag == 't2_calibration' and self._calibration is None:
+                self._calibration = (elem.get('pixelWidth'),
+                                     elem.get('pixelHeight'),
+                                     elem.get('pixelDepth'))
+            #Free the element and any siblings that have already been read
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+        del context
         
+    def index_paths(self):
+        """
+        Builds the path index in a single traversal of the XML tree.
+
+        self._paths is a dictionary 
+        (key=(area list name, layer oid), val=list of t2_path/@d strings)
+        Paths are kept in document order. In streaming mode the index is
+        filled while the file is read.
+        """
+        if self.xml is None: return
+        self._paths = {}
+        for area_list in self.xml.iter('t2_area_list'):
+            title = area_list.get('title')
+            for area in area_list.iterchildren('t2_area'):
+                key = (title,area.get('layer_id'))
+                paths = self._paths.setdefault(key,[])
+                for path in area.iterchildren('t2_path'):
+                    paths.append(path.get('d'))
+
+    def get_paths(self,area_list,layer_oid):
+        """
+        Returns the t2_path strings of an area list in a layer
+
+        Parameters
+        ----------
+        area_list : str
+          Area list name
+        layer_oid : str
+          TrakEM2 //t2_layer/@oid
+
+        Returns
+        -------
+        paths : list
+          List of t2_path/@d strings. Empty if the area list has no
+          paths in the layer.
+        """
+        if self._paths is None: self.index_paths()
+        return self._paths.get((area_list,layer_oid),[])
+
+    def index_occupancy(self):
+        """
+        Builds the occupancy table from the path index. 
+
+        self.occupancy is a dictionary 
+        (key=cell name, val={layer oid: (segment count, bbox)})
+        where bbox = (xmin,ymin,xmax,ymax) of the segment vertices in 
+        layer coordinates, as in get_layer_boundaries() but before the 
+        area threshold is applied. Only layers in which the cell has 
+        segments are listed. All paths are decoded in one call. Requires
+        get_area_lists().
+        """
+        if self._paths is None: self.index_paths()
+        keys = [k for k in self._paths if k[0] in self.area_lists]
+        paths = [p for k in keys for p in self._paths[k]]
+        path_key = np.repeat(np.arange(len(keys)),
+                             [len(self._paths[k]) for k in keys])
+        self.occupancy = {}
+        self._layer_cells = {}
+        if not paths: return
+        if isinstance(paths[0],str):
+            (coords,offsets,source) = geometry.decode_paths(paths)
+            poly_key = path_key[source]
+        else:
+            coords = np.concatenate(paths)
+            offsets = np.r_[0,np.cumsum([len(p) for p in paths])]
+            poly_key = path_key
+        nonempty = offsets[1:] > offsets[:-1]
+        poly_key = poly_key[nonempty]
+        bbox = geometry.bounding_boxes(coords,offsets[np.r_[nonempty,True]])
+        count = np.bincount(poly_key,minlength=len(keys))
+        occupied = np.flatnonzero(count)
+        start = np.searchsorted(poly_key,occupied)
+        lo = np.minimum.reduceat(bbox[:,:2],start,axis=0).tolist()
+        hi = np.maximum.reduceat(bbox[:,2:],start,axis=0).tolist()
+        for (i,k) in enumerate(occupied.tolist()):
+            (cell,oid) = keys[k]
+            (dx,dy) = self.area_lists[cell].transform
+            box = (lo[i][0] + dx,lo[i][1] + dy,hi[i][0] + dx,hi[i][1] + dy)
+            self.occupancy.setdefault(cell,{})[oid] = (int(count[k]),box)
+            self._layer_cells.setdefault(oid,[]).append(cell)
+
+    def get_occupancy(self,cell):
+        """
+        Returns the layers in which cell has segments
+
+        Parameters
+        ----------
+        cell : str
+          Area list name
+
+        Returns
+        -------
+        occupancy : dict
+          (key=layer oid, val=(segment count, (xmin,ymin,xmax,ymax))).
+          Empty if the cell has no segments.
+        """
+        if self.occupancy is None: self.index_occupancy()
+        return self.occupancy.get(cell,{})
+
+    def get_cell_layers(self,cell):
+        """
+        Returns the sorted names of the layers in which cell has segments.
+        Requires get_layers().
+        """
+        occ = self.get_occupancy(cell)
+        return sorted(n for (n,L) in self.layers.items() if L.oid in occ)
+
+    def get_layer_cells(self,layer):
+        """
+        Returns the sorted names of the cells with segments in layer
+
+        Parameters
+        ----------
+        layer : str
+          Layer name
+        """
+        if self.occupancy is None: self.index_occupancy()
+        return sorted(self._layer_cells.get(self.layers[layer].oid,[]))
+
     def get_layers(self):
         """
         Assigns dictionary of Layer(objects) to self.layers
@@ -98,16 +353,21 @@ class ParseTrakEM2(object):
         (key=layer name, val=Layer(object))
         """
         
-        layer_width = self.xml.xpath("//t2_layer_set/@layer_width")[0]
-        layer_height = self.xml.xpath("//t2_layer_set/@layer_height")[0]
+        if self.xml is None:
+            (layer_width,layer_height) = self._layer_set
+            (oid,thickness,z) = zip(*self._t2_layers)
+            (title,trans,width,height) = zip(*self._t2_patches)
+        else:
+            layer_width = self.xml.xpath("//t2_layer_set/@layer_width")[0]
+            layer_height = self.xml.xpath("//t2_layer_set/@layer_height")[0]
+            oid = self.xml.xpath("//t2_layer/@oid")
+            thickness = self.xml.xpath("//t2_layer/@thickness")
+            z = self.xml.xpath("//t2_layer/@z")
+            title = self.xml.xpath("//t2_patch/@title")
+            trans = self.xml.xpath("//t2_patch/@transform")
+            width = self.xml.xpath("//t2_patch/@width")
+            height = self.xml.xpath("//t2_patch/@height")
         self.layer_dim = [float(layer_width),float(layer_height)]        
-        oid = self.xml.xpath("//t2_layer/@oid")
-        thickness = self.xml.xpath("//t2_layer/@thickness")
-        z = self.xml.xpath("//t2_layer/@z")
-        title = self.xml.xpath("//t2_patch/@title")
-        trans = self.xml.xpath("//t2_patch/@transform")
-        width = self.xml.xpath("//t2_patch/@width")
-        height = self.xml.xpath("//t2_patch/@height")
         self.width = int(float(width[0]))
         self.height = int(float(height[0]))
         self.layers = {}
@@ -140,8 +400,11 @@ class ParseTrakEM2(object):
         self.area_lists is a dictionary 
         (key=cell name, val=AreaList(object))
         """
-        area_lists = self.xml.xpath("//t2_area_list/@title")
-        trans = self.xml.xpath("//t2_area_list/@transform")
+        if self.xml is None:
+            (area_lists,trans) = zip(*self._t2_area_lists)
+        else:
+            area_lists = self.xml.xpath("//t2_area_list/@title")
+            trans = self.xml.xpath("//t2_area_list/@transform")
         self.area_lists = {}
         for i in range(len(area_lists)):
             temp = trans[i].split(',')
@@ -155,11 +418,18 @@ class ParseTrakEM2(object):
             self.area_lists[A.name] = A
         if 'area_list' in self.area_lists.keys():
             del self.area_lists['area_list']
+        self.cell_ids = dict((n,i) for (i,n) in enumerate(self.area_lists))
 
     def set_fill(self,colors,opacity=0.5):
         """
         Changes the fill color for of area list. 
-        
+
+        The styles of all area lists are set in a single sweep of the
+        tree. Use write_fill() if the file was loaded in streaming mode.
+
+        Raises KeyError if a name in colors has no area list in the
+        file. The styles of the other area lists are still set.
+
         Parameters
         ----------
         colors : list
@@ -173,29 +443,117 @@ class ParseTrakEM2(object):
           Opacity of the fill. (default is 0.5)
         
         """
-        root = self.xml.getroot()
-        for col in colors:
-            if len(col) == 3:
-                (neuron,color,_opacity) = col
-            else:
-                (neuron,color) = col
-                _opacity = opacity
-            area_list = root.find(".//t2_area_list[@title='%s']" %neuron)
-            style = ("stroke:none;fill-opacity:%1.2f;fill:%s;"
-                     %(_opacity,color.lower()))
-            area_list.attrib['style'] = style
-        etree.tostring(self.xml)
+        if self.xml is None:
+            raise RuntimeError('set_fill() needs the XML tree. '
+                               'Use write_fill() in streaming mode.')
+        missing = _tree.set_styles(self.xml,_tree.fill_styles(colors,opacity))
+        if missing:
+            raise KeyError('Unknown area lists: %s' %', '.join(missing))
+
+    def write_fill(self,fout,colors,opacity=0.5,header=None,huge_tree=False):
+        """
+        Writes a copy of the trakem2 file with the fill colors changed
+
+        The file is streamed with tree.filter_trakem2(), so the XML tree
+        is never built. Works in any loading mode. Area lists in colors
+        that are not in the file are ignored.
+
+        Parameters
+        ----------
+        fout : str
+          Output file
+        colors : list
+          Same as set_fill()
+        opacity : float
+          Opacity of the fill. (default is 0.5)
+        header : str, Optional
+          File with the xml declaration and DOCTYPE written in front of 
+          the document, e.g. mat/header.txt
+        huge_tree : bool, Optional, default False
+          If writing a large file, use True
+        """
+        _tree.filter_trakem2(self.trakem2,fout,
+                             styles=_tree.fill_styles(colors,opacity),
+                             calibration=False,header=header,
+                             huge_tree=huge_tree)
         
     def get_calibration(self):
-        self.px_width = float(self.xml.xpath("//t2_calibration/@pixelWidth")[0])
-        self.px_height = float(self.xml.xpath("//t2_calibration/@pixelHeight")[0])
-        self.px_depth = float(self.xml.xpath("//t2_calibration/@pixelDepth")[0])
-        trans = self.xml.xpath("//t2_patch/@transform")[0]	
+        if self.xml is None:
+            (px_width,px_height,px_depth) = self._calibration
+            trans = self._t2_patches[0][1]
+        else:
+            px_width = self.xml.xpath("//t2_calibration/@pixelWidth")[0]
+            px_height = self.xml.xpath("//t2_calibration/@pixelHeight")[0]
+            px_depth = self.xml.xpath("//t2_calibration/@pixelDepth")[0]
+            trans = self.xml.xpath("//t2_patch/@transform")[0]	
+        self.px_width = float(px_width)
+        self.px_height = float(px_height)
+        self.px_depth = float(px_depth)
         trans = trans.replace(')','')
         trans = trans.split(',')
         self.dx = float(trans[-2])
         self.dy = float(trans[-1])
     
+    def get_layer_boundaries(self,layer,scale_bounding_box=1,
+                             area_thresh = 200,
+                             area_lists = []):
+        """
+        Returns the boundaries of the area lists in layer as flat arrays.
+
+        Parameters are the same as get_boundaries_in_layer(). All paths
+        of the layer are decoded, measured and gap filled in one pass.
+
+        Returns
+        ----------
+        boundaries : LayerBoundaries(object)
+
+        """
+        layer = self.layers[layer]
+        if not area_lists: area_lists = self.area_lists.keys()
+        coords,lengths,cells = [],[],[]
+        for n in area_lists:
+            paths = self.get_paths(n,layer.oid)
+            if not paths: continue
+            if isinstance(paths[0],str):
+                (_coords,_offsets,_) = geometry.decode_paths(paths)
+                _lengths = np.diff(_offsets)
+            else:
+                _coords = np.concatenate(paths)
+                _lengths = [len(p) for p in paths]
+            coords.append(_coords + np.asarray(self.area_lists[n].transform,
+                                               dtype=np.float64))
+            lengths.append(_lengths)
+            cells.append(np.full(len(_lengths),self.cell_ids[n],dtype=np.int32))
+        
+        B = LayerBoundaries(layer,list(self.area_lists))
+        if not coords: return B
+        coords = np.concatenate(coords)
+        lengths = np.concatenate(lengths).astype(np.int64)
+        cells = np.concatenate(cells)
+        offsets = np.zeros(len(lengths) + 1,dtype=np.int64)
+        np.cumsum(lengths,out=offsets[1:])
+
+        area = geometry.polygon_areas(coords,offsets)
+        keep = (area > area_thresh) & (lengths > 0)
+        coords = coords[np.repeat(keep,lengths)]
+        offsets = np.zeros(keep.sum() + 1,dtype=np.int64)
+        np.cumsum(lengths[keep],out=offsets[1:])
+        B.cell = cells[keep]
+        B.area = area[keep]
+        
+        #Number the boundaries of each cell in order
+        first = np.flatnonzero(np.r_[True,B.cell[1:] != B.cell[:-1]])
+        counts = np.diff(np.r_[first,len(B.cell)])
+        B.index = (np.arange(len(B.cell)) 
+                   - np.repeat(first,counts)).astype(np.int32)
+        
+        (B.vertices,B.vertex_offsets) = (coords,offsets)
+        (B.coords,B.offsets) = geometry.fill_boundary_gaps(coords,offsets)
+        B.bbox = geometry.bounding_boxes(B.coords,B.offsets)
+        if scale_bounding_box != 1:
+            B.bbox = geometry.scale_bounding_boxes(B.bbox,scale_bounding_box)
+        return B
+
     def get_boundaries_in_layer(self,layer,scale_bounding_box=1,
                                 area_thresh = 200,
                                 area_lists = []):
@@ -226,30 +584,11 @@ class ParseTrakEM2(object):
          boundary[name] = {0:Boundary(object), 1:Boundary(object)...}
 
         """
-        layer = self.layers[layer]
-        if not area_lists: area_lists = self.area_lists.keys()
-        boundary = {}
-        for n in area_lists:
-            path = ("//t2_area_list[@title='%s']"
-                    "/t2_area[@layer_id='%s']"
-                    "/t2_path/@d" %(n,layer.oid))
-            path = self.xml.xpath(path)
-            temp,idx = {},0
-            for p in path:
-                p = self.area_lists[n].path_transform(p)
-                b = Boundary(n,idx,p,transform=layer.transform)
-                b.set_area()
-                if b.area > area_thresh:
-                    b.fill_boundary_gaps()
-                    b.set_bounding_box()
-                    if scale_bounding_box != 1:
-                        b.scale_bounding_box(scale_bounding_box)
-                    temp[idx] = b
-                    idx += 1
-            if temp:
-                boundary[n] = temp
-                
-        return boundary   
+        B = self.get_layer_boundaries(layer,
+                                      scale_bounding_box=scale_bounding_box,
+                                      area_thresh=area_thresh,
+                                      area_lists=area_lists)
+        return B.to_dict()   
 
     
     def get_overlapping_boundaries(self,boundaries):
@@ -258,9 +597,9 @@ class ParseTrakEM2(object):
 
         Parameters
         ----------
-        boundaries : list
-           List of tuples: [(B1,B2),(B1,B3),(B2,B3)...]
-           Where B1,B2,B3,etc are Boundary(objects)  
+        boundaries : 2D dictionary
+           Output of get_boundaries_in_layer() i.e. 
+           boundary[name] = {0:Boundary(object), 1:Boundary(object)...}
         
         Returns
         ----------
@@ -271,15 +610,37 @@ class ParseTrakEM2(object):
 
         """
         
-        nlst = [n for n in boundaries if n not in ['Pharynx','Phi_Marker']]
-        comb = itertools.combinations(nlst,2)
-        overlaps = []
-        for (a,b) in comb:
-            for i in boundaries[a]:
-                for j in boundaries[b]:
-                    if self.is_boundary_overlap(boundaries[a][i],boundaries[b][j]):
-                        overlaps.append((boundaries[a][i],boundaries[b][j]))
-        return overlaps
+        nlst = [n for n in boundaries if n not in EXCLUDE_CELLS]
+        blst = [boundaries[n][i] for n in nlst for i in boundaries[n]]
+        if not blst: return []
+        group = [k for (k,n) in enumerate(nlst) for i in boundaries[n]]
+        bbox = np.array([[b.bounding_box[0][0],b.bounding_box[0][1],
+                          b.bounding_box[1][0],b.bounding_box[1][1]]
+                         for b in blst])
+        (I,J) = geometry.overlapping_pairs(bbox,group)
+        return [(blst[i],blst[j]) for (i,j) in zip(I.tolist(),J.tolist())]
+
+    def get_overlapping_pairs(self,boundaries):
+        """
+        Returns index pairs of boundaries with overlapping bounding boxes
+
+        Parameters
+        ----------
+        boundaries : LayerBoundaries(object)
+        
+        Returns
+        ----------
+        I,J : numpy.ndarray
+           Boundary indices with I < J. Pairs from the same cell and 
+           pairs with an excluded cell (EXCLUDE_CELLS) are left out.
+
+        """
+        exclude = [boundaries.cells.index(n) for n in EXCLUDE_CELLS
+                   if n in boundaries.cells]
+        idx = np.flatnonzero(~np.isin(boundaries.cell,exclude))
+        (I,J) = geometry.overlapping_pairs(boundaries.bbox[idx],
+                                           boundaries.cell[idx])
+        return idx[I],idx[J]
 
     def is_boundary_overlap(self,A,B):
         """
@@ -307,7 +668,7 @@ class ParseTrakEM2(object):
 
         return True
         
-    def compute_adjacency(self,A,B,pixel_radius=10):
+    def compute_adjacency(self,A,B,pixel_radius=10,engine='cdist'):
         """
         Returns the length of adjacency (int) between boundaries A and B
         
@@ -318,6 +679,11 @@ class ParseTrakEM2(object):
         pixel_radius : int
           Boundary points closer than the pixel radius are classified
           as adjacent. (default is 10)
+        engine : str
+          'cdist' computes the full distance matrix between A and B.
+          'kdtree' queries the k-d trees of A and B, so memory scales
+          with the number of points rather than the product of the
+          boundary lengths. Both give the same result. (default is 'cdist')
         
         Returns
         ----------
@@ -326,15 +692,18 @@ class ParseTrakEM2(object):
            of pixels in boundary A adjacent to B and lB is the number
            of pixels in boundary B adjacent to A.  
         """
+        if engine == 'kdtree':
+            return geometry.boundary_adjacency(None,None,pixel_radius,
+                                               A.get_kdtree(),B.get_kdtree())
+        if engine != 'cdist':
+            raise ValueError('Unknown adjacency engine: %s' %engine)
         
         XA = np.array(A.path)
         XB = np.array(B.path)
-        Y = cdist(XA,XB,'euclidean')
-        I = np.where(Y <= pixel_radius)
-        adj = min(len(set(I[0])),len(set(I[1])))
-        return adj
+        return geometry.boundary_adjacency(XA,XB,pixel_radius)
 
-    def batch_compute_adjacency(self,boundaries,pixel_radius=10):
+    def batch_compute_adjacency(self,boundaries,pixel_radius=10,
+                                engine='cdist'):
         """
         Returns lenth of adjacencies for a list of bondary pairs
         
@@ -346,6 +715,8 @@ class ParseTrakEM2(object):
         pixel_radius : int
           Boundary points closer than the pixel radius are classified
           as adjacent. (default is 10)
+        engine : str
+          Adjacency engine, see compute_adjacency(). (default is 'cdist')
 
         Returns
         ---------
@@ -357,11 +728,60 @@ class ParseTrakEM2(object):
         """
         adj = []
         for (b1,b2) in boundaries:
-           a = self.compute_adjacency(b1,b2,pixel_radius=pixel_radius)
+           a = self.compute_adjacency(b1,b2,pixel_radius=pixel_radius,
+                                      engine=engine)
            if a > 0:
                adj.append((b1,b2,a))
         return adj
 
+    def compute_layer_adjacency(self,boundaries,pixel_radius=10):
+        """
+        Returns the adjacencies of all boundary pairs in a layer
+
+        The filled boundaries are rasterized into one label image and the
+        neighborhood of each boundary pixel is read from the image within
+        pixel_radius. No bounding box overlap test is needed. 
+
+        The result follows the point distance definition of 
+        compute_adjacency() with three differences:
+          1. Repeated boundary points are counted once.
+          2. A boundary point lying inside another cell's filled boundary
+             counts as adjacent to that cell, even if no boundary point of
+             the other cell is within pixel_radius.
+          3. Where filled boundaries overlap, the boundary rasterized last
+             hides the other, so points of the hidden boundary in the 
+             overlap are tested against the visible boundary only.
+        For non-overlapping, closed boundaries the adjacencies agree 
+        with compute_adjacency() up to repeated points.
+
+        Parameters
+        ----------
+        boundaries : LayerBoundaries(object)
+        pixel_radius : int
+          Pixels within the pixel radius are classified as adjacent. 
+          (default is 10)
+
+        Returns
+        ---------
+        adj : list
+          list of adjacencies for boundary pairs 
+          [(B1,B2,adj_12),(B1,B3,adj_13),....]
+
+        """
+        exclude = [boundaries.cells.index(n) for n in EXCLUDE_CELLS
+                   if n in boundaries.cells]
+        idx = np.flatnonzero(~np.isin(boundaries.cell,exclude))
+        lengths = np.diff(boundaries.offsets)[idx]
+        offsets = np.zeros(len(idx) + 1,dtype=np.int64)
+        np.cumsum(lengths,out=offsets[1:])
+        coords = np.concatenate([boundaries.path(k) for k in idx]
+                                or [np.zeros((0,2),dtype=np.int32)])
+        (I,J,A) = geometry.raster_adjacency(coords,offsets,
+                                            boundaries.cell[idx],
+                                            pixel_radius=pixel_radius)
+        return [(boundaries.boundary(idx[i]),boundaries.boundary(idx[j]),a)
+                for (i,j,a) in zip(I.tolist(),J.tolist(),A.tolist())]
+
 class Layer(object):
     """
     Class used to hold layer information
@@ -416,23 +836,157 @@ class AreaList(object):
         
         Parameters
         ----------
-        path : Boundary(object).path
-          Boundary path
+        path : str or numpy.ndarray
+          t2_path/@d string with a single subpath or array of path 
+          vertices with shape (n,2)
 
         Returns
         ---------
         path : list
-          Return a tranformed boundary object path  
+          Return a tranformed boundary object path, a list of (x,y) 
+          tuples. Raises ValueError if the path has several subpaths,
+          use subpath_transform() for those.
 
         """
+        subpaths = self.subpath_transform(path)
+        if len(subpaths) != 1:
+            raise ValueError('Path has %d subpaths, use subpath_transform()'
+                             %len(subpaths))
+        return [tuple(p) for p in subpaths[0].tolist()]
+
+    def subpath_transform(self,path):
+        """
+        Applies a x,y translation to each subpath of the path determined 
+        by self.transform
         
-        path = path.replace('M ','')
-        path = path.replace(' z','')
-        path = path.split(' L ')
-        path = [list(map(float,p.split(' '))) for p in path]
-        path = [(p[0] + self.transform[0], p[1] + self.transform[1])
-                for p in path]
-        return path
+        Parameters
+        ----------
+        path : str or numpy.ndarray
+          t2_path/@d string or array of path vertices with shape (n,2)
+
+        Returns
+        ---------
+        subpaths : list
+          List of transformed (n,2) float arrays, one per subpath  
+
+        """
+        if isinstance(path,str):
+            coords,offsets,_ = geometry.decode_paths([path])
+        else:
+            coords = np.asarray(path,dtype=np.float64)
+            offsets = [0,len(coords)]
+        coords = coords + np.asarray(self.transform,dtype=np.float64)
+        return np.split(coords,offsets[1:-1])
+
+class LayerBoundaries(object):
+    """
+    Class used to hold all boundaries of a layer in flat arrays
+
+    Boundary k has the pixels coords[offsets[k]:offsets[k+1]]. Cell names
+    are stored as integer ids into cells.
+
+    Attributes
+    ----------
+    layer : Layer(object)
+      Layer the boundaries belong to
+    cells : list
+      Cell names, indexed by cell id
+    coords : numpy.ndarray
+      (n,2) int32 array of gap filled boundary pixels
+    offsets : numpy.ndarray
+      int64 array of length len(self) + 1
+    vertices : numpy.ndarray
+      (m,2) float64 array of the transformed path vertices, before gap
+      filling
+    vertex_offsets : numpy.ndarray
+      Boundary k has the vertices vertices[vertex_offsets[k]:vertex_offsets[k+1]]
+    cell : numpy.ndarray
+      int32 cell id of each boundary
+    index : numpy.ndarray
+      int32 index of each boundary within its cell
+    area : numpy.ndarray
+      float64 area enclosed by each boundary
+    bbox : numpy.ndarray
+      (m,4) int32 bounding boxes with columns [xmin,ymin,xmax,ymax]
+
+    Methods
+    -------
+    path(k)
+      Returns the pixels of boundary k
+
+    boundary(k)
+      Returns a Boundary(object) view of boundary k
+
+    to_dict()
+      Returns boundaries as boundary[name] = {0:Boundary(object),...}
+
+    rasterize(out,labels,overlap='last')
+      Writes the filled boundaries into the label image out
+    """
+    def __init__(self,layer,cells):
+        self.layer = layer
+        self.cells = cells
+        self.coords = np.zeros((0,2),dtype=np.int32)
+        self.offsets = np.zeros(1,dtype=np.int64)
+        self.vertices = np.zeros((0,2))
+        self.vertex_offsets = np.zeros(1,dtype=np.int64)
+        self.cell = np.zeros(0,dtype=np.int32)
+        self.index = np.zeros(0,dtype=np.int32)
+        self.area = np.zeros(0)
+        self.bbox = np.zeros((0,4),dtype=np.int32)
+
+    def __len__(self):
+        return len(self.cell)
+
+    def path(self,k):
+        """
+        Returns the (n,2) pixel array of boundary k
+        """
+        return self.coords[self.offsets[k]:self.offsets[k+1]]
+
+    def boundary(self,k):
+        """
+        Returns a Boundary(object) view of boundary k. The path is a view
+        into self.coords.
+        """
+        b = Boundary(self.cells[self.cell[k]],int(self.index[k]),self.path(k),
+                     transform=self.layer.transform)
+        b.area = float(self.area[k])
+        (xmin,ymin,xmax,ymax) = [int(v) for v in self.bbox[k]]
+        b.bounding_box = [(xmin,ymin),(xmax,ymax)]
+        b.width = xmax - xmin + 1
+        b.height = ymax - ymin + 1
+        return b
+
+    def to_dict(self):
+        """
+        Returns the boundaries as a 2D dictionary of Boundary(object) i.e.
+        boundary[name] = {0:Boundary(object), 1:Boundary(object)...}
+        """
+        boundary = {}
+        for k in range(len(self)):
+            b = self.boundary(k)
+            boundary.setdefault(b.name,{})[b.index] = b
+        return boundary
+
+    def rasterize(self,out,labels,overlap='last'):
+        """
+        Writes the filled boundaries into the label image out with a 
+        scanline fill (see geometry.rasterize_polygons()). Only the
+        bounding box of each boundary is touched.
+
+        Parameters
+        ----------
+        out : numpy.ndarray
+          (height,width) layer image, e.g. from get_layer_dims()
+        labels : int or numpy.ndarray
+          Label of all boundaries or of each boundary
+        overlap : str, Optional, default 'last'
+          Where boundaries overlap, 'last' keeps the label of the later
+          boundary and 'first' the label of the earlier one.
+        """
+        geometry.rasterize_polygons(self.vertices,self.vertex_offsets,labels,
+                                    out,overlap=overlap)
 
 class Boundary(object):
     """
@@ -456,6 +1010,8 @@ class Boundary(object):
      Number of pixels in boundary
     bounding_box : list
      List of min and max points of bounding box [(xmin,ymin),(xmax,ymax)]
+    kdtree : scipy.spatial.cKDTree
+     k-d tree of the boundary points. None until get_kdtree() is called
     width : int
      Width of bounding box
     height : int
@@ -484,6 +1040,9 @@ class Boundary(object):
     get_display_matrix()
       Returns a matrix A with the dimensions of the bounding box. A[i,j] = 1 if
       it is a boundary point and A[i,j] = 0 otherwise. 
+
+    get_kdtree()
+      Returns a k-d tree of the boundary points, built on first use
     
 
     """
@@ -494,6 +1053,7 @@ class Boundary(object):
         self.transform = (0,0)
         self.area = None
         self.cent = None
+        self.kdtree = None
         if 'transform' in kwargs:
             self.transform = kwargs['transform']
 
@@ -509,6 +1069,17 @@ class Boundary(object):
         self.cent = [np.mean(cent[0]) - self.transform[0],
                      np.mean(cent[1]) - self.transform[1]]
 
+    def get_kdtree(self):
+        """
+        Returns a scipy.spatial.cKDTree of the boundary points
+
+        The tree is built on the first call and kept in self.kdtree, so
+        it is shared by all the pairs the boundary is part of.
+        """
+        if self.kdtree is None:
+            self.kdtree = cKDTree(np.asarray(self.path,dtype=np.float64))
+        return self.kdtree
+
     def set_boundary_length(self):
         """
         Computes number of pixels in the boundary
@@ -524,11 +1095,12 @@ class Boundary(object):
         Definition of area of polygon
         area += (B[j][0] + B[i][0])*(B[j][1] - B[i][1])
         """
-        B = self.path
-        area = 0	
-        for i in range(len(B)):
-            j = i - 1
-            area += (B[j][0] + B[i][0])*(B[j][1] - B[i][1])
+        B = np.asarray(self.path,dtype=np.float64)
+        if len(B) == 0:
+            self.area = 0
+            return
+        Bj = np.roll(B,1,axis=0)
+        area = np.sum((Bj[:,0] + B[:,0])*(Bj[:,1] - B[:,1]))
         self.area =  0.5*abs(area) 
    
 
@@ -593,6 +1165,7 @@ class Boundary(object):
         self.path = cnts
     
     def fill_boundary_gaps(self):
+        if isinstance(self.path,np.ndarray): self.path = self.path.tolist()
         zB = list(zip(self.path[:-1],self.path[1:]))
         zB.append((self.path[-1],self.path[0]))
         cnts = []
@@ -0,0 +1,97 @@
+"""
+results.py
+
+Streaming readers for the xml files written by measure_adjacency.py and
+extract_segmentation_stats.py.
+
+Files are read with iterparse. Each record is yielded when its element
+closes and the element is freed right away, so memory use does not
+grow with the size of the file.
+
+Layers are listed in the order they were written, which for the journal
+of measure_adjacency.py is the order they finished. With sort=True the
+records are returned sorted by layer name instead. Records are then 
+spooled to a temporary file one layer at a time and read back layer by
+layer, so at most one layer is held in memory.
+
+Required 3rd party packages:
+  lxml
+
+"""
+import pickle
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+
+from lxml import etree
+
+ADJACENCY_FIELDS = ['cell1','cell2','index1','index2','adjacency']
+SEGMENT_FIELDS = ['name','index','centx','centy','area','length']
+
+def iter_records(fname,tag,fields,huge_tree=False):
+    """
+    Generator of (layer,field1,field2,...) for every tag element in fname
+
+    Parameters
+    ----------
+    fname : str
+      Path to the xml file
+    tag : str
+      Record element, e.g. 'area' or 'segment'
+    fields : list
+      Child elements of the record. Their text is returned, or None if
+      the element is missing or empty.
+    huge_tree : bool
+      Passed to iterparse
+    """
+    layer = None
+    context = etree.iterparse(fname,events=('start','end'),
+                              huge_tree=huge_tree)
+    for (event,elem) in context:
+        if event == 'start':
+            if elem.tag == 'layer': layer = elem.get('name')
+            continue
+        if elem.tag == tag:
+            yield (layer,) + tuple(elem.findtext(f) or None for f in fields)
+        elif elem.tag != 'layer':
+            continue
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+def sort_by_layer(records):
+    """
+    Generator of records, tuples starting with the layer name, sorted by
+    layer. Records of the same layer keep their order.
+
+    Consecutive records of a layer are pickled to a temporary file as one
+    block. The blocks are then read back in order of the layer names.
+    """
+    blocks = []
+    with tempfile.TemporaryFile() as tmp:
+        for (layer,group) in groupby(records,key=itemgetter(0)):
+            blocks.append((layer,len(blocks),tmp.tell()))
+            pickle.dump(list(group),tmp,protocol=pickle.HIGHEST_PROTOCOL)
+        for (layer,_,start) in sorted(blocks):
+            tmp.seek(start)
+            for r in pickle.load(tmp): yield r
+
+def iter_adjacency(fname,huge_tree=False,sort=False):
+    """
+    Generator of (layer,cell1,cell2,index1,index2,adjacency) strings in
+    an adjacency file written by measure_adjacency.py. If sort, records
+    are sorted by layer name, see sort_by_layer().
+    """
+    records = iter_records(fname,'area',ADJACENCY_FIELDS,huge_tree=huge_tree)
+    if sort: records = sort_by_layer(records)
+    return records
+
+def iter_segments(fname,huge_tree=False,sort=False):
+    """
+    Generator of (layer,name,index,centx,centy,area,length) strings in
+    a file written by extract_segmentation_stats.py. If sort, records 
+    are sorted by layer name, see sort_by_layer().
+    """
+    records = iter_records(fname,'segment',SEGMENT_FIELDS,huge_tree=huge_tree)
+    if sort: records = sort_by_layer(records)
+    return records
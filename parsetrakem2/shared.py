@@ -0,0 +1,94 @@
+"""
+shared.py
+
+Publishes numpy arrays to worker processes through shared memory.
+
+The owner copies the arrays once into named shared memory blocks and
+passes the small spec (block names, shapes and dtypes) to its workers.
+Workers attach to the blocks without copying and keep the most recently
+used specs attached, so tasks on the same arrays only pay for the
+attach once.
+
+Required 3rd party packages:
+  numpy
+
+"""
+from collections import OrderedDict
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+#Number of specs a worker keeps attached
+MAX_ATTACHED = 2
+
+_attached = OrderedDict()
+
+class SharedArrays(object):
+    """
+    Class used to publish a set of arrays in shared memory
+
+    Attributes
+    ----------
+    spec : dict
+      spec[name] = (block name, shape, dtype string). Pass to attach()
+    blocks : list
+      SharedMemory blocks owned by this object
+
+    Methods
+    -------
+    close()
+      Releases and unlinks the shared memory blocks
+    """
+    def __init__(self,**arrays):
+        self.blocks = []
+        self.spec = {}
+        for (name,a) in arrays.items():
+            a = np.ascontiguousarray(a)
+            shm = shared_memory.SharedMemory(create=True,size=max(a.nbytes,1))
+            np.ndarray(a.shape,dtype=a.dtype,buffer=shm.buf)[...] = a
+            self.blocks.append(shm)
+            self.spec[name] = (shm.name,a.shape,a.dtype.str)
+
+    def close(self):
+        """
+        Releases and unlinks the shared memory blocks
+        """
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+def attach(spec):
+    """
+    Returns the arrays published under spec as a dictionary
+
+    Parameters
+    ----------
+    spec : dict
+      SharedArrays.spec
+    """
+    key = tuple(sorted(v[0] for v in spec.values()))
+    if key in _attached:
+        _attached.move_to_end(key)
+        return _attached[key][1]
+    blocks,arrays = {},{}
+    for (name,(block,shape,dtype)) in spec.items():
+        blocks[name] = shared_memory.SharedMemory(name=block)
+        #Only the owner unlinks the block
+        resource_tracker.unregister(blocks[name]._name,'shared_memory')
+        arrays[name] = np.ndarray(shape,dtype=dtype,buffer=blocks[name].buf)
+    _attached[key] = (blocks,arrays)
+    while len(_attached) > MAX_ATTACHED:
+        (blocks,arrays) = _attached.popitem(last=False)[1]
+        arrays.clear()
+        for shm in blocks.values():
+            try:
+                shm.close()
+            except BufferError:
+                pass
+    return _attached[key][1]
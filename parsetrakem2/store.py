@@ -0,0 +1,210 @@
+"""
+store.py
+
+SQLite store for adjacency and segmentation results.
+
+Results of measure_adjacency.py and extract_segmentation_stats.py can be
+written into a local SQLite database with tables for layers, cells,
+segments and adjacency. Segments are indexed on (cell,layer) and
+adjacencies on (cell1,cell2) and (cell2,cell1), so questions like "all
+contacts of cell X between layers A and B" or "per-layer area of cell Y"
+are index lookups instead of scans of the xml output.
+
+Results are written one layer at a time. Writing a layer replaces its
+previous records in a single transaction, so a layer can be recomputed
+without touching the rest of the database.
+
+Required 3rd party packages:
+  None (sqlite3 is in the python standard library)
+
+"""
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS layers (
+  id INTEGER PRIMARY KEY,
+  name TEXT UNIQUE NOT NULL,
+  z REAL
+);
+CREATE TABLE IF NOT EXISTS cells (
+  id INTEGER PRIMARY KEY,
+  name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+  layer INTEGER NOT NULL REFERENCES layers(id),
+  cell INTEGER NOT NULL REFERENCES cells(id),
+  idx INTEGER NOT NULL,
+  centx INTEGER,
+  centy INTEGER,
+  area INTEGER,
+  length INTEGER,
+  PRIMARY KEY (layer,cell,idx)
+);
+CREATE TABLE IF NOT EXISTS adjacency (
+  layer INTEGER NOT NULL REFERENCES layers(id),
+  cell1 INTEGER NOT NULL REFERENCES cells(id),
+  idx1 INTEGER NOT NULL,
+  cell2 INTEGER NOT NULL REFERENCES cells(id),
+  idx2 INTEGER NOT NULL,
+  adjacency INTEGER NOT NULL,
+  PRIMARY KEY (layer,cell1,idx1,cell2,idx2)
+);
+CREATE INDEX IF NOT EXISTS segments_cell_layer ON segments (cell,layer);
+CREATE INDEX IF NOT EXISTS adjacency_cell1_cell2 ON adjacency (cell1,cell2);
+CREATE INDEX IF NOT EXISTS adjacency_cell2_cell1 ON adjacency (cell2,cell1);
+"""
+
+class Store(object):
+    """
+    Class used to read and write results in a SQLite database
+
+    Attributes
+    ----------
+    fname : str
+      Path to the database. Created if it does not exist.
+    conn : sqlite3.Connection
+
+    Methods
+    -------
+    put_adjacency(layer,records,z=None)
+      Replaces the adjacency records of a layer
+
+    put_segments(layer,records,z=None)
+      Replaces the segment records of a layer
+
+    contacts(cell,start=None,stop=None)
+      Returns all adjacencies of cell, optionally between two layers
+
+    layer_areas(cell)
+      Returns the total area of cell in each layer
+
+    close()
+      Closes the database
+    """
+    def __init__(self,fname):
+        self.fname = fname
+        self.conn = sqlite3.connect(fname)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._cells = dict(self.conn.execute('SELECT name,id FROM cells'))
+
+    def close(self):
+        """
+        Closes the database
+        """
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def _layer_id(self,layer,z=None):
+        self.conn.execute('INSERT OR IGNORE INTO layers (name,z) VALUES (?,?)',
+                          (layer,z))
+        if z is not None:
+            self.conn.execute('UPDATE layers SET z = ? WHERE name = ?',(z,layer))
+        return self.conn.execute('SELECT id FROM layers WHERE name = ?',
+                                 (layer,)).fetchone()[0]
+
+    def _cell_ids(self,names):
+        new = [(n,) for n in set(names) if n not in self._cells]
+        if new:
+            self.conn.executemany('INSERT OR IGNORE INTO cells (name) VALUES (?)',new)
+            self._cells = dict(self.conn.execute('SELECT name,id FROM cells'))
+        return self._cells
+
+    def put_adjacency(self,layer,records,z=None):
+        """
+        Replaces the adjacency records of a layer
+
+        Parameters
+        ----------
+        layer : str
+          Layer name
+        records : list
+          List of (cell1,cell2,index1,index2,adjacency)
+        z : float, Optional
+          Layer z position, used to order layers in queries
+        """
+        with self.conn:
+            lid = self._layer_id(layer,z)
+            ids = self._cell_ids([r[0] for r in records] + [r[1] for r in records])
+            self.conn.execute('DELETE FROM adjacency WHERE layer = ?',(lid,))
+            self.conn.executemany(
+                'INSERT INTO adjacency VALUES (?,?,?,?,?,?)',
+                ((lid,ids[c1],i1,ids[c2],i2,a) for (c1,c2,i1,i2,a) in records))
+
+    def put_segments(self,layer,records,z=None):
+        """
+        Replaces the segment records of a layer
+
+        Parameters
+        ----------
+        layer : str
+          Layer name
+        records : list
+          List of (cell,index,centx,centy,area,length)
+        z : float, Optional
+          Layer z position, used to order layers in queries
+        """
+        with self.conn:
+            lid = self._layer_id(layer,z)
+            ids = self._cell_ids([r[0] for r in records])
+            self.conn.execute('DELETE FROM segments WHERE layer = ?',(lid,))
+            self.conn.executemany(
+                'INSERT INTO segments VALUES (?,?,?,?,?,?,?)',
+                ((lid,ids[c]) + tuple(r) for (c,*r) in records))
+
+    def contacts(self,cell,start=None,stop=None):
+        """
+        Returns all adjacencies of cell
+
+        Parameters
+        ----------
+        cell : str
+          Cell name
+        start,stop : str, Optional
+          Only layers with z between the z of layers start and stop,
+          inclusive, are returned. The order of start and stop does not
+          matter.
+
+        Returns
+        -------
+        rows : list
+          List of (layer,cell,index,partner,partner index,adjacency)
+          ordered by layer z
+        """
+        cid = self._cells.get(cell)
+        if cid is None: return []
+        where,args = '',[]
+        if start is not None and stop is not None:
+            z = [self.conn.execute('SELECT z FROM layers WHERE name = ?',
+                                   (l,)).fetchone() for l in (start,stop)]
+            if None in z: return []
+            where = 'AND l.z BETWEEN ? AND ?'
+            args = sorted(_z[0] for _z in z)
+        sql = ('SELECT l.name,?,a.%s,c.name,a.%s,a.adjacency,l.z '
+               'FROM adjacency a JOIN layers l ON l.id = a.layer '
+               'JOIN cells c ON c.id = a.%s WHERE a.%s = ? ' + where)
+        rows = []
+        for (this,other) in [('1','2'),('2','1')]:
+            q = sql %('idx' + this,'idx' + other,'cell' + other,'cell' + this)
+            rows.extend(self.conn.execute(q,[cell,cid] + args))
+        z = lambda r: float('inf') if r[-1] is None else r[-1]
+        rows.sort(key=lambda r: (z(r),r[0],r[2],r[3],r[4]))
+        return [r[:-1] for r in rows]
+
+    def layer_areas(self,cell):
+        """
+        Returns a list of (layer,area) with the total area of cell in each
+        layer, ordered by layer z
+        """
+        cid = self._cells.get(cell)
+        if cid is None: return []
+        return self.conn.execute(
+            'SELECT l.name,SUM(s.area) FROM segments s '
+            'JOIN layers l ON l.id = s.layer WHERE s.cell = ? '
+            'GROUP BY s.layer ORDER BY l.z',(cid,)).fetchall()
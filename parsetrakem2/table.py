@@ -0,0 +1,112 @@
+"""
+table.py
+
+Typed columnar tables for adjacency and segmentation results.
+
+A table is an uncompressed .npz file with one int32 array per column.
+Categorical columns (layer and cell names) hold int32 codes into a
+string array stored under '<column>.categories'. cell1 and cell2 share
+the same categories, so their codes can be compared directly. Loading a
+table is a single np.load and needs no parsing.
+
+Required 3rd party packages:
+  numpy
+
+"""
+import os
+import numpy as np
+
+ADJACENCY_COLUMNS = ['layer','cell1','cell2','index1','index2','adjacency']
+SEGMENT_COLUMNS = ['layer','cell','index','centx','centy','area','length']
+
+def encode(values,categories=None):
+    """
+    Returns the int32 codes of values and the categories
+
+    Parameters
+    ----------
+    values : list
+      List of labels
+    categories : list, Optional
+      Categories to encode into. Defaults to the sorted unique values.
+    """
+    values = np.asarray(values,dtype=str)
+    if categories is None:
+        (categories,codes) = np.unique(values,return_inverse=True)
+        return codes.astype(np.int32),categories
+    categories = np.asarray(categories,dtype=str)
+    order = np.argsort(categories)
+    pos = np.searchsorted(categories,values,sorter=order)
+    return order[pos].astype(np.int32),categories
+
+def from_records(records,columns,categorical=[],shared=[]):
+    """
+    Builds a table from a list of record tuples
+
+    Parameters
+    ----------
+    records : list
+      List of tuples with one entry per column
+    columns : list
+      Column names
+    categorical : list
+      Names of the columns holding labels
+    shared : list
+      Categorical columns that share one set of categories
+
+    Returns
+    -------
+    table : dict
+      table[column] = numpy.ndarray. Categories are stored under
+      '<column>.categories'.
+    """
+    data = list(zip(*records)) if records else [[] for c in columns]
+    values = dict(zip(columns,data))
+    common = None
+    if shared:
+        common = np.unique(np.concatenate([np.asarray(values[c],dtype=str)
+                                           for c in shared]))
+    table = {}
+    for c in columns:
+        if c in categorical:
+            cats = common if c in shared else None
+            (table[c],table[c + '.categories']) = encode(values[c],cats)
+        else:
+            table[c] = np.asarray(values[c],dtype=np.int32)
+    return table
+
+def to_records(table,columns):
+    """
+    Returns the rows of a table as a list of tuples with decoded labels
+    """
+    cols = [decode(table,c).tolist() for c in columns]
+    return list(zip(*cols))
+
+def decode(table,column):
+    """
+    Returns the labels of a categorical column, or the column itself
+    """
+    if column + '.categories' in table:
+        return table[column + '.categories'][table[column]]
+    return table[column]
+
+def write_table(fname,table):
+    """
+    Writes the table to fname. The file is replaced atomically.
+    """
+    tmp = fname + '.tmp'
+    with open(tmp,'wb') as fout:
+        np.savez(fout,**table)
+    os.replace(tmp,fname)
+
+def load_table(fname):
+    """
+    Loads a table written by write_table()
+
+    Returns
+    -------
+    table : dict
+      table[column] = numpy.ndarray
+    """
+    with np.load(fname,allow_pickle=False) as data:
+        return dict((k,data[k]) for k in data.files)
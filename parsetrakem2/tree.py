@@ -13,6 +13,9 @@ from lxml import etree
 from tqdm import tqdm
 import numpy as np
 
+from parsetrakem2.geometry import decode_paths, encode_paths
+from parsetrakem2.geometry import clip_polygons, polygon_index
+
 def fix_calibration(tree):
     root = tree.getroot()
     t2_layer_set = root.find('t2_layer_set')
@@ -76,42 +79,237 @@ def restrict_segments_by_roi(tree,roi,if_check=False):
     oids: layer ids
     roi: list, [xmin (int),ymin (int),xmax (int),ymax (int)]
     """
-    xmin,ymin,xmax,ymax = roi
     root = tree.getroot()
     t2_layer_set = root.find('t2_layer_set')
+    restrict_area_lists_by_roi(t2_layer_set.findall('t2_area_list'),roi)
+
+def restrict_area_list_by_roi(area,roi):
+    """
+    Clips the segments of a single t2_area_list element to the roi
+
+    Parameters:
+    -----------
+    area: lxml.etree.Element, t2_area_list
+    roi: list, [xmin (int),ymin (int),xmax (int),ymax (int)]
+    """
+    restrict_area_lists_by_roi([area],roi)
+
+def restrict_area_lists_by_roi(areas,roi):
+    """
+    Clips the segments of t2_area_list elements to the roi
+
+    All paths are decoded in one call and the paths with vertices outside
+    the roi are clipped at once with geometry.clip_polygons(), so clipped 
+    segments stay closed polygons. Paths entirely inside the roi keep 
+    their original string, paths entirely outside are removed, as are 
+    t2_area elements left without paths.
 
-    for area in tqdm(t2_layer_set.findall('t2_area_list'),desc='Restric rois'):
-        trans = get_area_list_transform(area)
+    Parameters:
+    -----------
+    areas: list of lxml.etree.Element, t2_area_list
+    roi: list, [xmin (int),ymin (int),xmax (int),ymax (int)]
+    """
+    paths,trans = [],[]
+    for area in areas:
+        t = get_area_list_transform(area)
         for t2_area in area.findall('t2_area'):
-            layer_id = t2_area.get('layer_id')
-            #patch = root.xpath("//t2_patch/@oid=")
-            t2_path = t2_area.findall('t2_path')
-            num_paths = len(t2_path)
-            paths_removed = 0
-            for path in t2_path:
-                p = path.get('d')
-                p = path_to_array(p)
-                p[:,0] += trans[0]
-                p[:,1] += trans[1]
-                pnew = [_p for _p in p.tolist() if in_roi(_p,roi)]
-                if pnew:
-                    pnew = np.array(pnew)
-                    pnew[:,0] -= trans[0]
-                    pnew[:,1] -= trans[1]
-                    pnew = array_to_path(pnew)
-                    path.set('d', pnew)
-                else:
-                    t2_area.remove(path)
-                    paths_removed += 1
-                #cent = np.mean(p,axis=0)
-                #c1 = (cent[0] < xmin) or (cent[0] > xmax)
-                #c2 = (cent[1] < ymin) or (cent[1] > ymax)
-                #if c1 or c2:
-                    #t2_area.remove(path)
-                    #paths_removed += 1
-            if paths_removed == num_paths: area.remove(t2_area)
-
-               
+            for path in t2_area.findall('t2_path'):
+                paths.append((t2_area,path))
+                trans.append(t)
+    if not paths: return
+    (coords,offsets,source) = decode_paths([p.get('d') for (a,p) in paths])
+    trans = np.array(trans,dtype=np.float64)
+    vsource = source[polygon_index(offsets)]
+    coords += trans[vsource]
+    (xmin,ymin,xmax,ymax) = roi
+    outside = ((coords[:,0] < xmin) | (coords[:,0] > xmax) 
+               | (coords[:,1] < ymin) | (coords[:,1] > ymax))
+    changed = np.bincount(vsource[outside],minlength=len(paths)) > 0
+    if not changed.any(): return
+    #Only the polygons of changed paths are clipped and rewritten
+    pkeep = changed[source]
+    lengths = np.diff(offsets)[pkeep]
+    coords = coords[np.repeat(pkeep,np.diff(offsets))]
+    offsets = np.r_[0,np.cumsum(lengths)]
+    (coords,offsets) = clip_polygons(coords,offsets,roi)
+    #Drop polygons that were clipped away
+    lengths = np.diff(offsets)
+    keep = lengths >= 3
+    source = source[pkeep][keep]
+    coords = coords[np.repeat(keep,lengths)]
+    offsets = np.r_[0,np.cumsum(lengths[keep])]
+    coords -= trans[source[polygon_index(offsets)]]
+    d = encode_paths(coords,offsets,source,len(paths))
+    emptied = set()
+    for i in np.flatnonzero(changed):
+        (t2_area,path) = paths[i]
+        if d[i]:
+            path.set('d',d[i])
+        else:
+            t2_area.remove(path)
+            emptied.add(t2_area)
+    for t2_area in emptied:
+        if t2_area.find('t2_path') is None: t2_area.getparent().remove(t2_area)
+
+#Elements that are copied start and end tag first, their children are 
+#filtered one at a time
+CONTAINERS = ['trakem2','project','t2_layer_set']
+
+def filter_trakem2(fin,fout,cells=None,zrange=None,roi=None,mipmaps=None,
+                   styles=None,calibration=True,header=None,
+                   encoding='ISO-8859-1',huge_tree=False):
+    """
+    Copies a TrakEM2 file while filtering it, in a single streaming pass
+
+    The input is read with iterparse and written with etree.xmlfile. Each
+    child of the trakem2, project and t2_layer_set elements is filtered
+    and written as soon as it is read and then freed, so memory is set by
+    the largest area list rather than by the file. This applies
+    extract_area_lists(), restrict_segments_by_oid(),
+    restrict_segments_by_roi(), change_mipmaps_dir() and 
+    fix_calibration() without building the tree.
+
+    Parameters:
+    -----------
+    fin: str, input TrakEM2 file
+    fout: str, output file
+    cells: (list, str), Optional. Area lists and neurons to keep. 
+        Default keeps all.
+    zrange: tuple, Optional. (zmin,zmax) keeps the segments of the layers 
+        zmin to zmax, inclusive, in the sorted order of the layer names.
+        Layers have to come before the area lists in the file, as 
+        written by TrakEM2.
+    roi: list, Optional. [xmin,ymin,xmax,ymax], see 
+        restrict_segments_by_roi()
+    mipmaps: str, Optional. New mipmaps directory
+    styles: dict, Optional. styles[area list title] = style attribute,
+        e.g. from fill_style()
+    calibration: bool, if True fix_calibration() is applied (default True)
+    header: str, Optional. File with the xml declaration and DOCTYPE 
+        written in front of the document, e.g. mat/header.txt. If not
+        given only an xml declaration is written.
+    encoding: str, output encoding (default 'ISO-8859-1')
+    huge_tree: bool, passed to iterparse
+    """
+    if isinstance(cells,str): cells = [cells]
+    keep = set(cells) if cells is not None else None
+    layers = []
+    oids = None
+    opened = []
+    context = etree.iterparse(fin,events=('start','end'),
+                              remove_blank_text=True,huge_tree=huge_tree)
+    with open(fout,'wb') as f:
+        if header is not None:
+            with open(header,'rb') as fheader:
+                f.write(fheader.read())
+        with etree.xmlfile(f,encoding=encoding) as xf:
+            if header is None: xf.write_declaration()
+            for (event,elem) in context:
+                parent = elem.getparent()
+                top = parent is None or parent.tag in CONTAINERS
+                if not top: continue
+                if elem.tag in CONTAINERS:
+                    if event == 'start':
+                        attrib = dict(elem.attrib)
+                        if elem.tag == 'project' and mipmaps is not None:
+                            attrib['mipmaps_folder'] = mipmaps
+                        opened.append(xf.element(elem.tag,attrib))
+                        opened[-1].__enter__()
+                    else:
+                        opened.pop().__exit__(None,None,None)
+                    continue
+                if event == 'start': continue
+                
+                #elem is a complete child of a container
+                write = True
+                if elem.tag == 'neuron' and parent.tag == 'project':
+                    write = keep is None or elem.get('title') in keep
+                elif elem.tag == 't2_calibration' and calibration:
+                    elem.set('pixelWidth','1.0')
+                    elem.set('pixelHeight','1.0')
+                    elem.set('pixelDepth','20.0')
+                    elem.set('unit','pixel')
+                elif elem.tag == 't2_layer':
+                    patch = elem.find('t2_patch')
+                    name = patch.get('title').replace('.tif','') if patch is not None else ''
+                    layers.append((name,elem.get('oid')))
+                elif elem.tag == 't2_area_list':
+                    title = elem.get('title')
+                    write = keep is None or title in keep
+                    if write and zrange is not None:
+                        if oids is None:
+                            if not layers:
+                                raise ValueError('zrange needs the t2_layer '
+                                                 'elements before the area lists')
+                            (zmin,zmax) = zrange
+                            oids = set(o for (n,o) in sorted(layers)[zmin:zmax + 1])
+                        for t2_area in elem.findall('t2_area'):
+                            if t2_area.get('layer_id') not in oids:
+                                elem.remove(t2_area)
+                    if write and roi is not None:
+                        restrict_area_list_by_roi(elem,roi)
+                    if write and styles is not None and title in styles:
+                        elem.set('style',styles[title])
+                if write: xf.write(elem)
+                parent.remove(elem)
+    del context
+
+def fill_style(color,opacity=0.5):
+    """
+    Returns the style attribute of an area list filled with color
+
+    Parameters:
+    -----------
+    color: str, HTML color code e.g. #000000
+    opacity: float, fill opacity (default 0.5)
+    """
+    return "stroke:none;fill-opacity:%1.2f;fill:%s;" %(float(opacity),color.lower())
+
+def fill_styles(colors,opacity=0.5):
+    """
+    Returns the style attributes of a batch of area lists
+
+    Parameters:
+    -----------
+    colors: list of (title,color) or (title,color,opacity) tuples, 
+        see ParseTrakEM2.set_fill()
+    opacity: float, fill opacity of tuples without one (default 0.5)
+
+    Returns:
+    --------
+    styles: dict, styles[title] = style attribute
+    """
+    styles = {}
+    for col in colors:
+        if len(col) == 3:
+            (title,color,_opacity) = col
+        else:
+            (title,color) = col
+            _opacity = opacity
+        styles[title] = fill_style(color,_opacity)
+    return styles
+
+def set_styles(tree,styles):
+    """
+    Sets the style attribute of area lists in a single sweep of the tree
+
+    Parameters:
+    -----------
+    tree: lxml.etree.parse  file
+    styles: dict, styles[area list title] = style attribute
+
+    Returns:
+    --------
+    missing: list, titles in styles without an area list
+    """
+    found = set()
+    for area in tree.getroot().iter('t2_area_list'):
+        title = area.get('title')
+        if title in styles:
+            area.set('style',styles[title])
+            found.add(title)
+    return [t for t in styles if t not in found]
+
 def get_area_list_transform(arealist):
     transform = arealist.get('transform').replace(')','')
     transform = transform.split(',')
@@ -123,26 +321,23 @@ def path_to_array(path):
 
     Parameters
     ----------
-    path : path string
+    path : path string with a single subpath
     
     Returns
     ---------
-    path : list
-      Return a tranformed boundary object path  
+    path : numpy.ndarray
+      (n,2) array of the path vertices. Raises ValueError if the path
+      has several subpaths, use geometry.decode_path() for those.
 
     """
-    path = path.replace('M ','')
-    path = path.replace(' z','')
-    path = path.split(' L ')
-    return np.array([list(map(float,p.split(' '))) for p in path])
-    #path = np.array([list(map(float,p.split(' '))) for p in path])
-    #path[:,0] += translate[0]
-    #path[:,1] += translate[1]
-    #return path
+    coords,offsets,_ = decode_paths([path])
+    if len(offsets) != 2:
+        raise ValueError('Path has %d subpaths, use geometry.decode_path()'
+                         %(len(offsets) - 1))
+    return coords
 
 def array_to_path(parray):
-    path = [' '.join(map(str,p)) for p in parray.tolist()]
-    return 'M ' + ' L '.join(path) + ' z'
+    return encode_paths(parray,np.array([0,len(parray)]))[0]
 
 
 def in_roi(pt,roi):
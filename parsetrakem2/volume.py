@@ -0,0 +1,412 @@
+"""
+volume.py
+
+Chunked 3D label volumes stored as local files.
+
+A volume is a directory holding a JSON header (meta.json) and one file
+per chunk (chunks/z.y.x). Each chunk is compressed on its own with zlib,
+or stored raw so that it can be memory-mapped. Chunks that were never
+written read as the fill value. Reading a region only loads the chunks
+that cover it.
+
+Chunk files are written under a temporary name and renamed into place,
+so readers never see a partial chunk and processes that write different
+chunks need no coordination.
+
+Labels of a volume are assigned by a CellRegistry, which maps cell 
+names to labels, picks the smallest integer dtype that holds all labels
+and is stored as JSON next to the volume.
+
+Single cells can also be stored as crops, a boolean mask of the cell's
+3D bounding box together with its origin, either dense or run-length
+encoded per row (see write_crop()).
+
+Required 3rd party packages:
+  numpy
+
+"""
+import os
+import json
+import zlib
+import csv
+import itertools
+import numpy as np
+
+META = 'meta.json'
+CHUNKS = 'chunks'
+COMPRESSORS = ['zlib','raw']
+LABEL_DTYPES = [np.uint8,np.uint16,np.uint32]
+
+class ChunkedVolume(object):
+    """
+    Class used to read and write a chunked 3D volume
+
+    Attributes
+    ----------
+    path : str
+      Volume directory
+    shape : tuple
+      (z,y,x) shape of the volume
+    chunks : tuple
+      (z,y,x) shape of a chunk
+    dtype : numpy.dtype
+    compressor : str
+      'zlib' or 'raw'
+    fill_value : int
+      Value of chunks that were not written
+    attrs : dict
+      User attributes stored in the header
+
+    Methods
+    -------
+    create(path,shape,chunks,dtype,compressor='zlib',attrs={})
+      Creates a new volume and returns it
+
+    read_chunk(idx)
+      Returns chunk idx
+
+    write_chunk(idx,data)
+      Writes chunk idx
+
+    write_slab(iz,data)
+      Writes all chunks of the z chunk index iz
+
+    __getitem__(key)
+      Reads a region, e.g. V[10:20,:,500:800]
+    """
+    def __init__(self,path):
+        self.path = path
+        with open(os.path.join(path,META),'r') as fin:
+            meta = json.load(fin)
+        self.shape = tuple(meta['shape'])
+        self.chunks = tuple(meta['chunks'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.compressor = meta['compressor']
+        self.fill_value = meta['fill_value']
+        self.attrs = meta['attrs']
+
+    @classmethod
+    def create(cls,path,shape,chunks,dtype,compressor='zlib',fill_value=0,
+               attrs={}):
+        """
+        Creates the volume directory and header and returns the volume.
+        Existing chunks are kept.
+        """
+        if compressor not in COMPRESSORS:
+            raise ValueError('Unknown compressor: %s' %compressor)
+        os.makedirs(os.path.join(path,CHUNKS),exist_ok=True)
+        meta = {'shape':[int(s) for s in shape],
+                'chunks':[int(c) for c in chunks],
+                'dtype':np.dtype(dtype).str,
+                'compressor':compressor,
+                'fill_value':fill_value,
+                'attrs':attrs}
+        tmp = os.path.join(path,META + '.tmp%d' %os.getpid())
+        with open(tmp,'w') as fout:
+            json.dump(meta,fout)
+        os.replace(tmp,os.path.join(path,META))
+        return cls(path)
+
+    @property
+    def grid(self):
+        """
+        Number of chunks along each axis
+        """
+        return tuple(-(-s // c) for (s,c) in zip(self.shape,self.chunks))
+
+    def chunk_path(self,idx):
+        return os.path.join(self.path,CHUNKS,'.'.join(str(i) for i in idx))
+
+    def chunk_slices(self,idx):
+        """
+        Returns the slices of chunk idx in the volume
+        """
+        return tuple(slice(i*c,min((i + 1)*c,s))
+                     for (i,c,s) in zip(idx,self.chunks,self.shape))
+
+    def chunk_shape(self,idx):
+        return tuple(s.stop - s.start for s in self.chunk_slices(idx))
+
+    def has_chunk(self,idx):
+        return os.path.isfile(self.chunk_path(idx))
+
+    def read_chunk(self,idx):
+        """
+        Returns chunk idx. Raw chunks are memory-mapped read only.
+        """
+        shape = self.chunk_shape(idx)
+        fname = self.chunk_path(idx)
+        if not os.path.isfile(fname):
+            return np.full(shape,self.fill_value,dtype=self.dtype)
+        if self.compressor == 'raw':
+            return np.memmap(fname,dtype=self.dtype,mode='r',shape=shape)
+        with open(fname,'rb') as fin:
+            data = zlib.decompress(fin.read())
+        return np.frombuffer(data,dtype=self.dtype).reshape(shape)
+
+    def write_chunk(self,idx,data):
+        """
+        Writes chunk idx. Chunks equal to the fill value are removed
+        rather than written.
+        """
+        data = np.ascontiguousarray(data,dtype=self.dtype)
+        if data.shape != self.chunk_shape(idx):
+            raise ValueError('Chunk %s has shape %s, expected %s'
+                             %(idx,data.shape,self.chunk_shape(idx)))
+        fname = self.chunk_path(idx)
+        if not np.any(data != self.fill_value):
+            if os.path.isfile(fname): os.remove(fname)
+            return
+        buf = data.tobytes()
+        if self.compressor == 'zlib': buf = zlib.compress(buf,1)
+        tmp = '%s.tmp%d' %(fname,os.getpid())
+        with open(tmp,'wb') as fout:
+            fout.write(buf)
+        os.replace(tmp,fname)
+
+    def write_slab(self,iz,data):
+        """
+        Writes all chunks with z chunk index iz. data covers the full
+        y and x extent of the volume.
+        """
+        zs = self.chunk_slices((iz,0,0))[0]
+        for (iy,ix) in itertools.product(range(self.grid[1]),range(self.grid[2])):
+            (_,ys,xs) = self.chunk_slices((iz,iy,ix))
+            self.write_chunk((iz,iy,ix),data[:,ys,xs])
+
+    def __getitem__(self,key):
+        """
+        Reads the region key, a tuple of up to three slices or integers.
+        Only the chunks covering the region are loaded.
+        """
+        if not isinstance(key,tuple): key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        bounds,squeeze = [],[]
+        for (k,s) in zip(key,self.shape):
+            if isinstance(k,slice):
+                (start,stop,step) = k.indices(s)
+                if step != 1: raise IndexError('Steps are not supported')
+                bounds.append((start,max(start,stop)))
+                squeeze.append(False)
+            else:
+                k = int(k) + s if k < 0 else int(k)
+                if not 0 <= k < s: raise IndexError('Index out of range')
+                bounds.append((k,k + 1))
+                squeeze.append(True)
+        out = np.full([b - a for (a,b) in bounds],self.fill_value,
+                      dtype=self.dtype)
+        ranges = [range(a // c,-(-b // c)) for ((a,b),c) in zip(bounds,self.chunks)]
+        for idx in itertools.product(*ranges):
+            sl = self.chunk_slices(idx)
+            src,dst = [],[]
+            for ((a,b),s) in zip(bounds,sl):
+                (lo,hi) = (max(a,s.start),min(b,s.stop))
+                src.append(slice(lo - s.start,hi - s.start))
+                dst.append(slice(lo - a,hi - a))
+            if not self.has_chunk(idx): continue
+            out[tuple(dst)] = self.read_chunk(idx)[tuple(src)]
+        return out[tuple(0 if q else slice(None) for q in squeeze)]
+
+class CellRegistry(object):
+    """
+    Class used to map cell names to the labels of a label volume. Label 0
+    is the background.
+
+    Attributes
+    ----------
+    cells : list
+      Cell names
+    labels : numpy.ndarray
+      int64 label of each cell
+    overlap : str
+      Overlap policy used when writing the volume, see 
+      geometry.rasterize_polygons()
+
+    Methods
+    -------
+    from_cells(cells,exclude=[],overlap='last')
+      Numbers the sorted cell names from 1
+
+    from_csv(fname,overlap='last')
+      Reads (name,label) rows from a csv file
+
+    load(fname)
+      Reads a registry written by write()
+
+    write(fname)
+      Writes the registry as JSON
+
+    label(names)
+      Returns the labels of names
+    """
+    def __init__(self,cells,labels,overlap='last'):
+        self.cells = list(cells)
+        self.labels = np.asarray(labels,dtype=np.int64)
+        self.overlap = overlap
+        if len(set(self.cells)) != len(self.cells):
+            raise ValueError('Cell names are not unique')
+        if np.any(self.labels < 1):
+            raise ValueError('Labels must be positive, 0 is the background')
+        self._order = np.argsort(np.asarray(self.cells,dtype=str))
+        self._sorted = np.asarray(self.cells,dtype=str)[self._order]
+
+    @classmethod
+    def from_cells(cls,cells,exclude=[],overlap='last'):
+        """
+        Numbers the sorted cell names, e.g. from ParseTrakEM2.get_cells(),
+        from 1. Cells in exclude are left out.
+        """
+        cells = sorted(set(c for c in cells if c not in exclude))
+        return cls(cells,np.arange(1,len(cells) + 1),overlap=overlap)
+
+    @classmethod
+    def from_csv(cls,fname,overlap='last'):
+        """
+        Reads a registry from a csv file with (name,label) rows
+        """
+        with open(fname,'r') as fin:
+            rows = [r for r in csv.reader(fin) if r]
+        return cls([r[0] for r in rows],[int(r[1]) for r in rows],
+                   overlap=overlap)
+
+    @classmethod
+    def load(cls,fname):
+        """
+        Reads a registry written by write()
+        """
+        with open(fname,'r') as fin:
+            reg = json.load(fin)
+        return cls(reg['cells'],reg['labels'],overlap=reg['overlap'])
+
+    def to_dict(self):
+        return {'cells':self.cells,
+                'labels':self.labels.tolist(),
+                'dtype':self.dtype.str,
+                'overlap':self.overlap}
+
+    def write(self,fname):
+        """
+        Writes the registry to fname as JSON. The file is replaced 
+        atomically.
+        """
+        tmp = fname + '.tmp%d' %os.getpid()
+        with open(tmp,'w') as fout:
+            json.dump(self.to_dict(),fout)
+        os.replace(tmp,fname)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self,name):
+        return name in self.cells
+
+    @property
+    def dtype(self):
+        """
+        Smallest unsigned integer dtype that holds all labels
+        """
+        top = int(self.labels.max()) if len(self.labels) else 0
+        for dtype in LABEL_DTYPES:
+            if top <= np.iinfo(dtype).max: return np.dtype(dtype)
+        raise ValueError('Label %d does not fit in uint32' %top)
+
+    def label(self,names):
+        """
+        Returns the int64 labels of a list of cell names. Raises KeyError
+        for names that are not registered.
+        """
+        names = np.asarray(names,dtype=str)
+        if not len(names): return np.zeros(0,dtype=np.int64)
+        pos = np.searchsorted(self._sorted,names)
+        found = pos < len(self._sorted)
+        found[found] = self._sorted[pos[found]] == names[found]
+        missing = ~found
+        if np.any(missing):
+            raise KeyError('Unknown cells: %s' %', '.join(np.unique(names[missing])))
+        return self.labels[self._order[pos]]
+
+def encode_runs(M):
+    """
+    Run-length encodes a boolean array along its last axis
+
+    Parameters
+    ----------
+    M : numpy.ndarray
+      Boolean array with at least 2 dimensions
+
+    Returns
+    -------
+    runs : numpy.ndarray
+      (n,M.ndim + 1) int32 array. Each row is the index of the row of M
+      followed by the start and length of a run of True values.
+    """
+    M = np.asarray(M,dtype=bool)
+    rows = M.reshape(-1,M.shape[-1])
+    pad = np.zeros((rows.shape[0],1),dtype=np.int8)
+    d = np.diff(np.concatenate([pad,rows.view(np.int8),pad],axis=1),axis=1)
+    (r,start) = np.nonzero(d == 1)
+    (_,stop) = np.nonzero(d == -1)
+    idx = np.unravel_index(r,M.shape[:-1])
+    return np.column_stack(idx + (start,stop - start)).astype(np.int32)
+
+def decode_runs(runs,shape):
+    """
+    Returns the boolean array of the given shape encoded by encode_runs()
+    """
+    M = np.zeros(shape,dtype=bool)
+    rows = M.reshape(-1,shape[-1])
+    r = np.ravel_multi_index(tuple(runs[:,:-2].T),shape[:-1])
+    (start,length) = (runs[:,-2],runs[:,-1])
+    #Mark run starts and ends, a cumulative sum fills the runs
+    D = np.zeros((rows.shape[0],shape[-1] + 1),dtype=np.int32)
+    np.add.at(D,(r,start),1)
+    np.add.at(D,(r,start + length),-1)
+    rows[:] = np.cumsum(D[:,:-1],axis=1) > 0
+    return M
+
+def write_crop(fname,M,origin,rle=False,**kwargs):
+    """
+    Writes a cropped mask and its origin to an npz file
+
+    Parameters
+    ----------
+    fname : str
+      Output npz file, replaced atomically
+    M : numpy.ndarray
+      Boolean mask of the crop
+    origin : tuple
+      Position of M[0,0,...] in the full volume
+    rle : bool, Optional, default False
+      If True the mask is stored run-length encoded per row
+    kwargs : 
+      Additional arrays to store
+    """
+    data = dict(kwargs)
+    data['origin'] = np.asarray(origin,dtype=np.int64)
+    data['shape'] = np.asarray(M.shape,dtype=np.int64)
+    if rle:
+        data['runs'] = encode_runs(M)
+    else:
+        data['mask'] = np.asarray(M,dtype=bool)
+    tmp = fname + '.tmp%d' %os.getpid()
+    with open(tmp,'wb') as fout:
+        np.savez_compressed(fout,**data)
+    os.replace(tmp,fname)
+
+def load_crop(fname):
+    """
+    Loads a crop written by write_crop()
+
+    Returns
+    -------
+    (M,origin,data) : the boolean mask, its origin and a dict of all
+      arrays in the file
+    """
+    with np.load(fname,allow_pickle=False) as f:
+        data = dict((k,f[k]) for k in f.files)
+    shape = tuple(data['shape'])
+    if 'runs' in data:
+        M = decode_runs(data['runs'],shape)
+    else:
+        M = data['mask']
+    return M,tuple(int(o) for o in data['origin']),data
@@ -5,6 +5,10 @@ Conversts xml adjacency file to a neighborhood file.
 
 In this formtat, each segment is listed with each of its neighbors
 
+The xml file is streamed in order of the layer names. Cell and layer 
+names are interned to integer ids and adjacencies are summed with numpy
+over (cell,layer,index,neighbor).
+
 created: Christopher Brittin
 date: 21 October 2018
 
@@ -12,35 +16,38 @@ date: 21 October 2018
 
 import os
 import argparse
+from array import array
+from itertools import groupby
+from operator import itemgetter
 from lxml import etree
-import csv
+import numpy as np
 from tqdm import tqdm
 
-class Segment:
-    def __init__(self,cell):
-        self.cell = cell
-        self.neighbors = {}
-
-    def add_neighbor(self,layer,idx,neighbor,adj):
-        if layer not in self.neighbors: self.neighbors[layer] = {}
-        if idx not in self.neighbors[layer]: self.neighbors[layer][idx] = {}
-        if neighbor not in self.neighbors[layer][idx]: self.neighbors[layer][idx][neighbor] = 0
-        self.neighbors[layer][idx][neighbor] += adj
-
-    def write_xml(self,root):
-        for l in self.neighbors:
-            layer = etree.SubElement(root,'layer')
-            layer.set('name',l)
-            for i in self.neighbors[l]:
-               idx = etree.SubElement(layer,'idx')
-               idx.set('value',str(i))
-               for (k,v) in self.neighbors[l][i].items():
-                   neigh = etree.SubElement(idx,'neighbor')
-                   neigh.set('name',k)
-                   neigh.set('adjacency',str(v))
-
-    
-    
+from parsetrakem2.results import iter_adjacency
+
+def first_seen(key):
+    """
+    Returns for each entry the position where its key first occurs
+    """
+    (_,first,inverse) = np.unique(key,return_index=True,return_inverse=True)
+    return first[inverse.ravel()]
+
+def aggregate(cell,layer,idx,neighbor,adj):
+    """
+    Sums adj over (cell,layer,idx,neighbor). Groups are returned in the
+    order they are first seen, nested by cell, layer and idx.
+    """
+    (C,L,I) = (cell.max() + 1,layer.max() + 1,idx.max() + 1)
+    key = cell.astype(np.int64)
+    order = [first_seen(key)]
+    for (k,n) in [(layer,L),(idx,I),(neighbor,C)]:
+        key = key * n + k
+        order.append(first_seen(key))
+    (_,first,inverse) = np.unique(key,return_index=True,return_inverse=True)
+    total = np.bincount(inverse.ravel(),weights=adj).astype(np.int64)
+    rank = np.lexsort([o[first] for o in order[::-1]])
+    first = first[rank]
+    return cell[first],layer[first],idx[first],neighbor[first],total[rank]
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=
@@ -57,40 +64,38 @@ if __name__ == '__main__':
 
     params = parser.parse_args()
 
-    tree = etree.parse(params.xml)
-    root = tree.getroot()
-    layers = sorted([l.get('name') for l in root.findall('layer')])
-    N = {}
+    #Interned cell and layer ids
+    cells,layers = {},{}
+    cell,layer,idx,neighbor,adj = [array('i') for i in range(5)]
+    for (_l,c1,c2,i1,i2,_adj) in tqdm(iter_adjacency(params.xml,sort=True),
+                                      desc="Loading xml data"):
+        l = layers.setdefault(_l,len(layers))
+        c1 = cells.setdefault(c1,len(cells))
+        c2 = cells.setdefault(c2,len(cells))
+        cell.extend((c1,c2))
+        layer.extend((l,l))
+        idx.extend((int(i1),int(i2)))
+        neighbor.extend((c2,c1))
+        adj.extend((int(_adj),int(_adj)))
+
+    cells = list(cells)
+    layers = list(layers)
+    rows = []
+    if len(cell):
+        rows = zip(*[a.tolist() for a in 
+                     aggregate(*[np.frombuffer(a,dtype=np.int32) 
+                                 for a in (cell,layer,idx,neighbor,adj)])])
     
-    for _l in tqdm(layers,desc="Loading xml data"):
-        l = root.find("layer[@name='%s']" %_l)
-        areas = l.findall('area')
-        for a in areas:
-            c1 = a.find('cell1').text
-            c2 = a.find('cell2').text
-            i1 = int(a.find('index1').text)
-            i2 = int(a.find('index2').text)
-            adj = int(a.find('adjacency').text)
-            if c1 not in N: N[c1] = Segment(c1)
-            if c2 not in N: N[c2] = Segment(c2)
-            N[c1].add_neighbor(_l,i1,c2,adj)
-            N[c2].add_neighbor(_l,i2,c1,adj)
-
-    #Set up xml if file if it does not exist
-    data = etree.Element('data')
-    xml_out = etree.tostring(data,pretty_print=False)
-    with open(params.fout,'wb') as fout:
-        fout.write(xml_out)
-            
-    #Open xml file
-    tree = etree.parse(params.fout)
-    root = tree.getroot()
-
-    for (cell,v) in tqdm(N.items(),desc="Writing neighbors to xml"):
-        c = etree.SubElement(root,'cell')
-        c.set('name',cell)
-        v.write_xml(c)
-
-    xml_out = etree.tostring(tree,pretty_print=False)
-    with open(params.fout,'wb') as fout:
-        fout.write(xml_out)
+    with etree.xmlfile(params.fout) as xf:
+        with xf.element('data'):
+            for (c,rows_c) in groupby(rows,key=itemgetter(0)):
+                with xf.element('cell',name=cells[c]):
+                    for (l,rows_l) in groupby(rows_c,key=itemgetter(1)):
+                        with xf.element('layer',name=layers[l]):
+                            for (i,rows_i) in groupby(rows_l,key=itemgetter(2)):
+                                with xf.element('idx',value=str(i)):
+                                    for r in rows_i:
+                                        neigh = etree.Element('neighbor')
+                                        neigh.set('name',cells[r[3]])
+                                        neigh.set('adjacency',str(r[4]))
+                                        xf.write(neigh)
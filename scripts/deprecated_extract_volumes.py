@@ -33,18 +33,17 @@ def worker_0(pid,layers,cell,P,params):
     num_stacks = len(layers)
     V = np.zeros((height,width,num_stacks),dtype=np.uint8)
     stacks = np.zeros(num_stacks)
+    occupied = set(P.get_cell_layers(cell))
     with tqdm(total=len(layers), desc=tqdm_text, position=pid+1) as pbar:
         for (i,(ldx,lname)) in enumerate(layers):
-            B = P.get_boundaries_in_layer(lname,area_thresh = params.area_thresh,
+            stacks[i] = ldx
+            if lname not in occupied:
+                pbar.update(1)
+                continue
+            B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
                                         scale_bounding_box = params.scale_bounding_box,
                                         area_lists=[cell])
-            try:
-                for (k,v) in B[cell].items():
-                    M = v.get_global_display_matrix(height,width)
-                    V[:,:,i] += M
-            except:
-                pass
-            stacks[i] = ldx
+            B.rasterize(V[:,:,i],1,overlap='last')
             pbar.update(1)
 
     fout = f'{params.dout}{cell}_vol_{pid}.npz'
@@ -58,13 +57,10 @@ def worker(pid,layers,cells,P,params):
     stacks = np.zeros(num_stacks)
     with tqdm(total=len(layers), desc=tqdm_text, position=pid+1) as pbar:
         for (i,(ldx,lname)) in enumerate(layers):
-            B = P.get_boundaries_in_layer(lname,area_thresh = params.area_thresh,
+            B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
                                         scale_bounding_box = params.scale_bounding_box)
-            for cell in B.keys():
-                for (k,v) in B[cell].items():
-                    M = v.get_global_display_matrix(height,width)
-                    M = M*cells[cell]
-                    V[:,:,i] += M.astype(np.uint8)
+            labels = np.array([cells[B.cells[c]] for c in B.cell],dtype=np.int64)
+            B.rasterize(V[:,:,i],labels,overlap='last')
             
             pbar.update(1)
 
@@ -81,6 +77,7 @@ def load_data(params):
     inst = manager.ParseTrakEM2(params.trakem2)
     inst.get_layers()
     inst.get_area_lists()
+    inst.index_paths()
     
     layers = sorted(inst.get_layer_list())
     print('Extracted %d layers.' %(len(layers)))
@@ -142,27 +139,21 @@ def mp_chunk_slices(params):
 def worker_3(pid,layers,cells,P,params):
     tqdm_text = f'PID {pid}: layers'
     [height,width] = P.get_layer_dims()
-    V = np.zeros((height,width),dtype=np.uint8)
     cell_names = [c[0] for c in cells]
     cdx = dict([(c[0],int(c[1])) for c in cells])
+    V = np.zeros((height,width),dtype=np.min_scalar_type(max(cdx.values())))
 
     for (ldx,lname) in layers:
-        B = P.get_boundaries_in_layer(lname,area_thresh = params.area_thresh,
+        V[:] = 0
+        B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
                                     scale_bounding_box = params.scale_bounding_box,
                                     area_lists=cell_names)
  
         tqdm_text = f'PID {pid}: layer:#{ldx}:{lname}'
         with tqdm(total=len(cell_names), desc=tqdm_text, position=pid+1) as pbar:
-            for cell in cell_names:
-                try: 
-                    for (k,v) in B[cell].items():
-                        M = v.get_global_display_matrix(height,width)
-                        M = M*cdx[cell] 
-                        V[:,:] += M.astype(np.uint8)
-                except:
-                    pass
-
-                pbar.update(1)
+            labels = np.array([cdx[B.cells[c]] for c in B.cell],dtype=np.int64)
+            B.rasterize(V,labels,overlap='last')
+            pbar.update(len(cell_names))
         
         fout = f'{params.dout}JSH_slice_{ldx}.npz'
         np.savez_compressed(fout,V=V)
@@ -234,22 +225,14 @@ def worker_1(pid,layer,cells,P,params):
     (ldx,lname) = layer 
     cell_names = [c[0] for c in cells]
     cdx = dict([(c[0],int(c[1])) for c in cells])
-    B = P.get_boundaries_in_layer(lname,area_thresh = params.area_thresh,
+    B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
                                     scale_bounding_box = params.scale_bounding_box,
                                     area_lists=cell_names)
 
     with tqdm(total=len(cells), desc=tqdm_text, position=pid+1) as pbar:
-        for cell in cell_names:
-            try: 
-                print(cell)
-                for (k,v) in B[cell].items():
-                    M = v.get_global_display_matrix(height,width)
-                    M = M*cdx[cell]
-                    V[:,:] += M.astype(np.uint8)
-            except:
-                pass
-            
-            pbar.update(1)
+        labels = np.array([cdx[B.cells[c]] for c in B.cell],dtype=np.int64)
+        B.rasterize(V,labels,overlap='last')
+        pbar.update(len(cells))
 
     fout = f'{params.dout}JSH_slice_{ldx}.npz'
     np.savez_compressed(fout,V=V)
@@ -262,20 +245,14 @@ def mp_test(params):
     cell_names = [c[0] for c in cells]
     cdx = dict([(c[0],int(c[1])) for c in cells])
  
-    B = P.get_boundaries_in_layer(lname,area_thresh = params.area_thresh,
-                                    scale_bounding_box = params.scale_bounding_box)
+    B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
+                                    scale_bounding_box = params.scale_bounding_box,
+                                    area_lists=cell_names)
     
     V = np.zeros((height,width),dtype=np.uint8) 
-    for cell in cell_names:
-        try: 
-            print(cell)
-            for (k,v) in B[cell].items():
-                M = v.get_global_display_matrix(height,width)
-                M = M*cdx[cell] 
-                V[:,:] += M.astype(np.uint8)
-        except:
-            pass
-            #print('skipping',cell)
+    labels = np.array([cdx[B.cells[c]] for c in B.cell],dtype=np.int64)
+    B.rasterize(V,labels,overlap='last')
+    cell = cell_names[-1]
     fig,ax = plt.subplots(1,1,figsize=(10,10))
     ax.imshow(V)
     ax.set_title(cell)
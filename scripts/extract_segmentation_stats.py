@@ -19,6 +19,13 @@ Synposis:
 Parameters:
     trakem2 (str):  The file location of the trakem2 file
     fout (str): The file location of the xml file to which data will be written
+    -f, --format (str): Output format. 'xml', 'npz' or 'both'. 'npz' writes a columnar
+                 table with int32 columns layer, cell, index, centx, centy, area and
+                 length, where layer and cell names are int32 codes into the stored 
+                 categories (see parsetrakem2.table). 'both' writes fout as xml and
+                 the table next to it with the extension .npz. (default is xml)
+    --db (str): Also write the segments of each layer to this SQLite database.
+                 Layers are replaced as they are recomputed (see parsetrakem2.store).
 
 """
 import os
@@ -26,6 +33,8 @@ import argparse
 from lxml import etree
 
 from parsetrakem2.parse import ParseTrakEM2
+from parsetrakem2 import table
+from parsetrakem2.store import Store
 
     
 if __name__ == '__main__':
@@ -49,6 +58,25 @@ if __name__ == '__main__':
                                 "considered in the adajancency analysis. "
                                 "DEFAULT = 200. "))    
     
+    parser.add_argument('-f','--format',
+                        dest = 'format',
+                        action = 'store',
+                        required = False,
+                        default = 'xml',
+                        choices = ['xml','npz','both'],
+                        help = ("Output format. 'npz' writes a columnar table "
+                                "with int32 and categorical columns. 'both' "
+                                "writes fout as xml and the table next to it "
+                                "with the extension .npz. DEFAULT = xml."))
+    
+    parser.add_argument('--db',
+                        dest = 'db',
+                        action = 'store',
+                        required = False,
+                        default = None,
+                        help = ("Also write the segments of each layer to "
+                                "this SQLite database (see parsetrakem2.store)."))
+    
     parser.add_argument('--huge_tree',
                         dest='huge_tree',
                         action='store_true',
@@ -58,56 +86,101 @@ if __name__ == '__main__':
                             "throws a 'use XML_PARSE_HUGE option' error.")
                         )
 
+    parser.add_argument('--streaming',
+                        dest='streaming',
+                        action='store_true',
+                        default=False,
+                        required=False,
+                        help=("Stream the TrakEM2 file with iterparse instead of "
+                            "building the full XML tree. Lowers peak memory "
+                            "on large files.")
+                        )
+
+    parser.add_argument('--cache',
+                        dest='cache',
+                        action='store_true',
+                        default=False,
+                        required=False,
+                        help=("Load the geometry from the cache next to the "
+                            "TrakEM2 file. The cache is built on first use and "
+                            "rebuilt when the TrakEM2 file changes.")
+                        )
+
     params = parser.parse_args()
 
     print('TrakEM2 file: %s' %params.trakem2)
     print('Writing to file: %s' %params.fout)
     print('Loading TrakEM2 file...')
-    P = ParseTrakEM2(params.trakem2, huge_tree=params.huge_tree)
+    P = ParseTrakEM2(params.trakem2, huge_tree=params.huge_tree,
+                     streaming=params.streaming, cache=params.cache)
     P.get_layers()
     print('Extracted %d layers.' %(len(P.layers)))
     P.get_area_lists()
+    P.index_paths()
     
     #Set up xml if file if it does not exist
-    if not os.path.isfile(params.fout):
+    fxml = params.fout if params.format != 'npz' else None
+    if fxml and not os.path.isfile(fxml):
         data = etree.Element('data')
         xml_out = etree.tostring(data,pretty_print=False)
-        with open(params.fout,'wb') as fout:
+        with open(fxml,'wb') as fout:
             fout.write(xml_out)
             
     #Open xml file
-    tree = etree.parse(params.fout)
-    root = tree.getroot()
+    if fxml:
+        tree = etree.parse(fxml)
+        root = tree.getroot()
+
+    db = Store(params.db) if params.db else None
 
     print('Processing layers...')
     layers = sorted(P.layers.keys())
+    records = []
     for l in layers:
         print('Processed layer: %s' %l)
         B = P.get_boundaries_in_layer(l,area_thresh = params.area_thresh)
-        xlayer = etree.SubElement(root,'layer')
-        xlayer.set('name',l)
-        root.append(xlayer)
+        _records = []
         for _name in B.keys():
             for idx in B[_name]:
                 B[_name][idx].set_centroid()
                 B[_name][idx].set_boundary_length()
-                xseg = etree.SubElement(xlayer,'segment')
-                cell = etree.SubElement(xseg,'name')
-                cell.text = B[_name][idx].name
-                index = etree.SubElement(xseg,'index')
-                index.text = str(B[_name][idx].index)
-                centx = etree.SubElement(xseg,'centx')
-                centx.text = str(int(B[_name][idx].cent[0]))
-                centy = etree.SubElement(xseg,'centy')
-                centy.text = str(int(B[_name][idx].cent[1]))
-                area = etree.SubElement(xseg,'area')
-                area.text = str(int(B[_name][idx].area))
-                length = etree.SubElement(xseg,'length')
-                length.text = str(int(B[_name][idx].boundary_length))
-
-    xml_out = etree.tostring(tree,pretty_print=False)
-    with open(params.fout,'wb') as fout:
-        fout.write(xml_out)
-    print('Finished!')
-
+                _records.append((l,B[_name][idx].name,B[_name][idx].index,
+                                 int(B[_name][idx].cent[0]),
+                                 int(B[_name][idx].cent[1]),
+                                 int(B[_name][idx].area),
+                                 int(B[_name][idx].boundary_length)))
+        records.extend(_records)
+        if db: db.put_segments(l,[r[1:] for r in _records],z=P.layers[l].z)
+        if not fxml: continue
+        xlayer = etree.SubElement(root,'layer')
+        xlayer.set('name',l)
+        root.append(xlayer)
+        for (_,_name,idx,_centx,_centy,_area,_length) in _records:
+            xseg = etree.SubElement(xlayer,'segment')
+            cell = etree.SubElement(xseg,'name')
+            cell.text = _name
+            index = etree.SubElement(xseg,'index')
+            index.text = str(idx)
+            centx = etree.SubElement(xseg,'centx')
+            centx.text = str(_centx)
+            centy = etree.SubElement(xseg,'centy')
+            centy.text = str(_centy)
+            area = etree.SubElement(xseg,'area')
+            area.text = str(_area)
+            length = etree.SubElement(xseg,'length')
+            length.text = str(_length)
     
+    if db: db.close()
+    if fxml:
+        xml_out = etree.tostring(tree,pretty_print=False)
+        with open(fxml,'wb') as fout:
+            fout.write(xml_out)
+    if params.format != 'xml':
+        ftable = params.fout
+        if params.format == 'both': 
+            ftable = os.path.splitext(params.fout)[0] + '.npz'
+        print('Writing table: %s' %ftable)
+        T = table.from_records(records,table.SEGMENT_COLUMNS,
+                               categorical=['layer','cell'])
+        table.write_table(ftable,T)
+    print('Finished!')
@@ -5,6 +5,28 @@
 Extracts the volumes into 3D arrays. Each cell is stored as a separate 
 array in binary (npy) format.
 
+With --mode chunked the labels are written to a chunked 3D volume in
+dout/volume instead (see parsetrakem2.volume). A sub-volume is read with
+
+    from parsetrakem2.volume import ChunkedVolume
+    V = ChunkedVolume('dout/volume')[z0:z1,y0:y1,x0:x1]
+
+which only loads the chunks covering the region.
+
+In the default slices mode finished slices are recorded with their 
+checksum in dout/manifest.json. Rerunning the same command only redoes
+slices that are missing, failed, or do not match their checksum.
+
+With --mode cells each cell is written to dout/cells/<cell>.npz as a
+boolean mask cropped to its 3D bounding box, together with the origin 
+of the crop (see parsetrakem2.volume.load_crop()).
+
+Labels come from the cell registry in dout/cells.json, which is built 
+from the cells of the TrakEM2 file (or --cell_index) on the first run 
+and reused afterwards. The volume uses the smallest unsigned integer 
+type that holds all labels, and --overlap sets which label is kept where 
+cells overlap.
+
 @author: Christopher Brittin
 @email: "cabrittin"+ <at>+ "gmail"+ "."+ "com"
 @date: 2019-12-05
@@ -15,27 +37,54 @@ from lxml import etree
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 import numpy as np
-from multiprocessing_on_dill.managers import BaseManager
-from multiprocessing_on_dill import Process,Manager,Pool
+import multiprocessing as mp
 import random
 
 from parsetrakem2.parse import ParseTrakEM2
-from pycsvparser import read
+from parsetrakem2.volume import ChunkedVolume, CellRegistry, COMPRESSORS
+from parsetrakem2.volume import write_crop
+from parsetrakem2.jobs import JobManifest
+from parsetrakem2.cache import file_hash
+from parsetrakem2 import geometry
+from parsetrakem2.geometry import OVERLAP
+
+REGISTRY = 'cells.json'
+MANIFEST = 'manifest.json'
+EXCLUDE_CELLS = ['Pharynx','Phi_Marker']
 
 def chunk_list(lst,num_chunks): 
     lst_size = len(lst)
     for (idx,i) in enumerate(range(0,lst_size,num_chunks)):
         yield idx,lst[i:i+num_chunks]
 
+#Workers are forked where possible so that they inherit the geometry
+mp_context = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else None)
+_project = None
+
+def get_project(params):
+    """
+    Returns the indexed ParseTrakEM2 of this process. Workers started with
+    fork inherit the copy loaded by the parent, so each worker reads the 
+    geometry from its own address space without any IPC. Otherwise the 
+    worker loads the file itself, which is fast with --cache where the
+    geometry arrays are memory-mapped and shared through the page cache.
+    With --fix_cell only that area list is read, using the byte offset
+    index next to the TrakEM2 file.
+    """
+    global _project
+    if _project is None:
+        cells = [params.fix_cell] if params.fix_cell else None
+        P = ParseTrakEM2(params.trakem2,cache=params.cache,cells=cells)
+        P.get_layers()
+        P.get_area_lists()
+        P.index_paths()
+        _project = P
+    return _project
+
 def load_data(params):
     print('TrakEM2 file: %s' %params.trakem2)
     
-    BaseManager.register('ParseTrakEM2', ParseTrakEM2)
-    manager = BaseManager()
-    manager.start()
-    inst = manager.ParseTrakEM2(params.trakem2)
-    inst.get_layers()
-    inst.get_area_lists()
+    inst = get_project(params)
     
     layers = sorted(inst.get_layer_list())
     print('Extracted %d layers.' %(len(layers)))
@@ -50,29 +99,133 @@ def load_data(params):
     
     return inst,layers,cells
 
+def load_registry(params,inst):
+    """
+    Returns the CellRegistry of the volume in dout. An existing
+    dout/cells.json is reused so that all runs on a volume use the same
+    labels. Otherwise the registry is read from --cell_index or built 
+    from the cells of the TrakEM2 file and written to dout/cells.json.
+    """
+    fname = os.path.join(params.dout,REGISTRY)
+    if os.path.isfile(fname): return CellRegistry.load(fname)
+    if params.cell_index:
+        reg = CellRegistry.from_csv(params.cell_index,overlap=params.overlap)
+    else:
+        reg = CellRegistry.from_cells(inst.get_cells(),exclude=EXCLUDE_CELLS,
+                                      overlap=params.overlap)
+    os.makedirs(params.dout,exist_ok=True)
+    reg.write(fname)
+    print('Cell registry: %d cells, %s labels' %(len(reg),reg.dtype))
+    return reg
+
+
+def run_params(params):
+    """
+    Parameters recorded in the job manifest. Slices written with other
+    parameters are redone.
+    """
+    return {'trakem2':os.path.abspath(params.trakem2),
+            'area_thresh':params.area_thresh,
+            'scale_bounding_box':params.scale_bounding_box,
+            'registry':load_registry(params,get_project(params)).to_dict()}
+
+def slice_file(params,ldx):
+    return f'{params.dout}JSH_slice_{ldx}.npz'
+
+def save_slice(fout,V):
+    """
+    Writes a layer image under a temporary name and renames it into 
+    place. Returns the sha1 checksum of the file.
+    """
+    tmp = fout + '.tmp%d' %os.getpid()
+    with open(tmp,'wb') as f:
+        np.savez_compressed(f,V=V)
+    os.replace(tmp,fout)
+    return file_hash(fout)
+
+def run_jobs(params,job,layers,jobs,desc):
+    """
+    Runs job on every layer with a pool of params.nproc workers. Layers 
+    are handed out one at a time, so a slow worker never holds back a 
+    fixed share of the layers. Results are recorded in the job manifest
+    as they arrive.
+    """
+    with mp_context.Pool(params.nproc,initializer=init_job,initargs=(params,)) as pool:
+        results = pool.imap_unordered(job,layers)
+        for (ldx,lname,fout,sha1,error) in tqdm(results,total=len(layers),desc=desc):
+            if error is None:
+                jobs.mark_done(lname,fout,sha1=sha1,index=ldx)
+            else:
+                print('Layer %s failed: %s' %(lname,error))
+                jobs.mark_failed(lname,error)
+
+_params = None
+
+def init_job(params):
+    global _params
+    _params = params
 
 def mp_chunk_slices(params):
-    done_slices = []
-    for fname in os.listdir(params.dout):
-        fname = fname.split('_')[-1]
-        idx = int(fname.split('.')[0])
-        done_slices.append(idx)
-    done_slices = sorted(done_slices)
+    """
+    Writes one layer image per layer to dout/JSH_slice_<z>.npz. Finished
+    slices are recorded in dout/manifest.json with their checksum, and
+    only missing, failed or changed slices are done on a rerun.
+    """
     inst,layers,cells = load_data(params)
-    layers = [l for l in layers if l[0] not in done_slices]
-    #layers=layers[60:]
-    #print(layers)
-    #random.shuffle(layers)
-    
-    #cdx = read.into_dict('data/jsh_vol_cell_index.csv')
-    cdx = read.into_dict('data/n2u_vol_cell_index.csv')
-    for (k,v) in cdx.items(): cdx[k] = int(v)
-    
-    num_chunks = len(layers) // params.nproc
+    jobs = JobManifest(os.path.join(params.dout,MANIFEST),run_params(params))
+    todo = [(ldx,lname) for (ldx,lname) in layers if not jobs.is_done(lname)]
+    print('%d of %d slices done.' %(len(layers) - len(todo),len(layers)))
+    run_jobs(params,slice_job,todo,jobs,'Slices')
+
+def slice_job(layer):
+    (ldx,lname) = layer
+    params = _params
+    try:
+        P = get_project(params)
+        reg = load_registry(params,P)
+        V = np.zeros(P.get_layer_dims(),dtype=reg.dtype)
+        rasterize_layer(P,lname,sorted(reg.cells),reg,params,V)
+        fout = slice_file(params,ldx)
+        sha1 = save_slice(fout,V)
+    except Exception as e:
+        return (ldx,lname,None,None,repr(e))
+    return (ldx,lname,fout,sha1,None)
+
+def rasterize_layer(P,lname,cell_names,reg,params,V,pbar=None):
+    """
+    Writes the registry labels of the cells in cell_names in layer lname 
+    into the layer image V. Cells are written in the order of cell_names
+    and overlaps are resolved with the overlap policy of the registry.
+    """
+    B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
+                               scale_bounding_box = params.scale_bounding_box,
+                               area_lists=cell_names)
+    labels = reg.label([B.cells[c] for c in B.cell])
+    B.rasterize(V,labels,overlap=reg.overlap)
+    if pbar is not None: pbar.update(len(cell_names))
+
+def mp_chunked(params):
+    """
+    Writes a chunked label volume to dout/volume (see parsetrakem2.volume). 
+    Each process writes whole z-slabs of chunks, so processes never 
+    write to the same chunk.
+    """
+    inst,layers,cells = load_data(params)
+    reg = load_registry(params,inst)
     
+    [height,width] = inst.get_layer_dims()
+    chunks = [int(c) for c in params.chunks.split(',')]
+    vol = ChunkedVolume.create(os.path.join(params.dout,'volume'),
+                               (len(layers),height,width),chunks,reg.dtype,
+                               compressor=params.compressor,
+                               attrs={'layers':[l for (i,l) in layers],
+                                      'cells':reg.to_dict()})
+    slabs = list(range(vol.grid[0]))
+    num_chunks = max(1,-(-len(slabs) // params.nproc))
+
     procs = []
-    for (job_id,_layers) in chunk_list(layers,num_chunks):
-        proc = Process(target=worker, args=(job_id,_layers,cdx,cells,inst,params,))
+    for (job_id,_slabs) in chunk_list(slabs,num_chunks):
+        proc = mp_context.Process(target=worker_chunked, args=(job_id,_slabs,layers,reg,vol.path,params,))
         procs.append(proc)
         proc.start()
 
@@ -80,75 +233,201 @@ def mp_chunk_slices(params):
     
     print("\n" * (len(procs) + 1)) 
 
-def worker(pid,layers,cdx,cells,P,params):
-    tqdm_text = f'PID {pid}: layers'
+def worker_chunked(pid,slabs,layers,reg,path,params):
+    P = get_project(params)
+    vol = ChunkedVolume(path)
+    cell_names = sorted(reg.cells)
     [height,width] = P.get_layer_dims()
-    V = np.zeros((height,width),dtype=np.uint8)
-    cell_names = sorted([c for c in cdx.keys()])
-    #cdx = dict([(c[0],int(c[1])) for c in cells])
-
-    for (ldx,lname) in layers:
-        B = P.get_boundaries_in_layer(lname,area_thresh = params.area_thresh,
-                                    scale_bounding_box = params.scale_bounding_box,
-                                    area_lists=cell_names)
- 
-        tqdm_text = f'PID {pid}: layer:#{ldx}:{lname}'
-        with tqdm(total=len(cell_names), desc=tqdm_text, position=pid+1) as pbar:
-            for cell in cell_names:
-                try: 
-                    for (k,v) in B[cell].items():
-                        M = v.get_global_display_matrix(height,width)
-                        V[M>0] = cdx[cell]
-                except:
-                    pass
-
+    depth = vol.chunks[0]
+    
+    #Scratch slab on disk, a full slab can be larger than memory
+    scratch = os.path.join(path,'scratch_%d.dat' %pid)
+    S = np.memmap(scratch,dtype=vol.dtype,mode='w+',shape=(depth,height,width))
+    for iz in slabs:
+        zs = vol.chunk_slices((iz,0,0))[0]
+        tqdm_text = f'PID {pid}: slab:#{iz}'
+        with tqdm(total=zs.stop - zs.start, desc=tqdm_text, position=pid+1) as pbar:
+            for (k,(ldx,lname)) in enumerate(layers[zs]):
+                S[k] = 0
+                rasterize_layer(P,lname,cell_names,reg,params,S[k])
                 pbar.update(1)
-        
-        fout = f'{params.dout}JSH_slice_{ldx}.npz'
-        np.savez_compressed(fout,V=V)
+        vol.write_slab(iz,S[:zs.stop - zs.start])
+    del S
+    os.remove(scratch)
 
-def mp_fix_cell(params):
+def occupied_layers(P,layers,cell_names):
+    """
+    Returns the (ldx,lname) entries of layers in which any of the cells
+    in cell_names has segments
+    """
+    occupied = set()
+    for c in cell_names: occupied.update(P.get_cell_layers(c))
+    return [(ldx,lname) for (ldx,lname) in layers if lname in occupied]
+
+def cell_bounding_boxes(P,layers,cell_names,params):
+    """
+    Returns the 3D bounding box of each cell from the path vertices,
+    without rasterizing. Only the layers in which the cells have 
+    segments are read.
+
+    Returns
+    -------
+    bbox : dict
+      bbox[cell] = [z0,y0,x0,z1,y1,x1], inclusive, where z is the index
+      into layers
+    """
+    bbox = {}
+    for (ldx,lname) in tqdm(occupied_layers(P,layers,cell_names),desc='Bounding boxes'):
+        B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
+                                   scale_bounding_box = params.scale_bounding_box,
+                                   area_lists=cell_names)
+        if not len(B): continue
+        bb = geometry.bounding_boxes(np.trunc(B.vertices),B.vertex_offsets)
+        #Boundaries of a cell are contiguous
+        first = np.flatnonzero(np.r_[True,B.cell[1:] != B.cell[:-1]])
+        lo = np.minimum.reduceat(bb[:,:2],first).astype(int)
+        hi = np.maximum.reduceat(bb[:,2:],first).astype(int)
+        for (c,(x0,y0),(x1,y1)) in zip(B.cell[first],lo,hi):
+            b = bbox.setdefault(B.cells[c],[ldx,y0,x0,ldx,y1,x1])
+            b[:] = [min(b[0],ldx),min(b[1],y0),min(b[2],x0),
+                    max(b[3],ldx),max(b[4],y1),max(b[5],x1)]
+    return bbox
+
+def crop_scratch(path,cell):
+    return os.path.join(path,'%s.dat' %cell)
+
+def mp_cells(params):
+    """
+    Writes each cell as a boolean mask cropped to its 3D bounding box to
+    dout/cells/<cell>.npz (see parsetrakem2.volume.write_crop()). The 
+    bounding boxes are computed from the geometry first. Then the layers 
+    are split between processes and every process rasterizes all cells 
+    of its layers into crops on disk, so the layers are only read once.
+    """
     inst,layers,cells = load_data(params)
+    reg = load_registry(params,inst)
+    cell_names = sorted(reg.cells)
+    bbox = cell_bounding_boxes(inst,layers,cell_names,params)
     
-    random.shuffle(layers)
-    cdx = read.into_dict('data/jsh_vol_cell_index.csv')
-    for (k,v) in cdx.items(): cdx[k] = int(v)
+    path = os.path.join(params.dout,'cells')
+    os.makedirs(path,exist_ok=True)
+    for (cell,(z0,y0,x0,z1,y1,x1)) in bbox.items():
+        S = np.memmap(crop_scratch(path,cell),dtype=bool,mode='w+',
+                      shape=(z1 - z0 + 1,y1 - y0 + 1,x1 - x0 + 1))
+        del S
     
-    num_chunks = len(layers) // params.nproc
-
+    #Layers without segments of the cells leave the crops empty
+    occupied = occupied_layers(inst,layers,cell_names)
+    num_chunks = max(1,-(-len(occupied) // params.nproc))
     procs = []
-    for (job_id,_layers) in chunk_list(layers,num_chunks):
-        proc = Process(target=worker_fix, args=(job_id,_layers,cdx,params.fix_cell,inst,params,))
+    for (job_id,_layers) in chunk_list(occupied,num_chunks):
+        proc = mp_context.Process(target=worker_cells, args=(job_id,_layers,bbox,cell_names,path,params,))
         procs.append(proc)
         proc.start()
 
     for proc in procs: proc.join()
     
     print("\n" * (len(procs) + 1)) 
+    names = np.array([l for (i,l) in layers])
+    for (cell,(z0,y0,x0,z1,y1,x1)) in tqdm(bbox.items(),desc='Writing cells'):
+        scratch = crop_scratch(path,cell)
+        S = np.memmap(scratch,dtype=bool,mode='r',
+                      shape=(z1 - z0 + 1,y1 - y0 + 1,x1 - x0 + 1))
+        write_crop(os.path.join(path,'%s.npz' %cell),S,(z0,y0,x0),
+                   rle=params.rle,layers=names[z0:z1 + 1])
+        del S
+        os.remove(scratch)
 
-def worker_fix(pid,layers,cdx,cell_fix,P,params):
-    [height,width] = P.get_layer_dims()
-    cell_names = sorted([c for c in cdx.keys()])
-    #cdx = dict([(c[0],int(c[1])) for c in cells])
-
-    tqdm_text = f'PID {pid}: {cell_fix} layers:'
+def worker_cells(pid,layers,bbox,cell_names,path,params):
+    P = get_project(params)
+    crops = {}
+    tqdm_text = f'PID {pid}: layers'
     with tqdm(total=len(layers), desc=tqdm_text, position=pid+1) as pbar: 
         for (ldx,lname) in layers:
-            vol = f'{params.dout}JSH_slice_{ldx}.npz'
-            V = np.load(vol)['V'] 
-            B = P.get_boundaries_in_layer(lname,area_thresh = params.area_thresh,
-                                    scale_bounding_box = params.scale_bounding_box,
-                                    area_lists=[cell_fix])
-            try: 
-                for (k,v) in B[cell_fix].items():
-                    M = v.get_global_display_matrix(height,width)
-                    #print(cdx[cell_fix])
-                    V[M>0] = cdx[cell_fix]
-            except:
-                    pass
-
+            B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
+                                       scale_bounding_box = params.scale_bounding_box,
+                                       area_lists=cell_names)
+            for (k,x0,y0,M) in geometry.polygon_masks(B.vertices,B.vertex_offsets):
+                cell = B.cells[B.cell[k]]
+                (cz0,cy0,cx0,cz1,cy1,cx1) = bbox[cell]
+                if cell not in crops:
+                    crops[cell] = np.memmap(crop_scratch(path,cell),dtype=bool,
+                                            mode='r+',shape=(cz1 - cz0 + 1,
+                                                             cy1 - cy0 + 1,
+                                                             cx1 - cx0 + 1))
+                (y,x) = (y0 - cy0,x0 - cx0)
+                (h,w) = M.shape
+                crops[cell][ldx - cz0,y:y + h,x:x + w] |= M
             pbar.update(1)
-            np.savez_compressed(vol,V=V)
+    for S in crops.values(): S.flush()
+
+def mp_fix_cell(params):
+    """
+    Redraws params.fix_cell in the finished slices, see redraw_cell(), 
+    and updates their checksums in the manifest. Only the area list of the cell is
+    read from the TrakEM2 file, so the labels come from the existing cell
+    registry in dout. Layers in which the cell has no segments are
+    skipped.
+    """
+    if not os.path.isfile(os.path.join(params.dout,REGISTRY)):
+        print('No cell registry in %s, run the slices first.' %params.dout)
+        return
+    inst,layers,cells = load_data(params)
+    jobs = JobManifest(os.path.join(params.dout,MANIFEST),run_params(params))
+    #Slices without segments of the cell are left as they are
+    occupied = set(inst.get_cell_layers(params.fix_cell))
+    todo = [(ldx,lname) for (ldx,lname) in layers 
+            if lname in occupied and jobs.is_done(lname)]
+    print('%s has segments in %d of %d layers.' %(params.fix_cell,len(occupied),len(layers)))
+    if occupied and not todo:
+        print('None of these slices are finished with the current parameters, '
+              'run the slices first.')
+        return
+    if len(todo) < len(occupied):
+        print('%d of these slices are not finished and are skipped.' 
+              %(len(occupied) - len(todo)))
+    run_jobs(params,fix_job,todo,jobs,params.fix_cell)
+
+def redraw_cell(V,B,cell,reg):
+    """
+    Replaces the pixels of cell in the layer image V by the boundaries B
+    of the cell. The old pixels are cleared first. Where the cell 
+    overlaps other cells, the label follows the overlap policy of the 
+    registry in sorted cell order, as in rasterize_layer(). Pixels the
+    cell used to cover on top of other cells become background.
+    """
+    label = reg.label([cell])[0]
+    V[V == label] = 0
+    M = np.zeros(V.shape,dtype=np.uint8)
+    B.rasterize(M,1)
+    M = M.astype(bool)
+    #Cells that keep their pixels where they overlap cell
+    names = sorted(reg.cells)
+    rank = names.index(cell)
+    if reg.overlap == 'last':
+        keep = names[rank + 1:]
+    else:
+        keep = names[:rank]
+    (y,x) = np.nonzero(M)
+    free = ~np.isin(V[y,x],reg.label(keep))
+    V[y[free],x[free]] = label
+
+def fix_job(layer):
+    (ldx,lname) = layer
+    params = _params
+    try:
+        P = get_project(params)
+        reg = load_registry(params,P)
+        fout = slice_file(params,ldx)
+        V = np.load(fout)['V'] 
+        B = P.get_layer_boundaries(lname,area_thresh = params.area_thresh,
+                                   scale_bounding_box = params.scale_bounding_box,
+                                   area_lists=[params.fix_cell])
+        redraw_cell(V,B,params.fix_cell,reg)
+        sha1 = save_slice(fout,V)
+    except Exception as e:
+        return (ldx,lname,None,None,repr(e))
+    return (ldx,lname,fout,sha1,None)
 
 
 def mp_test(params):
@@ -156,23 +435,12 @@ def mp_test(params):
     [height,width] = P.get_layer_dims()
     layer = layers[0]
     (ldx,lname) = layer 
-    cell_names = [c[0] for c in cells]
-    cdx = dict([(c[0],int(c[1])) for c in cells])
- 
-    B = P.get_boundaries_in_layer(lname,area_thresh = params.area_thresh,
-                                    scale_bounding_box = params.scale_bounding_box)
-    
-    V = np.zeros((height,width),dtype=np.uint8) 
-    for cell in cell_names:
-        try: 
-            print(cell)
-            for (k,v) in B[cell].items():
-                M = v.get_global_display_matrix(height,width)
-                M = M*cdx[cell] 
-                V[:,:] += M.astype(np.uint8)
-        except:
-            pass
-            #print('skipping',cell)
+    reg = load_registry(params,P)
+    cell_names = sorted(reg.cells)
+    
+    V = np.zeros((height,width),dtype=reg.dtype) 
+    rasterize_layer(P,lname,cell_names,reg,params,V)
+    cell = cell_names[-1]
     fig,ax = plt.subplots(1,1,figsize=(10,10))
     ax.imshow(V)
     ax.set_title(cell)
@@ -223,7 +491,84 @@ if __name__ == '__main__':
                         action = 'store',
                         required = False,
                         default = None,
-                        help = ("Cell name to fix")
+                        help = ("Redraw this cell on top of the finished "
+                                "slices. Only its area list is read from the "
+                                "TrakEM2 file.")
+                        )
+
+    parser.add_argument('-m','--mode',
+                        dest = 'mode',
+                        action = 'store',
+                        required = False,
+                        default = 'slices',
+                        choices = ['slices','chunked','cells'],
+                        help = ("'slices' writes one compressed npz file per "
+                                "layer. 'chunked' writes a chunked 3D label "
+                                "volume to dout/volume with a JSON header, "
+                                "where each chunk is compressed on its own and "
+                                "can be read without the rest. 'cells' writes "
+                                "one mask per cell to dout/cells, cropped to "
+                                "the cell's bounding box. DEFAULT = slices.")
+                        )
+
+    parser.add_argument('--rle',
+                        dest = 'rle',
+                        action = 'store_true',
+                        default = False,
+                        required = False,
+                        help = ("Run-length encode the rows of the cell masks "
+                                "written with --mode cells.")
+                        )
+
+    parser.add_argument('--chunks',
+                        dest = 'chunks',
+                        action = 'store',
+                        required = False,
+                        default = '64,512,512',
+                        help = ("Chunk shape z,y,x of the chunked volume. "
+                                "DEFAULT = 64,512,512.")
+                        )
+
+    parser.add_argument('--compressor',
+                        dest = 'compressor',
+                        action = 'store',
+                        required = False,
+                        default = 'zlib',
+                        choices = COMPRESSORS,
+                        help = ("Chunk compression of the chunked volume. 'raw' "
+                                "chunks can be memory-mapped. DEFAULT = zlib.")
+                        )
+
+    parser.add_argument('--cell_index',
+                        dest = 'cell_index',
+                        action = 'store',
+                        required = False,
+                        default = None,
+                        help = ("csv file of (cell,label) rows used to build the "
+                                "cell registry instead of numbering the cells "
+                                "of the TrakEM2 file. Ignored if dout/cells.json "
+                                "exists.")
+                        )
+
+    parser.add_argument('--overlap',
+                        dest = 'overlap',
+                        action = 'store',
+                        required = False,
+                        default = 'last',
+                        choices = OVERLAP,
+                        help = ("Label kept where cells overlap: 'last' or "
+                                "'first' in sorted cell order. Stored in the "
+                                "cell registry. DEFAULT = last.")
+                        )
+
+    parser.add_argument('--cache',
+                        dest='cache',
+                        action='store_true',
+                        default=False,
+                        required=False,
+                        help=("Load the geometry from the cache next to the "
+                            "TrakEM2 file. The cache is built on first use and "
+                            "rebuilt when the TrakEM2 file changes.")
                         )
 
 
@@ -234,8 +579,14 @@ if __name__ == '__main__':
     #mp_by_subvolume(params) 
     #mp_by_cells(params) 
     #mp_by_slice(params) 
-    mp_chunk_slices(params) 
-    #mp_fix_cell(params) 
+    if params.fix_cell:
+        mp_fix_cell(params)
+    elif params.mode == 'chunked':
+        mp_chunked(params)
+    elif params.mode == 'cells':
+        mp_cells(params)
+    else:
+        mp_chunk_slices(params) 
     
     #mp_test(params)
     """
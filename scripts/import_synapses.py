@@ -18,6 +18,7 @@ import numpy as np
 #Local modules
 import aux
 from parsetrakem2.parse import ParseTrakEM2
+from parsetrakem2.index import TrakEM2Index
 from parsetrakem2.tree import extract_area_lists, change_mipmaps_dir, add_synapse_area_lists_to_tree
 import db as db
 
@@ -232,7 +233,8 @@ if __name__=="__main__":
     
     for c in syn_remove: del syn[c]
     
-    tree = etree.parse(cfg[tkey]['trakem2'])
+    #Only the area list of the cell is read, see parsetrakem2.index
+    tree = TrakEM2Index(cfg[tkey]['trakem2']).tree(params.cell)
     
     #Setup directory
     if cfg.getboolean(tkey,'make_dir'):
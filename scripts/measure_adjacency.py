@@ -21,7 +21,20 @@ Adjacency data is written to an xml file, which can be easily updated. It's poss
 to look at only specific layers rather than all of the layers. In this case, only the 
 specified layers will be updated. 
 
-To speed up processing, layers can be processed over multiple CPUs.    
+While running, the records of each layer are appended to fout.journal and flushed 
+to disk, and the layer is marked as complete in fout.manifest. The xml file is 
+written once, at the end of the run. If a run is interrupted, restart it with 
+--resume and the same parameters to skip the completed layers.
+
+To speed up processing, layers can be processed over multiple CPUs. A single
+pool of workers is started for the whole run. The boundaries and candidate pairs
+of each layer are published once in shared memory and each task only passes a
+range of pair indices. With the kdtree engine each worker keeps the k-d trees
+it builds for a layer and reuses them in its later tasks of that layer. The cost
+of each pair is estimated from its point counts and pairs are split into many 
+ranges of about equal cost, queued most expensive first. The next layer is 
+queued before the current one is collected, so the workers stay busy until the
+end of the run.
 
 Code has only been tested on Linux OS. If running on Windows there may be formatting
 issues with reading/writing to files.  
@@ -53,10 +66,35 @@ Parameters:
     -s, --scale_bounding_box (float): Scales the bounding box. Set to greater than 1
                 to ensure that all adjacent boundaries are identified in the preprocessing
                 step of looking for overlapping boundary boxes. (default is 1.1)
-    -n, --nprox (int): Number of CPU(s) used to process each layer. (default is 1)
+    -n, --nproc (int): Number of CPU(s) used to process each layer. (default is 1)
+    -e, --engine (str): Adjacency engine. 'cdist' builds the full distance matrix
+                of each boundary pair. 'kdtree' uses k-d trees, built once per
+                boundary and worker, so memory scales with the number of boundary points.
+                Both engines give identical output. 'raster' rasterizes all
+                filled boundaries of a layer into a label image and reads each 
+                boundary pixel's neighbors within pixel_radius from the image, 
+                so every pair in the layer is measured at once and no bounding 
+                box test is needed (-s and -n are ignored). Results follow the 
+                point distance definition except that repeated boundary points 
+                count once, boundary points inside another cell count as 
+                adjacent to it, and where filled boundaries overlap only the 
+                boundary drawn last is visible. (default is cdist)
     -l, --layers (str): Specify which layers to process. Separate multiple layers
                  by a ','. Make sure to use the layer names in the trakem2 file. 
                  If not specified, then all layers will be processed. 
+    -f, --format (str): Output format. 'xml', 'npz' or 'both'. 'npz' writes a columnar
+                 table with int32 columns layer, cell1, cell2, index1, index2 and 
+                 adjacency, where layer and cell names are int32 codes into the
+                 stored categories (see parsetrakem2.table). 'both' writes fout as
+                 xml and the table next to it with the extension .npz. 
+                 (default is xml)
+    --db (str): Also write the adjacencies of each layer to this SQLite database.
+                 Layers are replaced as they are recomputed (see parsetrakem2.store).
+    --resume: Skip layers completed by an interrupted run with the same parameters.
+    --streaming: Stream the TrakEM2 file with iterparse rather than building the
+                 full XML tree. Use for files too large to hold in memory.
+    --cache: Load the geometry from the on-disk cache next to the TrakEM2 file,
+                 building it on the first run.
 
 
 Examples:
@@ -68,16 +106,34 @@ Examples:
 
   Specify layers to be processed
      python measure_adjacency.py /path/to/trakem2 /path/to/xml -l LAYER1,LAYER2,LAYER3
+
+  Write the xml and a columnar table /path/to/adjacency.npz
+     python measure_adjacency.py /path/to/trakem2 /path/to/adjacency.xml -f both
    
 
 """
 import os
 import argparse
-import multiprocessing_on_dill as mp
+import multiprocessing as mp
 import time
-from lxml import etree
+from collections import deque, OrderedDict
+import numpy as np
+
+from parsetrakem2.parse import ParseTrakEM2, ENGINES
+from parsetrakem2 import geometry
+from parsetrakem2 import shared
+from parsetrakem2.journal import AdjacencyJournal
+from parsetrakem2.store import Store
+
+#Target number of tasks per worker and layer
+TASKS_PER_PROC = 8
+
+#Layers queued on the pool ahead of the layer being collected
+PREFETCH = 1
 
-from trakem2.parse import ParseTrakEM2
+#k-d trees built by a worker, per layer. Tasks of a layer that run on
+#the same worker reuse the trees of earlier tasks.
+_trees = OrderedDict()
 
 def time_string(_seconds):
     day = _seconds // (24 * 3600)
@@ -89,9 +145,100 @@ def time_string(_seconds):
     seconds = _seconds
     return "%d:%d:%d:%d" % (day, hour, minutes, seconds)
 
-def submit_batch(P,o,pixel_radius):
-    adj = P.batch_compute_adjacency(o,pixel_radius)
-    return adj
+def layer_trees(spec):
+    """
+    Returns the k-d tree cache of the layer published under spec. Caches 
+    are kept for as many layers as shared.attach() keeps attached.
+    """
+    key = spec['coords'][0]
+    if key in _trees:
+        _trees.move_to_end(key)
+    else:
+        _trees[key] = {}
+        while len(_trees) > shared.MAX_ATTACHED: _trees.popitem(last=False)
+    return _trees[key]
+
+def submit_range(spec,start,stop,pixel_radius,engine):
+    """
+    Computes the adjacency of the shared pairs start to stop. Returns the
+    pair indices and lengths of the adjacent pairs.
+    """
+    A = shared.attach(spec)
+    trees = layer_trees(spec) if engine == 'kdtree' else None
+    adj = geometry.pair_adjacency(A['coords'],A['offsets'],
+                                  A['I'][start:stop],A['J'][start:stop],
+                                  pixel_radius=pixel_radius,engine=engine,
+                                  trees=trees)
+    k = np.flatnonzero(adj)
+    return start + k,adj[k]
+
+def submit_layer(pool,nproc,B,I,J,pixel_radius,engine):
+    """
+    Publishes the pairs (I,J) of the LayerBoundaries B and queues them on
+    the pool. Pairs are split into ranges of about equal estimated cost,
+    queued most expensive first. Returns the shared arrays and the 
+    pending results.
+    """
+    S = shared.SharedArrays(coords=B.coords,offsets=B.offsets,I=I,J=J)
+    cost = geometry.pair_costs(B.offsets,I,J,engine)
+    ranges = geometry.partition_costs(cost,nproc*TASKS_PER_PROC)
+    results = [pool.apply_async(submit_range,
+                                (S.spec,a,b,pixel_radius,engine))
+               for (a,b) in ranges]
+    return S,results
+
+def collect_layer(S,results):
+    """
+    Waits for the results of submit_layer() and releases the shared 
+    arrays. Returns the pair indices and lengths of the adjacent pairs
+    in pair order.
+    """
+    try:
+        results = [r.get() for r in results]
+    finally:
+        S.close()
+    if not results: return np.zeros(0,dtype=int),np.zeros(0,dtype=int)
+    k = np.concatenate([r[0] for r in results])
+    adj = np.concatenate([r[1] for r in results])
+    order = np.argsort(k)
+    return k[order],adj[order]
+
+def to_boundaries(B,I,J,k,adj):
+    return [(B.boundary(I[_k]),B.boundary(J[_k]),a)
+            for (_k,a) in zip(k.tolist(),adj.tolist())]
+
+def process_layers(P,layers,pool,params):
+    """
+    Yields (layer,adj) for each layer in order, where adj is a list of
+    (B1,B2,adj_12). With a pool, the pairs of the next PREFETCH layers
+    are queued before the results of the current layer are collected,
+    so the workers are kept busy while layers are loaded and written.
+    """
+    pending = deque()
+    for l in layers:
+        if params.engine == 'raster':
+            B = P.get_layer_boundaries(l,area_thresh = params.area_thresh)
+            yield l,P.compute_layer_adjacency(B,pixel_radius=params.pixel_radius)
+            continue
+        B = P.get_layer_boundaries(l,area_thresh = params.area_thresh,
+                                   scale_bounding_box = params.scale_bounding_box)
+        (I,J) = P.get_overlapping_pairs(B)
+        if pool is None:
+            adj = geometry.pair_adjacency(B.coords,B.offsets,I,J,
+                                          pixel_radius=params.pixel_radius,
+                                          engine=params.engine)
+            k = np.flatnonzero(adj)
+            yield l,to_boundaries(B,I,J,k,adj[k])
+            continue
+        pending.append((l,B,I,J,submit_layer(pool,params.nproc,B,I,J,
+                                              params.pixel_radius,
+                                              params.engine)))
+        if len(pending) > PREFETCH:
+            (l,B,I,J,job) = pending.popleft()
+            yield l,to_boundaries(B,I,J,*collect_layer(*job))
+    while pending:
+        (l,B,I,J,job) = pending.popleft()
+        yield l,to_boundaries(B,I,J,*collect_layer(*job))
     
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__,
@@ -153,6 +300,69 @@ if __name__ == '__main__':
                                 "Must use layer name specified in "
                                 "//t2_patch/@title in TrakEM2 file."))
 
+    parser.add_argument('-e','--engine',
+                        dest = 'engine',
+                        action = 'store',
+                        required = False,
+                        default = 'cdist',
+                        choices = ENGINES + ['raster'],
+                        help = ("Adjacency engine. 'cdist' computes the full "
+                                "distance matrix of each boundary pair, 'kdtree' "
+                                "queries k-d trees and needs far less memory "
+                                "for long boundaries. Both give the same "
+                                "result. 'raster' measures all pairs of a "
+                                "layer at once from a label image. "
+                                "DEFAULT = cdist."))
+
+    parser.add_argument('-f','--format',
+                        dest = 'format',
+                        action = 'store',
+                        required = False,
+                        default = 'xml',
+                        choices = ['xml','npz','both'],
+                        help = ("Output format. 'npz' writes a columnar table "
+                                "with int32 and categorical columns. 'both' "
+                                "writes fout as xml and the table next to it "
+                                "with the extension .npz. DEFAULT = xml."))
+
+    parser.add_argument('--db',
+                        dest = 'db',
+                        action = 'store',
+                        required = False,
+                        default = None,
+                        help = ("Also write the adjacencies of each layer to "
+                                "this SQLite database (see parsetrakem2.store)."))
+
+    parser.add_argument('--resume',
+                        dest='resume',
+                        action='store_true',
+                        default=False,
+                        required=False,
+                        help=("Skip layers completed by a previous run with the "
+                            "same parameters. Completed layers are read from "
+                            "fout.journal and fout.manifest.")
+                        )
+
+    parser.add_argument('--streaming',
+                        dest='streaming',
+                        action='store_true',
+                        default=False,
+                        required=False,
+                        help=("Stream the TrakEM2 file with iterparse instead of "
+                            "building the full XML tree. Lowers peak memory "
+                            "on large files.")
+                        )
+
+    parser.add_argument('--cache',
+                        dest='cache',
+                        action='store_true',
+                        default=False,
+                        required=False,
+                        help=("Load the geometry from the cache next to the "
+                            "TrakEM2 file. The cache is built on first use and "
+                            "rebuilt when the TrakEM2 file changes.")
+                        )
+
     
     params = parser.parse_args()
 
@@ -160,78 +370,48 @@ if __name__ == '__main__':
     print('Writing to file: %s' %params.fout)
     print('Running %d jobs' %params.nproc) 
     print('Loading TrakEM2 file...')
-    P = ParseTrakEM2(params.trakem2)
+    P = ParseTrakEM2(params.trakem2,streaming=params.streaming,
+                     cache=params.cache)
     P.get_layers()
     print('Extracted %d layers.' %(len(P.layers)))
     P.get_area_lists()
     print('Extracted %d area lists.' %(len(P.area_lists)))    
+    P.index_paths()
     if params.layers:
         print('Analyzing layers: %s' %params.layers)
         layers = params.layers.split(',')
+    else:
         layers = sorted(P.layers.keys())
     
 
-    #Set up xml if file if it does not exist
-    if not os.path.isfile(params.fout):
-        data = etree.Element('data')
-        xml_out = etree.tostring(data,pretty_print=False)
-        with open(params.fout,'wb') as fout:
-            fout.write(xml_out)
-            
-    #Open xml file
-    tree = etree.parse(params.fout)
-    root = tree.getroot()
+    #Checkpointed output. Completed layers are skipped on --resume
+    run_params = {'trakem2':os.path.abspath(params.trakem2),
+                  'pixel_radius':params.pixel_radius,
+                  'area_thresh':params.area_thresh,
+                  'scale_bounding_box':params.scale_bounding_box,
+                  'engine':params.engine}
+    journal = AdjacencyJournal(params.fout,run_params,resume=params.resume)
+    done = [l for l in layers if l in journal.completed]
+    if done: print('Resuming. Skipping %d completed layers.' %len(done))
+    layers = [l for l in layers if l not in journal.completed]
 
-    #Add layers not previously analyzed
-    curr_layers = [l.get('name') for l in root.findall('layer')]
-    for l in layers:
-        if l in curr_layers:
-            xlayer = root.find("layer[@name='%s']" %l)
-            root.remove(xlayer)
-        _l = etree.SubElement(root,'layer')
-        _l.set('name',l)
-        root.append(_l) 
-    xml_out = etree.tostring(tree,pretty_print=False)
-    with open(params.fout,'wb') as fout:
-            fout.write(xml_out)
+    db = Store(params.db) if params.db else None
 
+    pool = None
+    if params.nproc > 1 and params.engine != 'raster':
+        pool = mp.Pool(processes = params.nproc)
 
     print('Processing layers...')
     N = len(layers)
     idx = 0
     __end = '\r'
     time0 = time.time()
-    for l in layers:
-        time1 = time.time()
-        B = P.get_boundaries_in_layer(l,area_thresh = params.area_thresh,
-                                      scale_bounding_box = params.scale_bounding_box)
-        overlap = P.get_overlapping_boundaries(B)        
-
-        if params.nproc == 1:
-            adj = P.batch_compute_adjacency(overlap,
-                                            pixel_radius=params.pixel_radius)
-        else:
-            overlap_split = [overlap[i::params.nproc] for i in range(params.nproc)]
-            pool = mp.Pool(processes = params.nproc)
-            results = [pool.apply_async(submit_batch,
-                                        args=(P,o,params.pixel_radius,))
-                       for o in overlap_split]
-            adj = [o for p in results for o in p.get()]
-
-          
-        xlayer = root.find("layer[@name='%s']" %l)
-        for (b1,b2,_adj) in adj:
-            xarea = etree.SubElement(xlayer,'area')
-            cell1 = etree.SubElement(xarea,'cell1')
-            cell1.text = b1.name
-            cell2 = etree.SubElement(xarea,'cell2')
-            cell2.text = b2.name
-            idx1 = etree.SubElement(xarea,'index1')
-            idx1.text = str(b1.index)
-            idx2 = etree.SubElement(xarea,'index2')
-            idx2.text = str(b2.index)     
-            xadj = etree.SubElement(xarea,'adjacency')
-            xadj.text = str(_adj)             
+    time1 = time.time()
+    for (l,adj) in process_layers(P,layers,pool,params):
+        records = [(b1.name,b2.name,b1.index,b2.index,_adj) 
+                   for (b1,b2,_adj) in adj]
+        journal.write_layer(l,records)
+        if db: db.put_adjacency(l,records,z=P.layers[l].z)
             
         idx += 1
         if idx == N: __end = '\n'
@@ -241,10 +421,20 @@ if __name__ == '__main__':
               "Time to process last layer: %2.3f sec. "
               "Total processing time: %s. "
               %(idx,N,l,len(adj),time.time() - time1,proc_time),end=__end)
-    
-        xml_out = etree.tostring(tree,pretty_print=False)
-        with open(params.fout,'wb') as fout:
-            fout.write(xml_out)
+        time1 = time.time()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if db: db.close()
+    print('Exporting journal to %s' %params.fout)
+    if params.format == 'npz':
+        journal.export_table(params.fout)
+    else:
+        journal.export_xml()
+    if params.format == 'both':
+        ftable = os.path.splitext(params.fout)[0] + '.npz'
+        print('Exporting journal to %s' %ftable)
+        journal.export_table(ftable)
     print('Finished!')
 
     
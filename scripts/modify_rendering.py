@@ -5,11 +5,16 @@
 
 Modifies the rendering by keeping only the desired segments.
 
+The TrakEM2 file is filtered in a single streaming pass (see 
+parsetrakem2.tree.filter_trakem2()): cell selection, Z-range and ROI 
+restriction, the mipmaps directory and the colors are applied while the
+file is copied, so the file is never loaded as a whole.
+
 !!!!IMPORTANT!!!!
-The output xml file will not have the appropriate header in order
-to be read by TrakEM2. You will need insert the header yourself.
-An accompanying header file is provided in mat/. In linux you
-can combine the files with the 'cat' command e.g.
+TrakEM2 needs the DOCTYPE header in front of the xml. If [input] header
+is set in the config file (e.g. mat/header.txt) it is written to the
+output directly. Otherwise you will need to insert the header yourself,
+e.g. in linux
 
 cat /mat/header.txt output.xml > trakem2_readable.xml
 
@@ -36,7 +41,6 @@ from configparser import ConfigParser,ExtendedInterpolation
 from lxml import etree
 
 import aux
-from parsetrakem2.parse import ParseTrakEM2
 from parsetrakem2.tree import *
 
 
@@ -53,59 +57,38 @@ if __name__=="__main__":
     cfg.read(params.config)
         
     cells = aux.read.into_list(cfg['input']['cells'])
-    #P = ParseTrakEM2(cfg['trakem2'])
-
-    tree = etree.parse(cfg['input']['trakem2'])
-    fix_calibration(tree)
 
     #Setup directory
+    mipmaps = None
     if cfg.getboolean('output','make_dir'):
         if not os.path.exists(cfg['output']['dname']): os.makedirs(cfg['output']['dname'])
-        change_mipmaps_dir(tree,cfg['output']['mipmaps'])
+        mipmaps = cfg['output']['mipmaps']
 
-    extract_area_lists(tree,cells)
-    
-    P = ParseTrakEM2(cfg['input']['trakem2'])
-    P.get_area_lists()
-    P.get_layers()
-    layers = sorted(P.layers.keys())
-
-    
+    zrange = None
     if cfg.getboolean('params','modify_Z'):
-        zmin = cfg.getint('params','zmin')
-        zmax = cfg.getint('params','zmax')
-        layers = layers[zmin:zmax + 1]
-        oids = [P.layers[l].oid for l in layers]
-        restrict_segments_by_oid(tree,oids)      
+        zrange = (cfg.getint('params','zmin'),cfg.getint('params','zmax'))
 
+    roi = None
     if cfg.getboolean('params','modify_ROI'):
-        oids = [P.layers[l].oid for l in layers]
         roi = [int(i) for i in cfg['params']['roi'].split(',')]
-        restrict_segments_by_roi(tree,roi,if_check=True)      
     
-    #if cfg.getboolean('params','modify_ROI'):
-    #    oids = [P.layers[l].oid for l in layers]
-    #    restrict_segments_by_roi(tree,[2166,1000,4446,5472],if_check=True)      
-    
-
-    xml_out = etree.tostring(tree,pretty_print=False)
-    with open(cfg['output']['fout'],'wb') as fout:
-        fout.write(xml_out)
-
+    styles = None
     if cfg.getboolean('params','modify_color'):
         nclass = aux.read.into_dict(cfg['input']['nclass'])
         color = aux.read.into_dict2(cfg['input']['color'])
-        P = ParseTrakEM2(cfg['output']['fout'])
-        P.get_area_lists()
         cols = []
-        for n in tqdm(P.area_lists,desc='Setting colors'):
-            if n in nclass:
-                try:
-                    cols.append([n,color[nclass[n]][0],float(color[nclass[n]][1])])
-                except:
-                    cols.append([n,color[nclass[n]][0]])
-        P.set_fill(cols)
-        P.xml.write(cfg['output']['fout'],pretty_print=True)
+        for (n,c) in nclass.items():
+            #Classes without a color are left as they are
+            if c not in color: continue
+            try:
+                cols.append([n,color[c][0],float(color[c][1])])
+            except (IndexError,ValueError):
+                cols.append([n,color[c][0]])
+        styles = fill_styles(cols)
+    
+    filter_trakem2(cfg['input']['trakem2'],cfg['output']['fout'],
+                   cells=cells,zrange=zrange,roi=roi,mipmaps=mipmaps,
+                   styles=styles,header=cfg.get('input','header',fallback=None),
+                   huge_tree=True)
 
     print('Finished!')
-
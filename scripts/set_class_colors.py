@@ -3,10 +3,14 @@ set_class_colors.py
 
 Sets the fill colors for area_lists in the trakem2 xml file.
 
+The file is copied in a single streaming pass 
+(parsetrakem2.tree.filter_trakem2()), so files too large to load as a
+tree can be recolored. All styles are applied in the same pass.
+
 !!!!IMPORTANT!!!!
-The output xml file will not have the appropriate header in order
-to be read by TrakEM2. You will need insert the header yourself.
-An accompanying header file is provided in mat/. In linux you
+TrakEM2 needs the DOCTYPE header in front of the xml. If --header is
+given (e.g. mat/header.txt) it is written to the output directly. 
+Otherwise you will need insert the header yourself. In linux you
 can combine the files with the 'cat' command e.g.
 
 cat /mat/header.txt output.xml > trakem2_readable.xml
@@ -26,20 +30,21 @@ Required 3rd party packages:
 
 
 Synopsis:
- python set_class_colors.py -t /path/to/trakem2 -n /path/to/class/file -c /path/to/color/code/file -o /path/to/output/xml
+ python set_class_colors.py -t /path/to/trakem2 -n /path/to/class/file -c /path/to/color/code/file -o /path/to/output/xml [--header mat/header.txt]
 
 Parameters:
   -t, --trakem2 (str): Trakem2 file
   -n, --nclass  (str): Class file which maps area_list names to classes
   -c, --color   (str): Color code file maps colors to classes
   -o, --output  (str): Output file
+  --header      (str): Header file written in front of the output
 
 """
 import argparse
 
 #Local modules
 from pycsvparser import read
-from parsetrakem2.parse import ParseTrakEM2
+from parsetrakem2.tree import filter_trakem2, fill_styles
 
 
 
@@ -80,18 +85,25 @@ if __name__ == '__main__':
                         default = None,
                         help="Output xml file"
                         )
+
+    parser.add_argument('--header',
+                        dest = 'header',
+                        action="store",
+                        required= False,
+                        default = None,
+                        help="Header file written in front of the output"
+                        )
     
     params = parser.parse_args()
     nclass = read.into_dict(params.nclass)
     color = read.into_dict(params.color,multi_dim=True)
-    P = ParseTrakEM2(params.trakem2)
-    P.get_area_lists()
     cols = []
-    for n in P.area_lists:
-        if n in nclass:
-            try:
-                cols.append([n,color[nclass[n]][0],float(color[nclass[n]][1])])
-            except:
-                cols.append([n,color[nclass[n]][0]])
-    P.set_fill(cols)
-    P.xml.write(params.fout,pretty_print=True)
+    for (n,c) in nclass.items():
+        #Classes without a color are left as they are
+        if c not in color: continue
+        try:
+            cols.append([n,color[c][0],float(color[c][1])])
+        except (IndexError,ValueError):
+            cols.append([n,color[c][0]])
+    filter_trakem2(params.trakem2,params.fout,styles=fill_styles(cols),
+                   calibration=False,header=params.header,huge_tree=True)
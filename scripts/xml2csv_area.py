@@ -3,15 +3,19 @@ xml2csv_area.py
 
 Conversts xml output from extract_segmentation_stats.py to csv 
 
+The xml file is streamed and rows are written sorted by layer name. At
+most one layer is held in memory.
+
 created: Christopher Brittin
 date: 21 October 2018
 
 """
 
 import argparse
-from lxml import etree
 import csv
 
+from parsetrakem2.results import iter_segments
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=
                                      ("Measure adjaceny in segmented" 
@@ -26,23 +30,9 @@ if __name__ == '__main__':
 
     params = parser.parse_args()
 
-    tree = etree.parse(params.xml)
-    root = tree.getroot()
-    layers = sorted([l.get('name') for l in root.findall('layer')])
-    data = [['layer_name','object_name','object_index','center_x','center_y','area','boundary_length']]
-    for _l in layers:
-        l = root.find("layer[@name='%s']" %_l)
-        segments = l.findall('segment')
-        for s in segments :
-            name = s.find('name').text
-            index = s.find('index').text
-            centx = s.find('centx').text
-            centy = s.find('centy').text
-            area = s.find('area').text
-            length = s.find('length').text 
-            data.append([_l,name,index,centx,centy,area,length])
-    
-
+    header = ['layer_name','object_name','object_index','center_x','center_y','area','boundary_length']
     with open(params.fout, "w") as f:
         writer = csv.writer(f)
-        writer.writerows(data)
+        writer.writerow(header)
+        for row in iter_segments(params.xml,sort=True):
+            writer.writerow(row)
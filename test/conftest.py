@@ -0,0 +1,104 @@
+"""
+conftest.py
+
+Synthetic TrakEM2 files shared by the tests.
+
+Outlines only have horizontal, vertical or diagonal edges, so every
+lattice point on an edge is known exactly and the reference masks do not
+depend on the code under test.
+
+"""
+import pytest
+
+#Command line script run by hand on a real TrakEM2 file, not a test module
+collect_ignore = ['test_parsetrakem2.py']
+
+WIDTH = 120
+HEIGHT = 100
+LAYERS = ['L001','L002']
+
+#CELLS[cell][layer] = list of outlines, each a list of (x,y) vertices in
+#area list coordinates. Every cell has the transform TRANSFORMS[cell].
+CELLS = {
+    #Rectangle and an L shape in the same layer
+    'rect':{'L001':[[(10,10),(30,10),(30,25),(10,25)],
+                    [(40,40),(60,40),(60,50),(50,50),(50,70),(40,70)]],
+            'L002':[[(5,60),(25,60),(25,80),(5,80)]]},
+    #Overlaps rect in both layers
+    'over':{'L001':[[(20,15),(45,15),(45,45),(20,45)]],
+            'L002':[[(15,70),(35,70),(35,90),(15,90)]]},
+    #Touches the frame at x = 0 and y = 0 and runs over the far edges
+    'edge':{'L001':[[(0,0),(8,0),(8,6),(0,6)],
+                    [(110,85),(130,85),(130,110),(110,110)]],
+            'L002':[[(-10,30),(12,30),(12,44),(-10,44)]]},
+    #Diamond with diagonal edges and a concave arrow
+    'diag':{'L001':[[(80,10),(90,20),(80,30),(70,20)]],
+            'L002':[[(60,10),(90,10),(90,40),(75,25),(60,40)]]},
+    #Two subpaths of one path, see PATHS
+    'multi':{'L002':[[(95,50),(105,50),(105,60),(95,60)],
+                     [(95,65),(105,65),(105,75),(95,75)]]},
+    }
+TRANSFORMS = dict((c,(0,0)) for c in CELLS)
+TRANSFORMS['diag'] = (3,-2)
+#Cells whose outlines are written as subpaths of a single t2_path
+MULTI = ['multi']
+
+def path_string(outlines):
+    return ' '.join('M ' + ' L '.join('%d %d' %p for p in v) + ' z'
+                    for v in outlines)
+
+def write_trakem2(fname,cells=CELLS,transforms=TRANSFORMS,layers=LAYERS,
+                  width=WIDTH,height=HEIGHT):
+    """
+    Writes a minimal TrakEM2 file with one patch per layer and the area
+    lists in cells
+    """
+    oids = dict((l,str(100 + i)) for (i,l) in enumerate(layers))
+    lines = ['<?xml version="1.0" encoding="ISO-8859-1"?>','<trakem2>',
+             '<project id="0" title="test" mipmaps_folder="mm/">']
+    for (i,c) in enumerate(cells):
+        lines.append('<neuron id="%d" title="%s"><area_list oid="%d" id="%d"/>'
+                     '</neuron>' %(1000 + i,c,2000 + i,3000 + i))
+    lines.append('</project>')
+    lines.append('<t2_layer_set oid="3" layer_width="%d.0" layer_height="%d.0">'
+                 %(width,height))
+    lines.append('<t2_calibration pixelWidth="1.0" pixelHeight="1.0" '
+                 'pixelDepth="1.0" unit="pixel"/>')
+    for (i,l) in enumerate(layers):
+        lines.append('<t2_layer oid="%s" thickness="1.0" z="%d.0" title="">'
+                     %(oids[l],i))
+        lines.append('<t2_patch oid="%d" width="%d.0" height="%d.0" '
+                     'transform="matrix(1.0,0.0,0.0,1.0,0.0,0.0)" title="%s.tif"/>'
+                     %(500 + i,width,height,l))
+        lines.append('</t2_layer>')
+    for (i,c) in enumerate(cells):
+        lines.append('<t2_area_list oid="%d" title="%s" '
+                     'transform="matrix(1.0,0.0,0.0,1.0,%d.0,%d.0)">'
+                     %(2000 + i,c,transforms[c][0],transforms[c][1]))
+        for (l,outlines) in cells[c].items():
+            lines.append('<t2_area layer_id="%s">' %oids[l])
+            if c in MULTI:
+                lines.append('<t2_path d="%s"/>' %path_string(outlines))
+            else:
+                for v in outlines:
+                    lines.append('<t2_path d="%s"/>' %path_string([v]))
+            lines.append('</t2_area>')
+        lines.append('</t2_area_list>')
+    lines.append('</t2_layer_set>')
+    lines.append('</trakem2>')
+    with open(fname,'w') as fout:
+        fout.write('\n'.join(lines))
+
+@pytest.fixture
+def trakem2(tmp_path):
+    fname = str(tmp_path / 'test.xml')
+    write_trakem2(fname)
+    return fname
+
+@pytest.fixture
+def project(trakem2):
+    from parsetrakem2.parse import ParseTrakEM2
+    P = ParseTrakEM2(trakem2)
+    P.get_layers()
+    P.get_area_lists()
+    return P
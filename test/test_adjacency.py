@@ -0,0 +1,104 @@
+"""
+test_adjacency.py
+
+Checks that the adjacency engines agree.
+
+"""
+import numpy as np
+import pytest
+
+from parsetrakem2 import geometry
+
+from conftest import LAYERS
+
+def adjacency_records(P,B,engine,pixel_radius):
+    """
+    Returns the set of (cell1,cell2,index1,index2,adjacency) records of
+    all overlapping boundary pairs of B
+    """
+    (I,J) = P.get_overlapping_pairs(B)
+    adj = geometry.pair_adjacency(B.coords,B.offsets,I,J,
+                                  pixel_radius=pixel_radius,engine=engine)
+    return set((B.cells[B.cell[i]],B.cells[B.cell[j]],int(B.index[i]),
+                int(B.index[j]),int(a)) for (i,j,a) in zip(I,J,adj) if a > 0)
+
+@pytest.mark.parametrize('layer',LAYERS)
+@pytest.mark.parametrize('pixel_radius',[1,5,10])
+def test_engines_agree(project,layer,pixel_radius):
+    B = project.get_layer_boundaries(layer,area_thresh=0,scale_bounding_box=1.1)
+    cdist = adjacency_records(project,B,'cdist',pixel_radius)
+    kdtree = adjacency_records(project,B,'kdtree',pixel_radius)
+    assert cdist
+    assert cdist == kdtree
+
+@pytest.mark.parametrize('layer',LAYERS)
+def test_compute_adjacency_engines(project,layer):
+    B = project.get_layer_boundaries(layer,area_thresh=0,scale_bounding_box=1.1)
+    (I,J) = project.get_overlapping_pairs(B)
+    pairs = [(B.boundary(i),B.boundary(j)) for (i,j) in zip(I,J)]
+    result = {}
+    for engine in ['cdist','kdtree']:
+        adj = project.batch_compute_adjacency(pairs,pixel_radius=10,engine=engine)
+        result[engine] = set((b1.name,b2.name,b1.index,b2.index,a)
+                             for (b1,b2,a) in adj)
+    assert result['cdist']
+    assert result['cdist'] == result['kdtree']
+    assert result['cdist'] == adjacency_records(project,B,'cdist',10)
+
+@pytest.mark.parametrize('layer',LAYERS)
+def test_shared_trees(project,layer):
+    #Pair ranges that share a tree cache give the same lengths
+    B = project.get_layer_boundaries(layer,area_thresh=0,scale_bounding_box=1.1)
+    (I,J) = project.get_overlapping_pairs(B)
+    adj = geometry.pair_adjacency(B.coords,B.offsets,I,J,engine='kdtree')
+    trees = {}
+    split = np.zeros(len(I),dtype=np.int64)
+    for (a,b) in geometry.partition_costs(np.ones(len(I)),3):
+        split[a:b] = geometry.pair_adjacency(B.coords,B.offsets,I[a:b],J[a:b],
+                                             engine='kdtree',trees=trees)
+    assert sorted(trees) == sorted(set(I.tolist()) | set(J.tolist()))
+    np.testing.assert_array_equal(split,adj)
+    X = trees[int(I[0])].data
+    geometry.pair_adjacency(B.coords,B.offsets,I,J,engine='kdtree',trees=trees)
+    assert trees[int(I[0])].data is X
+
+def test_unknown_engine():
+    X = np.zeros((1,2))
+    with pytest.raises(ValueError):
+        geometry.pair_adjacency(X,np.array([0,1]),[0],[0],engine='brute')
+
+def brute_force_pairs(bbox,group=None):
+    pairs = set()
+    for i in range(len(bbox)):
+        for j in range(i + 1,len(bbox)):
+            if group is not None and group[i] == group[j]: continue
+            if (bbox[i,0] <= bbox[j,2] and bbox[j,0] <= bbox[i,2] and
+                bbox[i,1] <= bbox[j,3] and bbox[j,1] <= bbox[i,3]):
+                pairs.add((i,j))
+    return pairs
+
+@pytest.mark.parametrize('seed',range(5))
+def test_overlapping_pairs(seed):
+    rng = np.random.default_rng(seed)
+    n = 200
+    lo = rng.integers(0,500,(n,2))
+    #Includes zero width boxes and boxes that only touch
+    bbox = np.c_[lo,lo + rng.integers(0,40,(n,2))]
+    (I,J) = geometry.overlapping_pairs(bbox)
+    assert (I < J).all()
+    assert len(set(zip(I.tolist(),J.tolist()))) == len(I)
+    assert set(zip(I.tolist(),J.tolist())) == brute_force_pairs(bbox)
+    group = rng.integers(0,20,n)
+    (I,J) = geometry.overlapping_pairs(bbox,group)
+    assert set(zip(I.tolist(),J.tolist())) == brute_force_pairs(bbox,group)
+
+def test_overlapping_pairs_touching():
+    bbox = np.array([[0,0,10,10],[10,10,20,20],[21,0,30,5],[0,11,10,20]])
+    (I,J) = geometry.overlapping_pairs(bbox)
+    assert list(zip(I.tolist(),J.tolist())) == [(0,1),(1,3)]
+
+@pytest.mark.parametrize('layer',LAYERS)
+def test_layer_overlapping_pairs(project,layer):
+    B = project.get_layer_boundaries(layer,area_thresh=0,scale_bounding_box=1.1)
+    (I,J) = project.get_overlapping_pairs(B)
+    assert set(zip(I.tolist(),J.tolist())) == brute_force_pairs(B.bbox,B.cell)
@@ -0,0 +1,57 @@
+"""
+test_cache.py
+
+Checks that the geometry cache is installed safely and reloaded.
+
+"""
+import os
+import shutil
+import numpy as np
+
+from parsetrakem2 import cache
+from parsetrakem2.parse import ParseTrakEM2
+
+from conftest import LAYERS
+
+def boundaries(P):
+    P.get_layers()
+    P.get_area_lists()
+    B = P.get_layer_boundaries(LAYERS[1],area_thresh=0)
+    return B.coords,B.offsets
+
+def leftovers(trakem2):
+    d = os.path.dirname(trakem2)
+    return [f for f in os.listdir(d) if '.cache.' in f]
+
+def test_cache_round_trip(trakem2):
+    (coords,offsets) = boundaries(ParseTrakEM2(trakem2))
+    P = ParseTrakEM2(trakem2,cache=True)
+    assert os.path.isdir(cache.cache_dir(trakem2))
+    np.testing.assert_array_equal(boundaries(P)[0],coords)
+    P = ParseTrakEM2(trakem2,cache=True)
+    (c,o) = boundaries(P)
+    np.testing.assert_array_equal(c,coords)
+    np.testing.assert_array_equal(o,offsets)
+    #Rebuilding replaces the old cache
+    P = ParseTrakEM2(trakem2,streaming=True)
+    cache.write_cache(P,cache.file_key(trakem2))
+    assert cache.load_cache(ParseTrakEM2(trakem2,streaming=True))
+    assert leftovers(trakem2) == []
+
+def test_concurrent_install(trakem2,monkeypatch):
+    #Another process installs its cache between the two renames
+    ParseTrakEM2(trakem2,cache=True)
+    dname = cache.cache_dir(trakem2)
+    other = dname + '.other'
+    shutil.copytree(dname,other)
+    rename = os.rename
+    def racing_rename(src,dst):
+        if dst == dname and os.path.isdir(other):
+            rename(other,dname)
+        rename(src,dst)
+    monkeypatch.setattr(os,'rename',racing_rename)
+    P = ParseTrakEM2(trakem2,streaming=True)
+    cache.write_cache(P,cache.file_key(trakem2))
+    monkeypatch.undo()
+    assert cache.load_cache(ParseTrakEM2(trakem2,streaming=True))
+    assert leftovers(trakem2) == []
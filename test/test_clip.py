@@ -0,0 +1,102 @@
+"""
+test_clip.py
+
+Compares the area of polygons clipped by geometry.clip_polygons() with
+the area of the unclipped polygons.
+
+"""
+import numpy as np
+import pytest
+from lxml import etree
+
+from parsetrakem2.geometry import clip_polygons, polygon_areas, decode_paths
+from parsetrakem2.tree import restrict_area_lists_by_roi
+
+#Rectangle, diamond, concave arrow and an L shape
+POLYGONS = [[(10,10),(30,10),(30,25),(10,25)],
+            [(80,10),(90,20),(80,30),(70,20)],
+            [(60,10),(90,10),(90,40),(75,25),(60,40)],
+            [(40,40),(60,40),(60,50),(50,50),(50,70),(40,70)]]
+
+def pack(polygons):
+    coords = np.concatenate([np.asarray(v,dtype=np.float64) for v in polygons])
+    offsets = np.r_[0,np.cumsum([len(v) for v in polygons])]
+    return coords,offsets
+
+def tile_areas(coords,offsets,xs,ys):
+    """
+    Sum over the tiles of the xs x ys grid of the clipped polygon areas
+    """
+    total = np.zeros(len(offsets) - 1)
+    for (x0,x1) in zip(xs[:-1],xs[1:]):
+        for (y0,y1) in zip(ys[:-1],ys[1:]):
+            (c,o) = clip_polygons(coords,offsets,[x0,y0,x1,y1])
+            assert len(o) == len(offsets)
+            if len(c):
+                assert (c[:,0] >= x0).all() and (c[:,0] <= x1).all()
+                assert (c[:,1] >= y0).all() and (c[:,1] <= y1).all()
+            total += polygon_areas(c,o)
+    return total
+
+def test_rect_in_rect():
+    (coords,offsets) = pack(POLYGONS[:1])
+    (c,o) = clip_polygons(coords,offsets,[15,0,100,20])
+    assert polygon_areas(c,o).tolist() == [15*10]
+    #Inside the rect the polygon is unchanged
+    (c,o) = clip_polygons(coords,offsets,[0,0,100,100])
+    np.testing.assert_array_equal(c,coords)
+    #Outside the rect it becomes empty
+    (c,o) = clip_polygons(coords,offsets,[50,50,100,100])
+    assert o.tolist() == [0,0]
+
+def test_diamond_corner():
+    (coords,offsets) = pack(POLYGONS[1:2])
+    (c,o) = clip_polygons(coords,offsets,[80,20,100,100])
+    assert polygon_areas(c,o).tolist() == [50.0]
+
+@pytest.mark.parametrize('seed',range(5))
+def test_tiles_add_up(seed):
+    #Clipping to the tiles of a grid that covers all polygons splits each
+    #polygon without losing or adding area
+    rng = np.random.default_rng(seed)
+    (coords,offsets) = pack(POLYGONS)
+    area = polygon_areas(coords,offsets)
+    xs = np.r_[0,np.sort(rng.uniform(5,95,4)),100]
+    ys = np.r_[0,np.sort(rng.uniform(5,75,4)),80]
+    np.testing.assert_allclose(tile_areas(coords,offsets,xs,ys),area)
+    for (x0,x1) in zip(xs[:-1],xs[1:]):
+        (c,o) = clip_polygons(coords,offsets,[x0,0,x1,80])
+        assert (polygon_areas(c,o) <= area + 1e-9).all()
+
+@pytest.mark.parametrize('seed',range(5))
+def test_random_polygons(seed):
+    #Star shaped polygons with arbitrary edge slopes
+    rng = np.random.default_rng(seed)
+    polygons = []
+    for k in range(20):
+        n = int(rng.integers(3,12))
+        ang = np.sort(rng.uniform(0,2*np.pi,n))
+        rad = rng.uniform(2,30,n)
+        center = rng.uniform(0,100,2)
+        polygons.append(center + np.c_[rad*np.cos(ang),rad*np.sin(ang)])
+    (coords,offsets) = pack(polygons)
+    area = polygon_areas(coords,offsets)
+    xs = np.r_[-40,np.sort(rng.uniform(0,100,3)),140]
+    ys = np.r_[-40,np.sort(rng.uniform(0,100,3)),140]
+    np.testing.assert_allclose(tile_areas(coords,offsets,xs,ys),area)
+
+def test_restrict_area_lists_by_roi():
+    area = etree.fromstring(
+        '<t2_area_list oid="1" transform="matrix(1.0,0.0,0.0,1.0,5.0,0.0)">'
+        '<t2_area layer_id="1"><t2_path d="M 5 10 L 25 10 L 25 25 L 5 25 z"/>'
+        '</t2_area>'
+        '<t2_area layer_id="2"><t2_path d="M 0 0 L 1 0 L 1 1 z"/></t2_area>'
+        '<t2_area layer_id="3"><t2_path d="M 200 200 L 210 200 L 210 210 z"/>'
+        '</t2_area></t2_area_list>')
+    restrict_area_lists_by_roi([area],[0,0,20,20])
+    t2_areas = area.findall('t2_area')
+    assert [a.get('layer_id') for a in t2_areas] == ['1','2']
+    (c,o,_) = decode_paths([t2_areas[0].find('t2_path').get('d')])
+    assert (c[:,0] + 5 <= 20).all() and (c[:,1] <= 20).all()
+    assert polygon_areas(c,o).tolist() == [10*10]
+    assert t2_areas[1].find('t2_path').get('d') == 'M 0 0 L 1 0 L 1 1 z'
@@ -0,0 +1,79 @@
+"""
+test_crop.py
+
+Checks the run-length encoding of cell crops and the crops written by
+extract_volumes.py --mode cells.
+
+"""
+import os
+import sys
+import glob
+import subprocess
+import numpy as np
+import pytest
+
+from parsetrakem2.volume import encode_runs, decode_runs, write_crop, load_crop
+from parsetrakem2.volume import CellRegistry
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.mark.parametrize('shape',[(7,13),(3,5,17),(2,1,1)])
+@pytest.mark.parametrize('density',[0,0.2,0.8,1])
+def test_runs_round_trip(shape,density):
+    rng = np.random.default_rng(0)
+    M = rng.random(shape) < density
+    runs = encode_runs(M)
+    assert runs.shape[1] == len(shape) + 1
+    assert runs[:,-1].sum() == M.sum()
+    np.testing.assert_array_equal(decode_runs(runs,shape),M)
+
+def test_runs_touch_row_ends():
+    M = np.array([[1,1,0,1],[0,0,0,0],[1,1,1,1]],dtype=bool)
+    assert encode_runs(M).tolist() == [[0,0,2],[0,3,1],[2,0,4]]
+
+@pytest.mark.parametrize('rle',[False,True])
+def test_crop_round_trip(tmp_path,rle):
+    rng = np.random.default_rng(1)
+    M = rng.random((4,9,6)) < 0.3
+    fname = str(tmp_path / 'cell.npz')
+    write_crop(fname,M,(2,-5,7),rle=rle,layers=np.array(['a','b','c','d']))
+    (N,origin,data) = load_crop(fname)
+    np.testing.assert_array_equal(N,M)
+    assert N.dtype == bool
+    assert origin == (2,-5,7)
+    assert data['layers'].tolist() == ['a','b','c','d']
+    assert ('runs' in data) == rle
+
+def test_cells_match_slices(trakem2,tmp_path):
+    #Crops of extract_volumes.py --mode cells against the label slices
+    env = dict(os.environ,PYTHONPATH=ROOT)
+    script = os.path.join(ROOT,'scripts','extract_volumes.py')
+    dout = str(tmp_path / 'out') + '/'
+    for args in [[],['-m','cells','--rle']]:
+        subprocess.run([sys.executable,script,trakem2,dout,'-t','0'] + args,
+                       env=env,check=True,stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+    S = np.stack([np.load(os.path.join(dout,'JSH_slice_%d.npz' %z))['V']
+                  for z in range(2)])
+    reg = CellRegistry.load(os.path.join(dout,'cells.json'))
+    crops = sorted(glob.glob(os.path.join(dout,'cells','*.npz')))
+    assert len(crops) == len(reg)
+    for f in crops:
+        cell = os.path.basename(f)[:-4]
+        (M,(z0,y0,x0),data) = load_crop(f)
+        assert 'runs' in data
+        #Place the crop in the frame of the slices
+        F = np.zeros(S.shape,dtype=bool)
+        (h,w) = S.shape[1:]
+        (dz,dy,dx) = M.shape
+        (a,b) = (max(y0,0),min(y0 + dy,h))
+        (c,d) = (max(x0,0),min(x0 + dx,w))
+        F[z0:z0 + dz,a:b,c:d] = M[:,a - y0:b - y0,c - x0:d - x0]
+        #Pixels of the cell in the slices are a subset of the crop, the
+        #rest of the crop is covered by cells drawn later
+        label = reg.label([cell])[0]
+        assert not (S == label)[~F].any()
+        assert (S[F] != 0).all()
+        if cell in ['diag','multi']:
+            #Cells without overlaps
+            np.testing.assert_array_equal(S == label,F)
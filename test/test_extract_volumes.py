@@ -0,0 +1,59 @@
+"""
+test_extract_volumes.py
+
+Runs scripts/extract_volumes.py on the synthetic project and checks that
+--fix_cell redraws a cell without changing an up to date volume.
+
+"""
+import os
+import sys
+import glob
+import json
+import subprocess
+import numpy as np
+import pytest
+
+from parsetrakem2.volume import CellRegistry
+from parsetrakem2.jobs import JobManifest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT,'scripts','extract_volumes.py')
+
+def run(*args):
+    env = dict(os.environ,PYTHONPATH=ROOT)
+    subprocess.run([sys.executable,SCRIPT] + list(args),env=env,check=True,
+                   stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+
+def load_slices(dout):
+    return dict((os.path.basename(f),np.load(f)['V'])
+                for f in sorted(glob.glob(os.path.join(dout,'JSH_slice_*.npz'))))
+
+@pytest.mark.parametrize('overlap',['last','first'])
+@pytest.mark.parametrize('cell',['rect','over','multi'])
+def test_fix_cell_is_idempotent(trakem2,tmp_path,overlap,cell):
+    dout = str(tmp_path / 'out') + '/'
+    run(trakem2,dout,'-t','0','--overlap',overlap)
+    before = load_slices(dout)
+    assert len(before) == 2
+    run(trakem2,dout,'-t','0','--fix_cell',cell)
+    after = load_slices(dout)
+    for f in before:
+        np.testing.assert_array_equal(after[f],before[f])
+
+def test_fix_cell_replaces_old_pixels(trakem2,tmp_path):
+    dout = str(tmp_path / 'out') + '/'
+    run(trakem2,dout,'-t','0')
+    before = load_slices(dout)['JSH_slice_0.npz']
+    reg = CellRegistry.load(os.path.join(dout,'cells.json'))
+    label = reg.label(['rect'])[0]
+    #Stray pixels of rect, recorded as the finished slice
+    V = before.copy()
+    V[95:99,0:3] = label
+    fname = os.path.join(dout,'JSH_slice_0.npz')
+    np.savez_compressed(fname,V=V)
+    fmanifest = os.path.join(dout,'manifest.json')
+    with open(fmanifest,'r') as fin:
+        jobs = JobManifest(fmanifest,json.load(fin)['params'])
+    jobs.mark_done('L001',fname,index=0)
+    run(trakem2,dout,'-t','0','--fix_cell','rect')
+    np.testing.assert_array_equal(load_slices(dout)['JSH_slice_0.npz'],before)
@@ -0,0 +1,46 @@
+"""
+test_fill.py
+
+Checks the fill colors set by ParseTrakEM2.set_fill() and write_fill().
+
+"""
+import pytest
+from lxml import etree
+
+from parsetrakem2.parse import ParseTrakEM2
+
+COLORS = [('rect','#FF0000'),('diag','#00ff00',0.8)]
+STYLES = {'rect':'stroke:none;fill-opacity:0.50;fill:#ff0000;',
+          'diag':'stroke:none;fill-opacity:0.80;fill:#00ff00;'}
+
+def styles(tree):
+    return dict((a.get('title'),a.get('style'))
+                for a in tree.getroot().iter('t2_area_list') if a.get('style'))
+
+def test_set_fill(trakem2,tmp_path):
+    P = ParseTrakEM2(trakem2)
+    P.set_fill(COLORS)
+    assert styles(P.xml) == STYLES
+    fout = str(tmp_path / 'out.xml')
+    P.xml.write(fout)
+    assert styles(etree.parse(fout)) == STYLES
+
+def test_set_fill_unknown(trakem2):
+    P = ParseTrakEM2(trakem2)
+    with pytest.raises(KeyError):
+        P.set_fill(COLORS + [('none','#0000ff')])
+    assert styles(P.xml) == STYLES
+
+def test_set_fill_streaming(trakem2):
+    with pytest.raises(RuntimeError):
+        ParseTrakEM2(trakem2,streaming=True).set_fill(COLORS)
+
+@pytest.mark.parametrize('kwargs',[{},{'streaming':True}])
+def test_write_fill(trakem2,tmp_path,kwargs):
+    #Unknown area lists are ignored
+    fout = str(tmp_path / 'out.xml')
+    ParseTrakEM2(trakem2,**kwargs).write_fill(fout,COLORS + [('none','#0000ff')])
+    P = ParseTrakEM2(trakem2)
+    P.set_fill(COLORS)
+    assert (etree.tostring(etree.parse(fout),method='c14n')
+            == etree.tostring(P.xml,method='c14n'))
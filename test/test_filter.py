@@ -0,0 +1,66 @@
+"""
+test_filter.py
+
+Checks the streaming filter_trakem2() against the DOM steps it replaces
+in modify_rendering.py.
+
+"""
+import pytest
+from lxml import etree
+
+from parsetrakem2.tree import *
+
+STYLES = fill_styles([['rect','#FF0000'],['diag','#00ff00',0.8],['none','#0000ff']])
+
+def dom_filter(fin,cells=None,zrange=None,roi=None,mipmaps=None,styles=None):
+    #Sequence of modify_rendering.py before filter_trakem2()
+    tree = etree.parse(fin,etree.XMLParser(remove_blank_text=True))
+    fix_calibration(tree)
+    if mipmaps is not None: change_mipmaps_dir(tree,mipmaps)
+    if cells is not None: extract_area_lists(tree,cells)
+    if zrange is not None:
+        oids = dict((l.find('t2_patch').get('title').replace('.tif',''),l.get('oid'))
+                    for l in tree.getroot().iter('t2_layer'))
+        layers = sorted(oids)[zrange[0]:zrange[1] + 1]
+        restrict_segments_by_oid(tree,[oids[l] for l in layers])
+    if roi is not None: restrict_segments_by_roi(tree,roi,if_check=True)
+    if styles is not None: set_styles(tree,styles)
+    return tree
+
+def c14n(tree):
+    return etree.tostring(tree,method='c14n')
+
+@pytest.mark.parametrize('kwargs',[
+    {},
+    {'cells':['rect','diag','multi']},
+    {'cells':'over','zrange':(1,1)},
+    {'zrange':(0,0),'roi':[5,5,70,60]},
+    {'cells':['rect','over','edge','diag'],'zrange':(0,1),'roi':[12,12,100,80],
+     'mipmaps':'../mm/','styles':STYLES},
+    {'roi':[0,0,119,99],'styles':STYLES},
+    ])
+def test_matches_dom(trakem2,tmp_path,kwargs):
+    fout = str(tmp_path / 'out.xml')
+    filter_trakem2(trakem2,fout,**kwargs)
+    tree = etree.parse(fout,etree.XMLParser(remove_blank_text=True))
+    assert c14n(tree) == c14n(dom_filter(trakem2,**kwargs))
+
+def test_header(trakem2,tmp_path):
+    fheader = str(tmp_path / 'header.txt')
+    with open(fheader,'w') as f:
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+                '<!DOCTYPE trakem2 [\n<!ELEMENT trakem2 (project,t2_layer_set)>\n]>\n')
+    fout = str(tmp_path / 'out.xml')
+    filter_trakem2(trakem2,fout,cells=['rect'],header=fheader)
+    tree = etree.parse(fout,etree.XMLParser(remove_blank_text=True))
+    assert tree.docinfo.doctype.startswith('<!DOCTYPE trakem2')
+    assert c14n(tree) == c14n(dom_filter(trakem2,cells=['rect']))
+    assert [a.get('title') for a in tree.getroot().iter('t2_area_list')] == ['rect']
+
+def test_zrange_needs_layers(tmp_path):
+    fin = str(tmp_path / 'in.xml')
+    with open(fin,'w') as f:
+        f.write('<trakem2><t2_layer_set><t2_area_list oid="1" title="a" '
+                'transform="matrix(1,0,0,1,0,0)"/></t2_layer_set></trakem2>')
+    with pytest.raises(ValueError):
+        filter_trakem2(fin,str(tmp_path / 'out.xml'),zrange=(0,1))
@@ -0,0 +1,58 @@
+"""
+test_index.py
+
+Checks the byte offset index against a full parse of the file.
+
+"""
+import numpy as np
+import pytest
+
+from parsetrakem2.index import TrakEM2Index
+from parsetrakem2.parse import ParseTrakEM2
+
+from conftest import CELLS, TRANSFORMS, LAYERS, write_trakem2
+
+#Quoted attribute values may contain '>'
+ODD = 'a>b/>'
+
+@pytest.fixture
+def odd_trakem2(tmp_path):
+    fname = str(tmp_path / 'odd.xml')
+    cells = dict(CELLS)
+    cells[ODD] = CELLS['rect']
+    transforms = dict(TRANSFORMS)
+    transforms[ODD] = (1,1)
+    write_trakem2(fname,cells=cells,transforms=transforms)
+    return fname
+
+def test_index(odd_trakem2):
+    I = TrakEM2Index(odd_trakem2)
+    assert [a[0] for a in I.area_lists] == list(CELLS) + [ODD]
+    assert len(I.layers) == len(LAYERS)
+    with open(odd_trakem2,'rb') as fin:
+        data = fin.read()
+    for (title,oid,start,end) in I.area_lists:
+        assert data[start:end].startswith(b'<t2_area_list')
+        assert data[start:end].endswith(b'</t2_area_list>')
+        assert I.get_area_list(title).get('oid') == oid
+    for (oid,start,end) in I.layers:
+        assert I.get_layer(oid).get('oid') == oid
+    assert I.get_project().tag == 'project'
+    #Reloaded from the index file
+    J = TrakEM2Index(odd_trakem2)
+    assert J.area_lists == I.area_lists and J.layers == I.layers
+
+@pytest.mark.parametrize('cells',[[ODD],['rect',ODD],['multi']])
+def test_cells_match_full_parse(odd_trakem2,cells):
+    P = ParseTrakEM2(odd_trakem2)
+    P.get_layers()
+    P.get_area_lists()
+    Q = ParseTrakEM2(odd_trakem2,cells=cells)
+    Q.get_layers()
+    Q.get_area_lists()
+    assert sorted(Q.area_lists) == sorted(cells)
+    for layer in LAYERS:
+        A = P.get_layer_boundaries(layer,area_thresh=0,area_lists=cells)
+        B = Q.get_layer_boundaries(layer,area_thresh=0)
+        np.testing.assert_array_equal(A.coords,B.coords)
+        np.testing.assert_array_equal(A.offsets,B.offsets)
@@ -0,0 +1,74 @@
+"""
+test_jobs.py
+
+Checks the job manifest of resumable runs.
+
+"""
+import os
+import pytest
+
+from parsetrakem2 import jobs, cache
+from parsetrakem2.jobs import JobManifest
+
+PARAMS = {'trakem2':'test.xml','area_thresh':200}
+
+def write_output(path,content=b'0123456789'):
+    with open(path,'wb') as fout:
+        fout.write(content)
+    return str(path)
+
+def test_done(tmp_path):
+    fname = str(tmp_path / 'manifest.json')
+    M = JobManifest(fname,PARAMS)
+    out = write_output(tmp_path / 'a.npz')
+    M.mark_done('a',out,index=1)
+    M = JobManifest(fname,PARAMS)
+    assert not M.stale
+    assert M.is_done('a') and M.is_done('a',verify=True)
+    assert M.pending(['a','b']) == ['b']
+    assert M.jobs['a']['index'] == 1
+
+def test_hash_only_on_mtime_change(tmp_path,monkeypatch):
+    fname = str(tmp_path / 'manifest.json')
+    M = JobManifest(fname,PARAMS)
+    out = write_output(tmp_path / 'a.npz')
+    M.mark_done('a',out)
+    calls = []
+    file_hash = cache.file_hash
+    counted = lambda f: calls.append(f) or file_hash(f)
+    monkeypatch.setattr(jobs,'file_hash',counted)
+    monkeypatch.setattr(cache,'file_hash',counted)
+    assert M.is_done('a')
+    assert calls == []
+    #Same size and content, newer mtime: hashed once, then trusted
+    st = os.stat(out)
+    os.utime(out,ns=(st.st_atime_ns,st.st_mtime_ns + 10**9))
+    assert M.is_done('a')
+    assert len(calls) == 1
+    assert M.is_done('a')
+    assert len(calls) == 1
+    assert M.is_done('a',verify=True)
+    assert len(calls) == 2
+
+def test_modified_output(tmp_path):
+    fname = str(tmp_path / 'manifest.json')
+    M = JobManifest(fname,PARAMS)
+    out = write_output(tmp_path / 'a.npz')
+    M.mark_done('a',out)
+    st = os.stat(out)
+    write_output(out,b'9876543210')
+    os.utime(out,ns=(st.st_atime_ns,st.st_mtime_ns + 10**9))
+    assert not M.is_done('a')
+    write_output(out,b'01234')
+    assert not M.is_done('a')
+    os.remove(out)
+    assert not M.is_done('a')
+
+def test_params_mismatch_warns(tmp_path):
+    fname = str(tmp_path / 'manifest.json')
+    M = JobManifest(fname,PARAMS)
+    M.mark_done('a',write_output(tmp_path / 'a.npz'))
+    with pytest.warns(UserWarning):
+        M = JobManifest(fname,dict(PARAMS,area_thresh=100))
+    assert M.stale
+    assert M.pending(['a']) == ['a']
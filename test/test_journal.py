@@ -0,0 +1,109 @@
+"""
+test_journal.py
+
+Checks the checkpointed adjacency journal and the --resume option of
+scripts/measure_adjacency.py.
+
+"""
+import os
+import sys
+import subprocess
+from lxml import etree
+
+from parsetrakem2.journal import AdjacencyJournal
+from parsetrakem2.results import iter_adjacency
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT,'scripts','measure_adjacency.py')
+
+PARAMS = {'trakem2':'test.xml','pixel_radius':10}
+RECORDS = {'L001':[('a','b',0,1,5),('a','c',1,0,7)],
+           'L002':[('b','c',2,2,3)],
+           'L003':[]}
+
+def run(*args):
+    env = dict(os.environ,PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable,SCRIPT] + list(args),env=env,check=True,
+                         stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+    return out.stdout.decode()
+
+def layers(fname):
+    """
+    Returns the adjacency records of fname by layer
+    """
+    out = {}
+    for r in iter_adjacency(fname):
+        out.setdefault(r[0],[]).append(r[1:])
+    return out
+
+def layer_elements(fname):
+    """
+    Returns the serialized layer elements of fname sorted by name
+    """
+    root = etree.parse(fname).getroot()
+    return sorted((l.get('name'),etree.tostring(l,method='c14n')) for l in root)
+
+def test_resume_after_truncated_line(tmp_path):
+    fout = str(tmp_path / 'adj.xml')
+    J = AdjacencyJournal(fout,PARAMS)
+    J.write_layer('L001',RECORDS['L001'])
+    size = os.path.getsize(J.journal)
+    #Crash while the next layer is appended
+    with open(J.journal,'ab') as f:
+        f.write(b'L002\tb\tc\t2')
+    J = AdjacencyJournal(fout,PARAMS,resume=True)
+    assert list(J.completed) == ['L001']
+    assert os.path.getsize(J.journal) == size
+    J.write_layer('L002',RECORDS['L002'])
+    assert dict(J.read_layers()) == {'L001':RECORDS['L001'],'L002':RECORDS['L002']}
+
+def test_resume_needs_same_params(tmp_path):
+    fout = str(tmp_path / 'adj.xml')
+    J = AdjacencyJournal(fout,PARAMS)
+    J.write_layer('L001',RECORDS['L001'])
+    J = AdjacencyJournal(fout,dict(PARAMS,pixel_radius=5),resume=True)
+    assert J.completed == {}
+    assert os.path.getsize(J.journal) == 0
+
+def test_resume_with_short_journal(tmp_path):
+    #A journal shorter than the manifest says cannot be trusted
+    fout = str(tmp_path / 'adj.xml')
+    J = AdjacencyJournal(fout,PARAMS)
+    J.write_layer('L001',RECORDS['L001'])
+    with open(J.journal,'ab') as f:
+        f.truncate(5)
+    J = AdjacencyJournal(fout,PARAMS,resume=True)
+    assert J.completed == {}
+
+def test_rerun_keeps_other_layers(tmp_path):
+    fout = str(tmp_path / 'adj.xml')
+    J = AdjacencyJournal(fout,PARAMS)
+    for (l,r) in RECORDS.items(): J.write_layer(l,r)
+    J.export_xml()
+    #New run without resume for one layer
+    J = AdjacencyJournal(fout,PARAMS)
+    assert J.completed == {}
+    J.write_layer('L002',[('b','d',0,0,9)])
+    J.export_xml()
+    out = layers(fout)
+    assert out['L001'] == [('a','b','0','1','5'),('a','c','1','0','7')]
+    assert out['L002'] == [('b','d','0','0','9')]
+
+def test_script_resume(trakem2,tmp_path):
+    single = str(tmp_path / 'single.xml')
+    run(trakem2,single)
+    expected = layers(single)
+    assert sorted(expected) == ['L001','L002']
+    #Interrupted run: L001 is completed, L002 is partly written
+    fout = str(tmp_path / 'adj.xml')
+    run(trakem2,fout,'-l','L001')
+    with open(fout + '.journal','ab') as f:
+        f.write(b'L002\trect\tover\t0')
+    out = run(trakem2,fout,'--resume')
+    assert 'Skipping 1 completed layers' in out
+    assert layers(fout) == expected
+    #Rerunning one layer without --resume keeps the other layer
+    out = run(trakem2,fout,'-l','L002')
+    assert 'Skipping' not in out
+    assert layers(fout) == expected
+    assert layer_elements(fout) == layer_elements(single)
@@ -0,0 +1,48 @@
+"""
+test_occupancy.py
+
+Checks the per-cell layer occupancy index against the outlines of the
+synthetic project and against get_layer_boundaries().
+
+"""
+import numpy as np
+import pytest
+
+from conftest import CELLS, TRANSFORMS, LAYERS
+
+def expected_occupancy(P,cell):
+    occ = {}
+    (dx,dy) = TRANSFORMS[cell]
+    for (layer,outlines) in CELLS[cell].items():
+        v = np.concatenate(outlines)
+        box = (v[:,0].min() + dx,v[:,1].min() + dy,v[:,0].max() + dx,v[:,1].max() + dy)
+        occ[P.layers[layer].oid] = (len(outlines),tuple(float(b) for b in box))
+    return occ
+
+@pytest.mark.parametrize('cell',list(CELLS))
+def test_occupancy(project,cell):
+    assert project.get_occupancy(cell) == expected_occupancy(project,cell)
+    assert project.get_cell_layers(cell) == sorted(CELLS[cell])
+
+def test_unknown_cell(project):
+    assert project.get_occupancy('none') == {}
+    assert project.get_cell_layers('none') == []
+
+@pytest.mark.parametrize('layer',LAYERS)
+def test_layer_cells(project,layer):
+    cells = project.get_layer_cells(layer)
+    assert cells == sorted(c for c in CELLS if layer in CELLS[c])
+    for c in CELLS:
+        assert (c in cells) == (layer in project.get_cell_layers(c))
+    #Same cells, segment counts and boxes as the boundaries of the layer
+    B = project.get_layer_boundaries(layer,area_thresh=0)
+    names = [B.cells[c] for c in B.cell]
+    assert sorted(set(names)) == cells
+    oid = project.layers[layer].oid
+    for c in cells:
+        k = np.flatnonzero(np.array(names) == c)
+        (count,box) = project.get_occupancy(c)[oid]
+        assert count == len(k)
+        v = np.concatenate([B.vertices[B.vertex_offsets[i]:B.vertex_offsets[i+1]]
+                            for i in k])
+        assert box == tuple(np.r_[v.min(axis=0),v.max(axis=0)].tolist())
@@ -0,0 +1,85 @@
+"""
+test_paths.py
+
+Checks the t2_path/@d decoding and encoding.
+
+"""
+import numpy as np
+import pytest
+
+from parsetrakem2.geometry import decode_paths, decode_path, encode_paths
+from parsetrakem2.parse import AreaList
+from parsetrakem2.tree import path_to_array, array_to_path
+
+PATHS = ['M 1 2 L 3 4 L 5 2 z',
+         'M 10 10 L 20 10 L 20 20 z M 30 30 L 40 30 L 40 40 L 30 40 z',
+         'M 0 0 L 1 0 L 1 1 z',
+         'M 1.5 2.25 L -3 4 L 5 -2.75 z M 7 8 L 9 10 L 11 8 z M 0 1 L 1 1 L 1 0 z']
+
+def old_decode(path):
+    #Subpath parser of the original path_transform()/path_to_array()
+    path = path.replace('M ','')
+    path = path.replace(' z','')
+    path = path.split(' L ')
+    return np.array([list(map(float,p.split(' '))) for p in path])
+
+def test_round_trip():
+    (coords,offsets,source) = decode_paths(PATHS)
+    assert encode_paths(coords,offsets,source,len(PATHS)) == PATHS
+    assert source.tolist() == [0,1,1,2,3,3,3]
+    assert np.diff(offsets).tolist() == [3,3,4,3,3,3,3]
+
+def test_decode_matches_old_parser():
+    for path in PATHS:
+        subpaths = decode_path(path)
+        assert len(subpaths) == path.count('M')
+        for (s,p) in zip(subpaths,path.split(' M ')):
+            if not p.startswith('M'): p = 'M ' + p
+            np.testing.assert_array_equal(s,old_decode(p))
+
+def test_decode_separators():
+    (coords,offsets,_) = decode_paths(['M 1,2 L 3,4 L 5,6 Z'])
+    np.testing.assert_array_equal(coords,[[1,2],[3,4],[5,6]])
+    assert offsets.tolist() == [0,3]
+
+def test_encode_empty_paths():
+    (coords,offsets,source) = decode_paths(PATHS)
+    #Drop the polygons of path 1, which becomes an empty string
+    keep = source != 1
+    lengths = np.diff(offsets)
+    c = coords[np.repeat(keep,lengths)]
+    o = np.r_[0,np.cumsum(lengths[keep])]
+    d = encode_paths(c,o,source[keep],len(PATHS))
+    assert d == [PATHS[0],'',PATHS[2],PATHS[3]]
+
+def test_random_round_trip():
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(3,20,50)
+    coords = np.round(rng.uniform(-1000,1000,(lengths.sum(),2)),2)
+    coords[::3] = np.round(coords[::3])
+    offsets = np.r_[0,np.cumsum(lengths)]
+    source = np.sort(rng.integers(0,20,50))
+    d = encode_paths(coords,offsets,source,20)
+    (c,o,s) = decode_paths([p for p in d if p])
+    np.testing.assert_array_equal(c,coords)
+    np.testing.assert_array_equal(o,offsets)
+
+def test_array_to_path():
+    assert array_to_path(np.array([[1,2],[3,4],[5,2]])) == PATHS[0]
+    np.testing.assert_array_equal(path_to_array(PATHS[0]),old_decode(PATHS[0]))
+
+def test_single_subpath_helpers_reject_subpaths():
+    A = AreaList('a')
+    A.transform = (10,20)
+    with pytest.raises(ValueError):
+        path_to_array(PATHS[1])
+    with pytest.raises(ValueError):
+        A.path_transform(PATHS[1])
+    assert len(A.subpath_transform(PATHS[1])) == 2
+
+def test_path_transform():
+    A = AreaList('a')
+    A.transform = (10,20)
+    path = A.path_transform(PATHS[0])
+    assert path == [(11.0,22.0),(13.0,24.0),(15.0,22.0)]
+    assert np.array(path).shape == (3,2)
@@ -0,0 +1,151 @@
+"""
+test_rasterize.py
+
+Compares the scanline masks of geometry.rasterize_polygons() and
+LayerBoundaries.rasterize() with masks from matplotlib.path and with the
+hole filled outlines that Boundary.get_global_display_matrix() used.
+
+"""
+import numpy as np
+import pytest
+from matplotlib.path import Path
+
+from parsetrakem2 import geometry
+from parsetrakem2.geometry import rasterize_polygons, rasterize_boundaries
+
+from conftest import LAYERS, WIDTH, HEIGHT
+
+def outline_points(v):
+    """
+    Lattice points on the outline of v. Edges are horizontal, vertical
+    or diagonal.
+    """
+    v = np.asarray(v,dtype=np.int64)
+    pts = []
+    for (p,q) in zip(v,np.roll(v,-1,axis=0)):
+        n = np.abs(q - p).max()
+        step = (q - p) // max(n,1)
+        pts.append(p + np.arange(n + 1)[:,None]*step)
+    return np.concatenate(pts)
+
+def reference_mask(v,shape):
+    """
+    Pixels on the outline of v or inside it according to matplotlib.path
+    """
+    (h,w) = shape
+    (ys,xs) = np.mgrid[0:h,0:w]
+    M = Path(v).contains_points(np.c_[xs.ravel(),ys.ravel()]).reshape(h,w)
+    b = outline_points(v)
+    b = b[(b[:,0] >= 0) & (b[:,0] < w) & (b[:,1] >= 0) & (b[:,1] < h)]
+    M[b[:,1],b[:,0]] = True
+    return M
+
+def reference_labels(B,labels,shape,overlap):
+    out = np.zeros(shape,dtype=np.int64)
+    order = range(len(B))
+    if overlap == 'first': order = reversed(order)
+    for k in order:
+        M = reference_mask(B.vertices[B.vertex_offsets[k]:B.vertex_offsets[k+1]],shape)
+        out[M] = labels[k]
+    return out
+
+@pytest.mark.parametrize('layer',LAYERS)
+def test_masks_match_path(project,layer):
+    B = project.get_layer_boundaries(layer,area_thresh=0)
+    assert len(B) > 0
+    for k in range(len(B)):
+        v = B.vertices[B.vertex_offsets[k]:B.vertex_offsets[k+1]]
+        out = np.zeros((HEIGHT,WIDTH),dtype=np.uint8)
+        rasterize_polygons(v,[0,len(v)],1,out)
+        np.testing.assert_array_equal(out.astype(bool),reference_mask(v,out.shape))
+
+def edge_distance(v,points):
+    """
+    Distance of each point to the closest edge of polygon v
+    """
+    (p,q) = (v,np.roll(v,-1,axis=0))
+    d = q - p
+    t = ((points[:,None,:] - p)*d).sum(axis=2) / (d*d).sum(axis=1)
+    c = p + np.clip(t,0,1)[:,:,None]*d
+    return np.sqrt(((points[:,None,:] - c)**2).sum(axis=2)).min(axis=1)
+
+@pytest.mark.parametrize('seed',range(5))
+def test_arbitrary_slopes(seed):
+    #Star shaped polygon with integer vertices and arbitrary edge slopes.
+    #Pixels more than one pixel away from the outline must agree with 
+    #matplotlib.path, pixels on the vertices must be set.
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(5,12))
+    ang = np.sort(rng.uniform(0,2*np.pi,n))
+    rad = rng.uniform(8,25,n)
+    v = np.round(np.c_[30 + rad*np.cos(ang),30 + rad*np.sin(ang)])
+    out = np.zeros((60,60),dtype=np.uint8)
+    rasterize_polygons(v,[0,len(v)],1,out)
+    (ys,xs) = np.mgrid[0:60,0:60]
+    points = np.c_[xs.ravel(),ys.ravel()].astype(np.float64)
+    inside = Path(v).contains_points(points)
+    far = edge_distance(v,points) > 1
+    np.testing.assert_array_equal(out.ravel().astype(bool)[far],inside[far])
+    assert out[v[:,1].astype(int),v[:,0].astype(int)].all()
+
+def test_rectilinear_mask():
+    v = np.array([(2,1),(6,1),(6,3),(4,3),(4,5),(2,5)],dtype=np.float64)
+    out = np.zeros((7,8),dtype=np.uint8)
+    rasterize_polygons(v,[0,len(v)],1,out)
+    expected = np.zeros((7,8),dtype=np.uint8)
+    expected[1:4,2:7] = 1
+    expected[1:6,2:5] = 1
+    np.testing.assert_array_equal(out,expected)
+
+def test_frame_edge_is_clipped():
+    v = np.array([(-3,-2),(4,-2),(4,3),(-3,3)],dtype=np.float64)
+    out = np.zeros((5,6),dtype=np.uint8)
+    rasterize_polygons(v,[0,len(v)],1,out)
+    expected = np.zeros((5,6),dtype=np.uint8)
+    expected[0:4,0:5] = 1
+    np.testing.assert_array_equal(out,expected)
+    #Entirely outside of the frame
+    out[:] = 0
+    rasterize_polygons(v + 50,[0,len(v)],1,out)
+    assert not out.any()
+
+@pytest.mark.parametrize('layer',LAYERS)
+@pytest.mark.parametrize('overlap',geometry.OVERLAP)
+def test_overlap_policies(project,layer,overlap):
+    B = project.get_layer_boundaries(layer,area_thresh=0)
+    labels = B.cell.astype(np.int64) + 1
+    out = np.zeros((HEIGHT,WIDTH),dtype=np.uint16)
+    B.rasterize(out,labels,overlap=overlap)
+    expected = reference_labels(B,labels,out.shape,overlap)
+    np.testing.assert_array_equal(out,expected)
+
+def test_unknown_overlap():
+    out = np.zeros((4,4),dtype=np.uint8)
+    for overlap in ['max','add']:
+        with pytest.raises(ValueError):
+            rasterize_polygons(np.zeros((3,2)),[0,3],1,out,overlap=overlap)
+
+@pytest.mark.parametrize('layer',LAYERS)
+def test_matches_hole_fill(project,layer):
+    B = project.get_layer_boundaries(layer,area_thresh=0)
+    labels = np.arange(1,len(B) + 1)
+    #Pad the frame so the hole fill sees the boundaries outside of it
+    pad = 20
+    origin = (-pad,-pad)
+    shape = (HEIGHT + 2*pad,WIDTH + 2*pad)
+    old = np.zeros(shape,dtype=np.int64)
+    rasterize_boundaries(B.coords,B.offsets,labels,old,origin=origin)
+    new = np.zeros(shape,dtype=np.int64)
+    rasterize_polygons(B.vertices,B.vertex_offsets,labels,new,origin=origin)
+    np.testing.assert_array_equal(new,old)
+
+def test_label_overflow():
+    v = np.array([(1,1),(3,1),(3,3),(1,3)],dtype=np.float64)
+    out = np.zeros((5,5),dtype=np.uint8)
+    with pytest.raises(ValueError):
+        rasterize_polygons(v,[0,4],256,out)
+    with pytest.raises(ValueError):
+        rasterize_polygons(v,[0,4],-1,out)
+    assert not out.any()
+    rasterize_polygons(v,[0,4],255,out)
+    assert out.max() == 255
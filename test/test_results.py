@@ -0,0 +1,45 @@
+"""
+test_results.py
+
+Checks the streaming readers of the result xml files.
+
+"""
+from parsetrakem2.results import iter_adjacency, iter_segments, sort_by_layer
+
+#Layers in completion order, as appended by the journal
+LAYERS = ['L003','L001','L010','L000','L002']
+
+def write_adjacency(fname):
+    lines = ['<data>']
+    for (i,l) in enumerate(LAYERS):
+        lines.append('<layer name="%s">' %l)
+        for k in range(i):
+            lines.append('<area><cell1>A%d</cell1><cell2>B%d</cell2>'
+                         '<index1>%d</index1><index2>%d</index2>'
+                         '<adjacency>%d</adjacency></area>' %(k,k,i,k,10*i + k))
+        lines.append('</layer>')
+    lines.append('</data>')
+    with open(fname,'w') as fout:
+        fout.write('\n'.join(lines))
+
+def test_file_order(tmp_path):
+    fname = str(tmp_path / 'adj.xml')
+    write_adjacency(fname)
+    rows = list(iter_adjacency(fname))
+    assert [r[0] for r in rows] == ['L001','L010','L010','L000','L000','L000',
+                                    'L002','L002','L002','L002']
+    assert rows[0] == ('L001','A0','B0','1','0','10')
+
+def test_sorted(tmp_path):
+    fname = str(tmp_path / 'adj.xml')
+    write_adjacency(fname)
+    rows = list(iter_adjacency(fname))
+    srows = list(iter_adjacency(fname,sort=True))
+    assert srows == sorted(rows,key=lambda r: r[0])
+    assert list(iter_segments(fname,sort=True)) == []
+
+def test_sort_by_layer_keeps_order():
+    records = [('b',1),('b',0),('a',2),('c',0),('a',1),('a',0)]
+    assert list(sort_by_layer(records)) == [('a',2),('a',1),('a',0),('b',1),
+                                            ('b',0),('c',0)]
+    assert list(sort_by_layer([])) == []
@@ -0,0 +1,73 @@
+"""
+test_store.py
+
+Checks the SQLite store queries against the xml output of the scripts.
+
+"""
+import os
+import sys
+import subprocess
+import pytest
+
+from parsetrakem2.store import Store
+from parsetrakem2.results import iter_adjacency, iter_segments
+
+from conftest import CELLS, LAYERS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(script,*args):
+    env = dict(os.environ,PYTHONPATH=ROOT)
+    subprocess.run([sys.executable,os.path.join(ROOT,'scripts',script)] + list(args),
+                   env=env,check=True,stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+
+@pytest.fixture
+def results(trakem2,tmp_path):
+    db = str(tmp_path / 'results.db')
+    fadj = str(tmp_path / 'adj.xml')
+    fseg = str(tmp_path / 'seg.xml')
+    run('measure_adjacency.py',trakem2,fadj,'-t','0','--db',db)
+    run('extract_segmentation_stats.py',trakem2,fseg,'-t','0','--db',db)
+    return db,fadj,fseg
+
+def xml_contacts(fadj,cell,layers=LAYERS):
+    rows = []
+    for (l,c1,c2,i1,i2,adj) in iter_adjacency(fadj):
+        if l not in layers: continue
+        if c1 == cell: rows.append((l,cell,int(i1),c2,int(i2),int(adj)))
+        if c2 == cell: rows.append((l,cell,int(i2),c1,int(i1),int(adj)))
+    #Layer z follows the layer order of the project
+    return sorted(rows,key=lambda r: (LAYERS.index(r[0]),) + r[2:5])
+
+@pytest.mark.parametrize('cell',list(CELLS) + ['none'])
+def test_contacts(results,cell):
+    (db,fadj,_) = results
+    with Store(db) as S:
+        rows = S.contacts(cell)
+        assert rows == xml_contacts(fadj,cell)
+        for l in LAYERS:
+            assert S.contacts(cell,l,l) == xml_contacts(fadj,cell,[l])
+        assert S.contacts(cell,LAYERS[1],LAYERS[0]) == rows
+    if cell in ['rect','over']: assert rows
+
+@pytest.mark.parametrize('cell',list(CELLS) + ['none'])
+def test_layer_areas(results,cell):
+    (db,_,fseg) = results
+    areas = {}
+    for (l,name,idx,cx,cy,area,length) in iter_segments(fseg):
+        if name == cell: areas[l] = areas.get(l,0) + int(area)
+    with Store(db) as S:
+        assert S.layer_areas(cell) == sorted(areas.items(),
+                                             key=lambda a: LAYERS.index(a[0]))
+
+def test_rerun_replaces_layer(results,trakem2,tmp_path):
+    (db,fadj,_) = results
+    with Store(db) as S:
+        before = S.contacts('rect')
+        S.put_adjacency(LAYERS[0],[])
+        assert S.contacts('rect',LAYERS[0],LAYERS[0]) == []
+    run('measure_adjacency.py',trakem2,str(tmp_path / 'adj2.xml'),'-t','0',
+        '-l',LAYERS[0],'--db',db)
+    with Store(db) as S:
+        assert S.contacts('rect') == before
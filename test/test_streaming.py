@@ -0,0 +1,78 @@
+"""
+test_streaming.py
+
+Checks that the streaming, cached and indexed loaders of ParseTrakEM2
+give the same geometry as the DOM loader.
+
+"""
+import numpy as np
+import pytest
+
+from parsetrakem2.parse import ParseTrakEM2
+
+from conftest import CELLS, LAYERS
+
+MODES = [{'streaming':True},{'cache':True}]
+SUBSETS = [['rect'],['over','multi'],['diag','edge','rect']]
+
+def load(trakem2,**kwargs):
+    P = ParseTrakEM2(trakem2,**kwargs)
+    P.get_layers()
+    P.get_area_lists()
+    return P
+
+def boundary_records(B):
+    """
+    Returns the per boundary data of B with cell names instead of ids
+    """
+    names = [B.cells[c] for c in B.cell]
+    return (names,B.index.tolist(),B.coords,B.offsets,B.vertices,
+            B.vertex_offsets,B.area,B.bbox)
+
+def assert_boundaries_equal(A,B):
+    (ra,rb) = (boundary_records(A),boundary_records(B))
+    assert ra[:2] == rb[:2]
+    for (a,b) in zip(ra[2:],rb[2:]):
+        np.testing.assert_array_equal(a,b)
+
+def assert_same_project(P,Q,cells):
+    assert P.get_layer_dims() == Q.get_layer_dims()
+    assert sorted(P.get_layer_list()) == sorted(Q.get_layer_list())
+    for layer in LAYERS:
+        A = P.get_layer_boundaries(layer,area_thresh=0,scale_bounding_box=1.1,
+                                   area_lists=cells)
+        B = Q.get_layer_boundaries(layer,area_thresh=0,scale_bounding_box=1.1,
+                                   area_lists=cells)
+        assert len(A) > 0
+        assert_boundaries_equal(A,B)
+        assert ([c for c in P.get_layer_cells(layer) if c in cells]
+                == [c for c in Q.get_layer_cells(layer) if c in cells])
+    for c in cells:
+        assert P.get_cell_layers(c) == Q.get_cell_layers(c)
+        assert P.get_occupancy(c) == Q.get_occupancy(c)
+
+@pytest.mark.parametrize('mode',MODES)
+def test_all_cells(trakem2,mode):
+    P = load(trakem2)
+    Q = load(trakem2,**mode)
+    assert Q.xml is None
+    assert sorted(P.get_cells()) == sorted(Q.get_cells())
+    assert P.get_calibration() == Q.get_calibration()
+    assert_same_project(P,Q,list(CELLS))
+    #A second load reads the cache written by the first
+    Q = load(trakem2,**mode)
+    assert_same_project(P,Q,list(CELLS))
+
+@pytest.mark.parametrize('mode',MODES)
+@pytest.mark.parametrize('cells',SUBSETS)
+def test_cell_subsets(trakem2,mode,cells):
+    P = load(trakem2)
+    Q = load(trakem2,**mode)
+    assert_same_project(P,Q,cells)
+    #Loading only these cells through the byte offset index
+    R = load(trakem2,cells=cells)
+    assert sorted(R.get_cells()) == sorted(cells)
+    assert_same_project(P,R,cells)
+    for layer in LAYERS:
+        assert R.get_layer_cells(layer) == [c for c in P.get_layer_cells(layer)
+                                            if c in cells]
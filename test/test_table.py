@@ -0,0 +1,58 @@
+"""
+test_table.py
+
+Checks that columnar tables read back what was written.
+
+"""
+import os
+import sys
+import subprocess
+import numpy as np
+
+from parsetrakem2 import table
+from parsetrakem2.results import iter_adjacency
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RECORDS = [('L002','b','a',0,1,5),('L001','a','c',1,0,7),('L001','c','d',2,2,3),
+           ('L010','d','b',0,3,12)]
+
+def test_round_trip(tmp_path):
+    fname = str(tmp_path / 'adj.npz')
+    T = table.from_records(RECORDS,table.ADJACENCY_COLUMNS,
+                           categorical=['layer','cell1','cell2'],
+                           shared=['cell1','cell2'])
+    table.write_table(fname,T)
+    S = table.load_table(fname)
+    assert sorted(S) == sorted(T)
+    for k in T:
+        np.testing.assert_array_equal(S[k],T[k])
+    for c in table.ADJACENCY_COLUMNS[3:]:
+        assert S[c].dtype == np.int32
+    assert table.to_records(S,table.ADJACENCY_COLUMNS) == RECORDS
+    #Shared categories make cell codes comparable
+    np.testing.assert_array_equal(S['cell1.categories'],S['cell2.categories'])
+    assert S['cell1'][1] == S['cell2'][0]
+    assert S['cell1'][2] == S['cell2'][1]
+    assert table.decode(S,'cell2').tolist() == ['a','c','d','b']
+
+def test_empty_table(tmp_path):
+    fname = str(tmp_path / 'adj.npz')
+    T = table.from_records([],table.ADJACENCY_COLUMNS,
+                           categorical=['layer','cell1','cell2'],
+                           shared=['cell1','cell2'])
+    table.write_table(fname,T)
+    assert table.to_records(table.load_table(fname),table.ADJACENCY_COLUMNS) == []
+
+def test_matches_xml(trakem2,tmp_path):
+    #measure_adjacency.py -f both writes the same records to xml and npz
+    fout = str(tmp_path / 'adj.xml')
+    env = dict(os.environ,PYTHONPATH=ROOT)
+    subprocess.run([sys.executable,os.path.join(ROOT,'scripts','measure_adjacency.py'),
+                    trakem2,fout,'-f','both'],env=env,check=True,
+                   stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+    xml = [(r[0],r[1],r[2],int(r[3]),int(r[4]),int(r[5]))
+           for r in iter_adjacency(fout)]
+    T = table.load_table(str(tmp_path / 'adj.npz'))
+    assert len(xml) > 0
+    assert table.to_records(T,table.ADJACENCY_COLUMNS) == xml
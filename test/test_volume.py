@@ -0,0 +1,79 @@
+"""
+test_volume.py
+
+Checks region reads of ChunkedVolume against a dense array.
+
+"""
+import os
+import sys
+import glob
+import subprocess
+import numpy as np
+import pytest
+
+from parsetrakem2.volume import ChunkedVolume, COMPRESSORS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SHAPE = (11,37,29)
+CHUNKS = (4,16,8)
+
+def dense(seed=0):
+    rng = np.random.default_rng(seed)
+    D = rng.integers(1,60000,SHAPE).astype(np.uint16)
+    #Chunks that are never written read as the fill value
+    D[4:8,16:32,8:16] = 0
+    return D
+
+def write_volume(path,D,compressor):
+    V = ChunkedVolume.create(path,D.shape,CHUNKS,D.dtype,compressor=compressor)
+    for iz in range(V.grid[0]):
+        zs = V.chunk_slices((iz,0,0))[0]
+        V.write_slab(iz,D[zs])
+    return ChunkedVolume(path)
+
+@pytest.mark.parametrize('compressor',COMPRESSORS)
+def test_roi_reads(tmp_path,compressor):
+    D = dense()
+    V = write_volume(str(tmp_path / 'vol'),D,compressor)
+    assert V.shape == SHAPE and V.dtype == D.dtype
+    assert not V.has_chunk((1,1,1))
+    np.testing.assert_array_equal(V[:],D)
+    rng = np.random.default_rng(1)
+    for i in range(50):
+        lo = [int(rng.integers(0,s)) for s in SHAPE]
+        hi = [int(rng.integers(a,s + 1)) for (a,s) in zip(lo,SHAPE)]
+        key = tuple(slice(a,b) for (a,b) in zip(lo,hi))
+        np.testing.assert_array_equal(V[key],D[key])
+    for key in [(5,),(slice(2,9),-3),(-1,slice(None),7),(3,10,20),
+                (slice(None),slice(30,100),slice(-5,None)),(slice(8,2),)]:
+        np.testing.assert_array_equal(V[key],D[key])
+    with pytest.raises(IndexError):
+        V[SHAPE[0]]
+    with pytest.raises(IndexError):
+        V[::2]
+
+def test_chunk_shape(tmp_path):
+    V = ChunkedVolume.create(str(tmp_path / 'vol'),SHAPE,CHUNKS,np.uint8)
+    with pytest.raises(ValueError):
+        V.write_chunk((0,0,0),np.ones((4,16,7),dtype=np.uint8))
+    with pytest.raises(ValueError):
+        ChunkedVolume.create(str(tmp_path / 'vol2'),SHAPE,CHUNKS,np.uint8,
+                             compressor='lz4')
+
+def test_matches_slices(trakem2,tmp_path):
+    #extract_volumes.py --mode chunked writes the same labels as the slices
+    env = dict(os.environ,PYTHONPATH=ROOT)
+    script = os.path.join(ROOT,'scripts','extract_volumes.py')
+    dout = str(tmp_path / 'out') + '/'
+    for mode in ['slices','chunked']:
+        subprocess.run([sys.executable,script,trakem2,dout,'-t','0','-m',mode,
+                        '--chunks','1,32,32'],env=env,check=True,
+                       stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+    V = ChunkedVolume(os.path.join(dout,'volume'))
+    for f in glob.glob(os.path.join(dout,'JSH_slice_*.npz')):
+        z = int(f.split('_')[-1].split('.')[0])
+        S = np.load(f)['V']
+        assert S.any()
+        np.testing.assert_array_equal(V[z],S)
+        np.testing.assert_array_equal(V[z,40:70,10:90],S[40:70,10:90])